@@ -0,0 +1,82 @@
+"""
+    Masking of the first release (np.where on float64 volumes), the
+    reference of the masked images computed by functions.mask_volume
+
+    Main functions:
+        - extract_roi_by_label
+        - mask_baseline
+
+    ----- LICENSE -----
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License (GPL) as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version. For more detail see the
+    GNU General Public License at <http://www.gnu.org/licenses/>.
+    -----------------
+
+    Developed by A. Delphin, E. Gourieux, J. Pietras, L. Lamalle
+    May 2024
+"""
+
+import numpy as np
+
+
+def extract_roi_by_label(seg_volume, labels):
+    """
+    Extract ROI by label (functions.py as first released)
+
+        Parameters: 
+            seg_volume (a numpy array): array resulting from a segmentation, 
+                                        typically filled with regions identified
+                                        by numerical labels
+            labels (a list): list of the labels to extract (ex [181, 185])
+        Returns:
+            label_seg_volume (a numpy array): a volume of the same shape as seg_volume 
+                                containing only the regions corresponding
+                                to the integers in labels
+    """
+    label_seg_volume = None
+
+    for label in labels:
+        tmp_label_seg_volume = np.where(
+            seg_volume == int(label), int(label), 0
+        )
+        if label_seg_volume is None:
+            label_seg_volume = tmp_label_seg_volume > 0
+        label_seg_volume = np.where(
+            tmp_label_seg_volume > 0, tmp_label_seg_volume, label_seg_volume
+        )
+    return label_seg_volume
+
+
+def mask_baseline(in_array, mod_img_array, labels, series_info):
+    """
+    Masked image of main_processing as first released
+
+        Parameters:
+            in_array (a numpy array): float64 image, as read by xmlrec
+            mod_img_array (a numpy array): label volume, same orientation
+            labels (a list): labels to burn
+            series_info (a list): header of the image (window)
+        Returns:
+            out_array (a numpy array): float64 masked image
+    """
+    # Extract roi
+    extracted_roi = extract_roi_by_label(mod_img_array, labels)
+
+    # Mask image
+    # Needs scaling to have mask brighter than the image
+    max_value = np.max(in_array)
+    window_width = series_info[0]["Window Width"]["Value"]
+    window_center = series_info[0]["Window Center"]["Value"]
+    offset = 0.5 * window_width / (len(labels) + 1)
+    scaled_max = max_value - window_center
+    out_array = in_array * scaled_max / max_value
+
+    # Extract masks
+    for i in np.arange(len(labels)):
+        out_array = np.where(
+            extracted_roi == labels[i], window_center +
+            offset * (i + 2), out_array
+        )
+    return out_array
@@ -0,0 +1,389 @@
+"""
+    Benchmarks of the processing steps on synthetic PRIDE exports, without
+    patient data nor the Philips xmlrec.py (see standin/xmlrec.py)
+
+    python benchmarks/bench.py --sizes 128 256 512 --output results.json
+    python benchmarks/bench.py --baseline baseline.json
+    python benchmarks/bench.py --sizes 256 512 --workers 1 2 4 8
+
+    Each step is run --repeat times on each size, the best time is kept.
+    The masked image is also checked against the float64 computation
+    (before the dtype policy): the exit code is 1 when a REC value differs
+    by more than 1.
+    With --workers, extract_roi_by_label and the masking are also timed
+    with each number of threads (see functions.VolumeWorkers) and their
+    speedup over one thread is printed; the exit code is 1 when a result
+    differs from the one of one thread.
+    With --baseline, the results are compared to a previous run and the
+    exit code is 1 when a step is slower than --tolerance times its
+    baseline; --save-baseline writes the results as the new baseline.
+
+    ----- LICENSE -----
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License (GPL) as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version. For more detail see the
+    GNU General Public License at <http://www.gnu.org/licenses/>.
+    -----------------
+
+    Developed by A. Delphin, E. Gourieux, J. Pietras, L. Lamalle
+    May 2024
+"""
+
+import argparse
+import copy
+import datetime
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+CODE_DIR = os.path.join(os.path.dirname(BENCH_DIR), "segment-from-pride")
+STANDIN_DIR = os.path.join(BENCH_DIR, "standin")
+
+# labels burned by default by the CLI
+MASK_LABELS = [181, 185, 201, 207]
+
+
+def _setup_path(real_xmlrec):
+    """Make the module and the xmlrec stand-in importable"""
+    sys.path.insert(0, CODE_DIR)
+    if not real_xmlrec:
+        sys.path.insert(0, STANDIN_DIR)
+
+
+def _best(function, repeat):
+    """Best wall time (s) of repeat calls of function"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def rec_difference(in_array, seg_array, labels, series_info, dtypes=None):
+    """
+    Compare mask_volume to the masking of the first release (float64), in
+    REC values
+
+        Parameters:
+            in_array (a numpy array): float64 image, as read by xmlrec
+            seg_array (a numpy array): label volume
+            labels (a list): labels to burn
+            series_info (a list): header of the image
+            dtypes (a dictionary): "Image" and "Labels" dtypes of
+                                   mask_volume (default: functions.DTYPES)
+        Returns:
+            check (a dictionary): max_difference, different_voxels
+    """
+    import numpy as np
+    from baseline_masking import mask_baseline
+    from functions import DTYPES, mask_volume
+
+    dtypes = {**DTYPES, **(dtypes or {})}
+    reference = mask_baseline(
+        in_array, seg_array.astype(np.float64), labels, series_info
+    )
+    result = mask_volume(
+        in_array.astype(dtypes["Image"]), seg_array.astype(dtypes["Labels"]),
+        labels, series_info, dtypes["Image"]
+    )
+
+    def rec(volume):
+        return np.clip(np.rint(volume), 0, 65535).astype(np.int32)
+    difference = np.abs(rec(reference) - rec(result))
+    return {
+        "max_difference": int(difference.max()),
+        "different_voxels": int(np.count_nonzero(difference)),
+    }
+
+
+def bench_scaling(in_array, seg_array, labels, series_info, workers,
+                  repeat):
+    """
+    Time the slab-parallel volume steps with each number of threads
+
+        Parameters:
+            in_array (a numpy array): image
+            seg_array (a numpy array): label volume
+            labels (a list): labels extracted by extract_roi_by_label
+            series_info (a list): header of the image
+            workers (a list): numbers of threads
+            repeat (an integer): runs of each step
+        Returns:
+            scaling (a dictionary): threads -> step -> best time (s) and
+                                    speedup over one thread, "identical"
+                                    False if a result differs from the one
+                                    of one thread
+    """
+    import numpy as np
+    from functions import extract_roi_by_label, mask_volume
+
+    references = {
+        "extract_roi_by_label": extract_roi_by_label(seg_array, labels),
+        "masking": mask_volume(in_array, seg_array, MASK_LABELS, series_info),
+    }
+    steps = {
+        "extract_roi_by_label":
+            lambda count: extract_roi_by_label(seg_array, labels, count),
+        "masking": lambda count: mask_volume(
+            in_array, seg_array, MASK_LABELS, series_info, workers=count
+        ),
+    }
+    scaling = {}
+    for count in workers:
+        scaling[str(count)] = {"identical": True}
+        for step, function in steps.items():
+            scaling[str(count)][step] = _best(lambda: function(count), repeat)
+            if not np.array_equal(function(count), references[step]):
+                scaling[str(count)]["identical"] = False
+    base = scaling.get("1")
+    for count in scaling.values():
+        for step in steps:
+            if base is not None:
+                count["speedup_" + step] = base[step] / count[step]
+    return scaling
+
+
+def bench_size(size, work_dir, repeat, workers=()):
+    """
+    Time each step on a synthetic export of size^3 voxels
+
+        Parameters:
+            size (an integer): number of voxels along each axis
+            work_dir (a string): directory of the exports and outputs
+            repeat (an integer): runs of each step
+            workers (a list): numbers of threads of bench_scaling (empty:
+                              not run)
+        Returns:
+            timings (a dictionary): step -> best time (s)
+            check (a dictionary): see rec_difference
+            scaling (a dictionary): see bench_scaling
+    """
+    import nibabel as nib
+    import numpy as np
+    import xmlrec as xml
+    from functions import (
+        DTYPES,
+        extract_roi_by_label,
+        mask_volume,
+        write_nifti_slabs,
+        write_outputs,
+    )
+    from geometry import AXES, derive_header, reorient, slice_axes
+    from synthetic import STRUCTURE_LABELS, fake_segment, make_export
+    from xml2par import main_xml2par
+    from xmlheader import read_xml_header
+
+    case_dir = make_export(os.path.join(work_dir, f"case_{size}"), size)
+    out_dir = os.path.join(work_dir, f"out_{size}")
+    os.makedirs(out_dir, exist_ok=True)
+    path_to_xml = os.path.join(case_dir, "Sag", "IM_Sag.XML")
+    path_to_rec = os.path.splitext(path_to_xml)[0] + ".REC"
+    nifti_path = os.path.join(out_dir, "IM_Sag.nii")
+    timings = {}
+
+    timings["xml2par"] = _best(lambda: main_xml2par(path_to_xml), repeat)
+
+    def nifti():
+        write_nifti_slabs(nib.load(path_to_rec, mmap=True), nifti_path)
+    timings["nifti"] = _best(nifti, repeat)
+
+    seg_path = os.path.join(
+        out_dir, "native_structures_" + os.path.basename(nifti_path) + ".gz"
+    )
+    if not os.path.exists(seg_path):
+        fake_segment(nifti_path)
+    seg_array = np.transpose(
+        np.asarray(nib.load(seg_path).dataobj, dtype=DTYPES["Labels"]),
+        (1, 0, 2)
+    )
+
+    state = {}
+
+    def load():
+        images, general_info, series_info = xml.read_xmlrec(path_to_xml)
+        state["in_array"] = np.squeeze(
+            xml.to_nd_array(images, general_info, series_info)
+        ).astype(DTYPES["Image"], copy=False)
+        state["series_info"] = series_info
+    timings["load"] = _best(load, repeat)
+
+    labels = [int(label) for label in STRUCTURE_LABELS]
+    timings["extract_roi_by_label"] = _best(
+        lambda: extract_roi_by_label(seg_array, labels), repeat
+    )
+
+    def masking():
+        state["out_array"] = mask_volume(
+            state["in_array"], seg_array, MASK_LABELS, state["series_info"]
+        )
+    timings["masking"] = _best(masking, repeat)
+    images, general_info, series_info = xml.read_xmlrec(path_to_xml)
+    check = rec_difference(
+        np.squeeze(xml.to_nd_array(images, general_info, series_info)),
+        seg_array, MASK_LABELS, series_info
+    )
+    scaling = {}
+    if workers:
+        scaling = bench_scaling(state["in_array"], seg_array, labels,
+                                state["series_info"], workers, repeat)
+
+    general_info, series_info = read_xml_header(path_to_xml)
+    sag_axes = slice_axes(series_info)
+    headers = {"Sagittal": (general_info, series_info)}
+    for orientation in ("Coronal", "Transversal"):
+        headers[orientation] = derive_header(
+            general_info, series_info, sag_axes, orientation
+        )
+
+    def writers():
+        write_outputs(out_dir, [
+            (orientation,
+             reorient(state["out_array"], sag_axes, AXES[orientation]),
+             *copy.deepcopy(header))
+            for orientation, header in headers.items()
+        ])
+    timings["writers"] = _best(writers, repeat)
+    return timings, check, scaling
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print the ratio of each step to its baseline
+
+        Parameters:
+            results (a dictionary): see main_bench
+            baseline (a dictionary): previous results
+            tolerance (a float): ratio above which a step is a regression
+        Returns:
+            regressions (a list): (size, step, ratio)
+    """
+    regressions = []
+    for size, timings in results["results"].items():
+        for step, seconds in timings.items():
+            reference = baseline["results"].get(size, {}).get(step)
+            if not reference:
+                continue
+            ratio = seconds / reference
+            flag = ""
+            if ratio > tolerance:
+                regressions.append((size, step, ratio))
+                flag = "  REGRESSION"
+            print(f"{size:>5} {step:<22}{reference:9.3f} ->{seconds:9.3f} s"
+                  f"  x{ratio:.2f}{flag}")
+    return regressions
+
+
+def main_bench():
+    """
+    Benchmark CLI
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark the processing steps on synthetic exports"
+    )
+    parser.add_argument(
+        "--sizes", type=int, nargs="*", default=[128, 256, 512],
+        help="Volume sizes (voxels along each axis)",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Runs of each step"
+    )
+    parser.add_argument(
+        "--work-dir",
+        default=os.path.join(tempfile.gettempdir(), "segment-from-pride-bench"),
+        help="Directory of the synthetic exports (kept between runs)",
+    )
+    parser.add_argument("--output", help="JSON file of the results")
+    parser.add_argument("--baseline", help="JSON baseline to compare to")
+    parser.add_argument(
+        "--save-baseline", action="store_true",
+        help="Write the results to --baseline",
+    )
+    parser.add_argument(
+        "--tolerance", type=float, default=1.25,
+        help="Slowdown ratio reported as a regression",
+    )
+    parser.add_argument(
+        "--real-xmlrec", action="store_true",
+        help="Use the Philips xmlrec.py instead of the stand-in",
+    )
+    parser.add_argument(
+        "--workers", type=int, nargs="*", default=[],
+        help="Threads of the slab-parallel steps to compare (ex 1 2 4 8)",
+    )
+    args = parser.parse_args()
+    _setup_path(args.real_xmlrec)
+    import nibabel
+    import numpy
+
+    results = {
+        "meta": {
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "numpy": numpy.__version__,
+            "nibabel": nibabel.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "xmlrec": "philips" if args.real_xmlrec else "stand-in",
+            "repeat": args.repeat,
+        },
+        "results": {},
+        "checks": {},
+        "scaling": {},
+    }
+    for size in args.sizes:
+        print(f"Size {size}^3")
+        timings, check, scaling = bench_size(
+            size, args.work_dir, args.repeat, args.workers
+        )
+        for step, seconds in timings.items():
+            print(f"    {step:<22}{seconds:9.3f} s")
+        print(f"    masked image vs first release: max difference "
+              f"{check['max_difference']}, {check['different_voxels']} voxels")
+        results["results"][str(size)] = timings
+        results["checks"][str(size)] = check
+        for count, steps in scaling.items():
+            print(f"    {count:>2} threads:"
+                  + "".join(f"  {step} {steps[step]:.3f} s"
+                            f" (x{steps.get('speedup_' + step, 1):.2f})"
+                            for step in ("extract_roi_by_label", "masking"))
+                  + ("" if steps["identical"] else "  DIFFERENT RESULT"))
+        if scaling:
+            results["scaling"][str(size)] = scaling
+
+    failed = [size for size, check in results["checks"].items()
+              if check["max_difference"] > 1]
+    if failed:
+        print(f"Masked image differs from the float64 one: {failed}")
+    different = [size for size, scaling in results["scaling"].items()
+                 if not all(steps["identical"] for steps in scaling.values())]
+    if different:
+        print(f"Threaded results differ from one thread: {different}")
+        failed += different
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as my_json:
+            json.dump(results, my_json, indent=4)
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as my_json:
+            json.dump(results, my_json, indent=4)
+        print(f"Baseline written to {args.baseline}")
+    elif args.baseline:
+        with open(args.baseline, encoding="utf-8") as my_json:
+            baseline = json.load(my_json)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regressions")
+            sys.exit(1)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,75 @@
+"""
+    Minimal stand-in for the Philips xmlrec.py, for the benchmarks and the
+    tests only: same functions as used by segment-from-pride, on top of
+    xmlheader and of the writer of the synthetic exports. Its volumes are
+    the stored pixel values of the REC (the rescaling of the real xmlrec
+    is not reproduced), which is enough for synthetic exports with a
+    rescale slope of 1 and an intercept of 0.
+
+    Main functions:
+        - read_xmlrec
+        - to_nd_array
+        - write_xmlrec
+
+    ----- LICENSE -----
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License (GPL) as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version. For more detail see the
+    GNU General Public License at <http://www.gnu.org/licenses/>.
+    -----------------
+
+    Developed by A. Delphin, E. Gourieux, J. Pietras, L. Lamalle
+    May 2024
+"""
+
+import os
+import numpy as np
+
+from xml2par import find_info
+from synthetic import write_export_xmlrec
+from xmlheader import read_xml_header
+
+
+def read_xmlrec(path_to_xml):
+    """
+    Read an XML/REC pair
+
+        Parameters:
+            path_to_xml (a string): XML path
+        Returns:
+            images (a numpy array): REC images (images, rows, columns),
+                                    memory-mapped
+            general_info (a dictionary): see xmlheader.read_xml_header
+            series_info (a list): see xmlheader.read_xml_header
+    """
+    general_info, series_info = read_xml_header(path_to_xml)
+    rows = int(find_info(series_info[0], "Resolution Y"))
+    columns = int(find_info(series_info[0], "Resolution X"))
+    bits = int(find_info(series_info[0], "Pixel Size"))
+    images = np.memmap(
+        os.path.splitext(path_to_xml)[0] + ".REC",
+        dtype=f"<u{bits // 8}",
+        mode="r",
+        shape=(len(series_info), rows, columns),
+    )
+    return images, general_info, series_info
+
+
+def to_nd_array(images, general_info, series_info):
+    """
+    Images as a volume (rows, columns, slices) of stored pixel values
+
+        Parameters:
+            images, general_info, series_info: see read_xmlrec
+        Returns:
+            a float64 numpy array
+    """
+    return np.transpose(images, (1, 2, 0)).astype(np.float64)
+
+
+def write_xmlrec(path_to_xml, general_info, series_info, volume):
+    """
+    Write an XML/REC pair (see synthetic.write_export_xmlrec)
+    """
+    write_export_xmlrec(path_to_xml, general_info, series_info, volume)
@@ -0,0 +1,116 @@
+"""
+    Startup benchmark of the command line, from python -X importtime
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --target-ms 250 --repeat 5
+
+    Two paths are measured: "help" (main.py --help, nothing but argparse
+    should be imported) and "headless" (the modules imported by the
+    command line before the processing starts: cli and functions). The
+    import time of each path is the best of --repeat runs; the exit code
+    is 1 when the headless path is above --target-ms or when a path
+    imports a module it must not (Qt, nibabel, xmlrec).
+
+    ----- LICENSE -----
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License (GPL) as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version. For more detail see the
+    GNU General Public License at <http://www.gnu.org/licenses/>.
+    -----------------
+
+    Developed by A. Delphin, E. Gourieux, J. Pietras, L. Lamalle
+    May 2024
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+CODE_DIR = os.path.join(os.path.dirname(BENCH_DIR), "segment-from-pride")
+
+# modules imported lazily: they must not be imported at startup
+LAZY_MODULES = ("PyQt5", "nibabel", "xmlrec")
+PATHS = {
+    "help": [os.path.join(CODE_DIR, "main.py"), "--help"],
+    "headless": ["-c", "import cli, functions"],
+}
+
+
+def import_times(args):
+    """
+    Run python -X importtime
+
+        Parameters:
+            args (a list): python arguments
+        Returns:
+            modules (a dictionary): module -> (self, cumulative) time (us),
+                                    in import order
+            total (an integer): cumulative time of the top-level imports (us)
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime"] + args,
+        cwd=CODE_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    modules = {}
+    total = 0
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+        # top-level imports are not indented
+        if not name[1:].startswith(" "):
+            total += int(cumulative_us)
+    return modules, total
+
+
+def main_startup():
+    """
+    Startup benchmark CLI
+    """
+    parser = argparse.ArgumentParser(
+        description="Import time of the command line"
+    )
+    parser.add_argument(
+        "--target-ms", type=float, default=250,
+        help="Import time target of the headless path (ms)",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="Runs of each path"
+    )
+    parser.add_argument(
+        "--top", type=int, default=8, help="Slowest imports listed"
+    )
+    args = parser.parse_args()
+
+    failed = False
+    for path, python_args in PATHS.items():
+        runs = [import_times(python_args) for _ in range(args.repeat)]
+        modules, total = min(runs, key=lambda run: run[1])
+        print(f"{path:<10}{total / 1000:9.1f} ms, {len(modules)} modules")
+        slowest = sorted(
+            modules.items(), key=lambda item: item[1][1], reverse=True
+        )
+        for name, (_, cumulative_us) in slowest[:args.top]:
+            print(f"    {name:<40}{cumulative_us / 1000:9.1f} ms")
+        lazy = sorted({name.split(".")[0] for name in modules} &
+                      set(LAZY_MODULES))
+        if lazy:
+            print(f"    imports {', '.join(lazy)} at startup")
+            failed = True
+        if path == "headless" and total / 1000 > args.target_ms:
+            print(f"    above the target of {args.target_ms:.0f} ms")
+            failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_startup()
@@ -0,0 +1,309 @@
+"""
+    Synthetic PRIDE exports for the benchmarks and the tests: cubic
+    Sag/Cor/Tra XML/REC of an ellipsoid phantom with a consistent geometry,
+    and a stand-in segmenter writing AssemblyNet-like label volumes with
+    many labels
+
+    Main functions:
+        - make_export
+        - write_export_xmlrec
+        - fake_segment
+
+    ----- LICENSE -----
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License (GPL) as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version. For more detail see the
+    GNU General Public License at <http://www.gnu.org/licenses/>.
+    -----------------
+
+    Developed by A. Delphin, E. Gourieux, J. Pietras, L. Lamalle
+    May 2024
+"""
+
+import os
+from xml.sax.saxutils import escape, quoteattr
+import nibabel as nib
+import numpy as np
+
+from geometry import AXES, DIRECTIONS, derive_header, reorient, rotation
+from xml2par import find_info
+
+# labels of the fake segmentation (AssemblyNet structure labels range)
+STRUCTURE_LABELS = np.arange(4, 208, dtype=np.uint16)
+PARCEL_SIZE = 16
+CENTRE = (3.2, 10.1, -0.5)
+ANGULATION = (0.1, -2.3, 1.5)
+# attributes of the Key element of an Image_Info, in this order
+KEY_ATTRIBUTES = (
+    "Slice", "Echo", "Dynamic", "Phase", "BValue", "Grad Orient",
+    "Label Type", "Type", "Sequence", "Index",
+)
+
+
+def _entry(xml_type, value, array_size=None):
+    """Header entry as read by xmlheader.read_xml_header"""
+    entry = {"Type": xml_type, "Value": value}
+    if array_size is not None:
+        entry["ArraySize"] = str(array_size)
+        entry["Value"] = np.array(value, dtype=float)
+    return entry
+
+
+def sagittal_header(size):
+    """
+    Header of a cubic sagittal volume of 1 mm voxels
+
+        Parameters:
+            size (an integer): number of voxels along each axis
+        Returns:
+            general_info (a dictionary), series_info (a list): see
+            xmlheader.read_xml_header
+    """
+    general_info = {
+        "Patient Name": _entry("String", "PHANTOM"),
+        "Examination Name": _entry("String", "Benchmark"),
+        "Protocol Name": _entry("String", "T1W_3D"),
+        "Examination Date": _entry("String", "2024.05.01"),
+        "Examination Time": _entry("String", "10:11:12"),
+        "Aquisition Number": _entry("Int32", 3),
+        "Reconstruction Number": _entry("Int32", 1),
+        "Scan Duration": _entry("Double", 312.4),
+        "Max No Phases": _entry("Int32", 1),
+        "Max No Echoes": _entry("Int32", 1),
+        "Max No Slices": _entry("Int32", size),
+        "Max No Dynamics": _entry("Int32", 1),
+        "Max No Mixes": _entry("Int32", 1),
+        "Patient Position": _entry("String", "HFS"),
+        "Preparation Direction": _entry("String", "AP"),
+        "Technique": _entry("String", "T1TFE"),
+        "Scan Resolution X": _entry("Int32", size),
+        "Scan Resolution Y": _entry("Int32", size),
+        "Scan Mode": _entry("String", "3D"),
+        "Repetition Times": _entry("Double", [7.5, 0], 2),
+        "FOV AP": _entry("Double", float(size)),
+        "FOV FH": _entry("Double", float(size)),
+        "FOV RL": _entry("Double", float(size)),
+        "Water Fat Shift": _entry("Double", 1.2),
+        "Angulation AP": _entry("Double", ANGULATION[0]),
+        "Angulation FH": _entry("Double", ANGULATION[1]),
+        "Angulation RL": _entry("Double", ANGULATION[2]),
+        "Off Center AP": _entry("Double", CENTRE[0]),
+        "Off Center FH": _entry("Double", CENTRE[1]),
+        "Off Center RL": _entry("Double", CENTRE[2]),
+        "Flow Compensation": _entry("Boolean", False),
+        "Presaturation": _entry("Boolean", True),
+        "Phase Encoding Velocity": _entry("Double", [0, 0, 0], 3),
+        "MTC": _entry("Boolean", False),
+        "SPIR": _entry("Boolean", False),
+        "EPI factor": _entry("Int32", 1),
+        "Dynamic Scan": _entry("Boolean", False),
+        "Diffusion": _entry("Boolean", False),
+        "Diffusion Echo Time": _entry("Double", 0.0),
+        "Max No B Values": _entry("Int32", 1),
+        "Max No Gradient Orients": _entry("Int32", 1),
+        "No Label Types": _entry("Int32", 0),
+    }
+    rot = rotation(general_info)
+    centre = np.array(CENTRE)
+    series_info = []
+    for index in range(size):
+        offcentre = centre + (index - (size - 1) / 2) \
+            * (rot @ DIRECTIONS[AXES["Sagittal"][2]])
+        series_info.append({
+            "Slice": _entry("Int32", index + 1),
+            "Echo": _entry("Int32", 1),
+            "Dynamic": _entry("Int32", 1),
+            "Phase": _entry("Int32", 1),
+            "BValue": _entry("Int32", 1),
+            "Grad Orient": _entry("Int32", 1),
+            "Label Type": _entry("String", "-"),
+            "Type": _entry("String", "M"),
+            "Sequence": _entry("String", "FFE"),
+            "Index": _entry("Int32", index),
+            "Pixel Size": _entry("Int32", 16),
+            "Scan Percentage": _entry("Double", 100.0),
+            "Resolution X": _entry("Int32", size),
+            "Resolution Y": _entry("Int32", size),
+            "Rescale Intercept": _entry("Double", 0.0),
+            "Rescale Slope": _entry("Double", 1.0),
+            "Scale Slope": _entry("Double", 0.012),
+            "Window Center": _entry("Double", 1000.0),
+            "Window Width": _entry("Double", 2000.0),
+            "Angulation AP": _entry("Double", ANGULATION[0]),
+            "Angulation FH": _entry("Double", ANGULATION[1]),
+            "Angulation RL": _entry("Double", ANGULATION[2]),
+            "Offcenter AP": _entry("Double", offcentre[0]),
+            "Offcenter FH": _entry("Double", offcentre[1]),
+            "Offcenter RL": _entry("Double", offcentre[2]),
+            "Slice Thickness": _entry("Double", 1.0),
+            "Slice Gap": _entry("Double", 0.0),
+            "Display Orientation": _entry("String", "NONE"),
+            "Slice Orientation": _entry("String", "Sagittal"),
+            "fMRI Status Indication": _entry("Int32", 0),
+            "Image Type Ed Es": _entry("String", "U"),
+            "Pixel Spacing": _entry("Double", [1, 1], 2),
+            "Echo Time": _entry("Double", 3.2),
+            "Dyn Scan Begin Time": _entry("Double", 0.0),
+            "Trigger Time": _entry("Double", 0.0),
+            "Diffusion B Factor": _entry("Double", 0.0),
+            "No Averages": _entry("Double", 1.0),
+            "Image Flip Angle": _entry("Double", 8.0),
+            "Cardiac Frequency": _entry("Int32", 0),
+            "Min RR Interval": _entry("Int32", 0),
+            "Max RR Interval": _entry("Int32", 0),
+            "TURBO Factor": _entry("Int32", 240),
+            "Inversion Delay": _entry("Double", 0.0),
+            "Contrast Type": _entry("String", "T1"),
+            "Diffusion Anisotropy Type": _entry("String", "-"),
+            "Diffusion AP": _entry("Double", 0.0),
+            "Diffusion FH": _entry("Double", 0.0),
+            "Diffusion RL": _entry("Double", 0.0),
+        })
+    return general_info, series_info
+
+
+def phantom(size, seed=0):
+    """
+    Ellipsoid phantom with noise (rows, columns, slices), uint16
+
+        Parameters:
+            size (an integer): number of voxels along each axis
+            seed (an integer): noise seed
+    """
+    rng = np.random.default_rng(seed)
+    rows, columns = np.mgrid[:size, :size] / size - 0.5
+    volume = np.empty((size, size, size), dtype=np.uint16)
+    for index in range(size):
+        radius = np.sqrt((rows / 0.45) ** 2 + (columns / 0.4) ** 2
+                         + ((index / size - 0.5) / 0.35) ** 2)
+        volume[:, :, index] = (
+            np.clip(1 - radius, 0, 1) * 2000
+            + rng.integers(0, 50, (size, size))
+        )
+    return volume
+
+
+def _attribute_xml(name, info):
+    """Attribute element of a header entry (see xmlheader.read_xml_header)"""
+    attributes = "".join(
+        f" {key}={quoteattr(str(value))}"
+        for key, value in info.items() if key != "Value"
+    )
+    text = escape(find_info({name: info}, name))
+    return f"<Attribute Name={quoteattr(name)}{attributes}>{text}</Attribute>\n"
+
+
+def write_export_xmlrec(path_to_xml, general_info, series_info, volume):
+    """
+    Write the XML/REC pair of a synthetic export, one slice at a time. The
+    values are the stored pixel values of the REC (no rescaling, the
+    synthetic exports have a rescale slope of 1 and an intercept of 0),
+    rounded and clipped to its pixel size.
+
+        Parameters:
+            path_to_xml (a string): XML path, the REC is written next to it
+            general_info (a dictionary): see xmlheader.read_xml_header
+            series_info (a list): see xmlheader.read_xml_header, one image
+                                  per slice
+            volume (a 3D array): image (rows, columns, slices)
+    """
+    if len(series_info) != volume.shape[2]:
+        raise ValueError(
+            f"{len(series_info)} images in the header for "
+            f"{volume.shape[2]} slices"
+        )
+    bits = int(find_info(series_info[0], "Pixel Size") or 16)
+    rec_dtype = np.dtype(f"<u{bits // 8}")
+    rec_max = np.iinfo(rec_dtype).max
+
+    path_to_rec = os.path.splitext(path_to_xml)[0] + ".REC"
+    with open(path_to_xml, "w", encoding="utf-8") as xml_file, \
+            open(path_to_rec, "wb") as rec_file:
+        xml_file.write('<?xml version="1.0" encoding="UTF-8"?>\n<PRIDE_V5>\n')
+        xml_file.write("<Series_Info>\n")
+        xml_file.writelines(
+            _attribute_xml(name, info) for name, info in general_info.items()
+        )
+        xml_file.write("</Series_Info>\n<Image_Array>\n")
+        for index, image_info in enumerate(series_info):
+            rec_slice = np.clip(np.rint(volume[:, :, index]), 0, rec_max)
+            rec_file.write(rec_slice.astype(rec_dtype).tobytes())
+
+            xml_file.write("<Image_Info>\n<Key>\n")
+            xml_file.writelines(
+                _attribute_xml(name, image_info[name])
+                for name in KEY_ATTRIBUTES if name in image_info
+            )
+            xml_file.write("</Key>\n")
+            xml_file.writelines(
+                _attribute_xml(name, info)
+                for name, info in image_info.items()
+                if name not in KEY_ATTRIBUTES
+            )
+            xml_file.write("</Image_Info>\n")
+        xml_file.write("</Image_Array>\n</PRIDE_V5>\n")
+
+
+def make_export(root_dir, size):
+    """
+    Write a synthetic PRIDE export: root_dir/Sag, Cor and Tra with one
+    XML/REC pair each (skipped if already there)
+
+        Parameters:
+            root_dir (a string): case directory
+            size (an integer): number of voxels along each axis
+        Returns:
+            root_dir (a string)
+    """
+    names = {"Sagittal": "Sag", "Coronal": "Cor", "Transversal": "Tra"}
+    paths = {
+        orientation: os.path.join(root_dir, export, f"IM_{export}.XML")
+        for orientation, export in names.items()
+    }
+    if all(os.path.exists(os.path.splitext(path)[0] + ".REC")
+           for path in paths.values()):
+        return root_dir
+    volume = phantom(size)
+    general_info, series_info = sagittal_header(size)
+    for orientation, path in paths.items():
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if orientation == "Sagittal":
+            header = (general_info, series_info)
+        else:
+            header = derive_header(general_info, series_info,
+                                   AXES["Sagittal"], orientation)
+        write_export_xmlrec(
+            path, *header,
+            reorient(volume, AXES["Sagittal"], AXES[orientation])
+        )
+    return root_dir
+
+
+def fake_segment(nifti_path):
+    """
+    Stand-in for AssemblyNet: writes a native_structures_*.nii.gz label
+    volume next to the input, the phantom being cut into parcels with many
+    different labels
+
+        Parameters:
+            nifti_path (a string): NIfTI path
+        Returns:
+            seg_path (a string): label volume path
+    """
+    img = nib.load(nifti_path)
+    shape = img.shape[:3]
+    seg = np.zeros(shape, dtype=np.uint16)
+    i, j = np.mgrid[:shape[0], :shape[1]] // PARCEL_SIZE
+    for k in range(shape[2]):
+        data = np.asanyarray(img.dataobj[..., k])
+        parcel = (i + 7 * j + 13 * (k // PARCEL_SIZE)) % len(STRUCTURE_LABELS)
+        seg[..., k] = np.where(data > 500, STRUCTURE_LABELS[parcel], 0)
+    seg_path = os.path.join(
+        os.path.dirname(nifti_path),
+        "native_structures_" + os.path.basename(nifti_path) + ".gz"
+    )
+    seg_img = nib.Nifti1Image(seg, img.affine)
+    seg_img.set_data_dtype(np.uint16)
+    seg_img.to_filename(seg_path)
+    return seg_path
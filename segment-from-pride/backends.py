@@ -0,0 +1,477 @@
+"""
+    Segmentation backends: the AssemblyNet docker, a local executable, a
+    pool of processes running a Python segmenter, or the warm worker of
+    worker.py. Each backend segments NIfTI files in the background
+    (submit), tells whether a job is finished (poll) and gives the path of
+    its label volume (result), so that several segmentations can run at
+    the same time.
+
+    A label volume is written next to its NIfTI file, named as by
+    AssemblyNet (native_structures_<name>.nii.gz, see label_path).
+
+    Main classes:
+        - DockerBackend
+        - ExecutableBackend
+        - ProcessPoolBackend
+        - SpoolBackend
+
+    Main functions:
+        - backend_from_config
+
+    ----- LICENSE -----
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License (GPL) as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version. For more detail see the
+    GNU General Public License at <http://www.gnu.org/licenses/>.
+    -----------------
+
+    Developed by A. Delphin, E. Gourieux, J. Pietras, L. Lamalle
+    May 2024
+"""
+
+import collections
+import importlib
+import json
+import os
+import subprocess
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from instrument import watch_container
+from worker import JOB_TIMEOUT, segment_warm
+
+ASSEMBLYNET_IMAGE = "volbrain/assemblynet:1.0.0"
+# lines of the segmenter output kept for the error message of a failed job
+LOG_TAIL = 50
+
+
+class SegmentationError(RuntimeError):
+    """Raised by a job whose segmenter failed"""
+
+
+def label_path(nifti_path):
+    """Path of the label volume of a NIfTI file"""
+    return os.path.join(
+        os.path.dirname(nifti_path),
+        "native_structures_" + os.path.basename(nifti_path) + ".gz"
+    )
+
+
+def _checked_label_path(nifti_path):
+    """label_path, SegmentationError if the segmenter did not write it"""
+    path = label_path(nifti_path)
+    if not os.path.exists(path):
+        raise SegmentationError(f"No label volume written for {nifti_path}")
+    return path
+
+
+class Job:
+    """
+    A segmentation submitted to a backend
+    """
+
+    def __init__(self, nifti_path):
+        """
+            Parameters:
+                nifti_path (a string): NIfTI path
+        """
+        self.nifti_path = nifti_path
+        self.log = collections.deque(maxlen=LOG_TAIL)
+        self.returncode = None
+        self.future = None
+
+
+class Backend:
+    """
+    Base class of the backends: subclasses implement _run, which segments
+    one NIfTI file and returns the path of its label volume
+    """
+
+    # stage of the records of the jobs (see instrument.Recorder.add)
+    stage = "segmentation_job"
+    # runs the jobs, max_workers=jobs
+    _executor_class = ThreadPoolExecutor
+
+    def __init__(self, tag, jobs=1):
+        """
+            Parameters:
+                tag (a string): identifies the segmenter in the cache keys
+                                and the stage checkpoints
+                jobs (an integer): segmentations run at the same time
+        """
+        self.tag = tag
+        self.jobs = max(int(jobs), 1)
+        self.executor = self._executor_class(max_workers=self.jobs)
+        self._lock = threading.Lock()
+
+    def reserve(self, jobs):
+        """
+        Let at least jobs segmentations run at the same time, e.g. the
+        concurrent segmentations of a batch (the executor only grows, the
+        jobs already submitted keep running)
+
+            Parameters:
+                jobs (an integer): segmentations run at the same time
+        """
+        with self._lock:
+            if jobs <= self.jobs:
+                return
+            previous = self.executor
+            self.jobs = jobs
+            self.executor = self._executor_class(max_workers=jobs)
+        previous.shutdown(wait=False)
+
+    def submit(self, nifti_path, log=None, cancel=None, usage=None):
+        """
+        Start segmenting a NIfTI file
+
+            Parameters:
+                nifti_path (a string): NIfTI path
+                log (a function): called with each line of the segmenter
+                                  output
+                cancel (a threading.Event): stops the segmentation when set
+                usage (a dictionary): filled with the resource use of the
+                                      job, None to not measure it
+            Returns:
+                job (a Job): see poll and result
+        """
+        job = Job(nifti_path)
+        job.future = self.executor.submit(
+            self._run, job, log, cancel, usage
+        )
+        return job
+
+    @staticmethod
+    def poll(job):
+        """True when the job is finished (successfully or not)"""
+        return job.future.done()
+
+    @staticmethod
+    def result(job, timeout=None):
+        """
+        Wait for a job
+
+            Parameters:
+                job (a Job): see submit
+                timeout (a float): seconds to wait (None: no limit)
+            Returns:
+                path (a string): label volume path
+        """
+        return job.future.result(timeout)
+
+    def segment(self, nifti_path, log=None, cancel=None, usage=None):
+        """submit then result"""
+        return self.result(self.submit(nifti_path, log, cancel, usage))
+
+    def _run(self, job, log, cancel, usage):
+        raise NotImplementedError
+
+    def _run_command(self, job, cmd, log, cancel, stop):
+        """
+        Run a segmentation command, its output is printed, passed to log
+        and kept in job.log
+
+            Parameters:
+                job (a Job): job of the command
+                cmd (a list): command
+                log (a function): see submit
+                cancel (a threading.Event): see submit
+                stop (a function): called with the process when cancel
+                                   is set
+        """
+        print(cmd)
+        process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            universal_newlines=True,
+            bufsize=1,
+        )
+        finished = threading.Event()
+        if cancel is not None:
+            threading.Thread(
+                target=_stop_on_cancel,
+                args=(process, stop, cancel, finished),
+                daemon=True,
+            ).start()
+        try:
+            for line in process.stdout:
+                print(line, end="")
+                job.log.append(line.rstrip())
+                if log is not None:
+                    log(line.rstrip())
+            job.returncode = process.wait()
+        finally:
+            finished.set()
+        if cancel is not None and cancel.is_set():
+            raise SegmentationError("Segmentation cancelled")
+        if job.returncode != 0:
+            raise SegmentationError(
+                f"Segmentation of {job.nifti_path} failed (exit code "
+                f"{job.returncode}):\n" + "\n".join(job.log)
+            )
+
+
+def _stop_on_cancel(process, stop, cancel, finished):
+    """Call stop(process) if cancel is set before finished is"""
+    while not finished.is_set():
+        if cancel.wait(0.5) and not finished.is_set():
+            stop(process)
+            return
+
+
+class _Done:
+    """is_set of a future, as for the Event of _stop_on_cancel"""
+
+    def __init__(self, future):
+        self.future = future
+
+    def is_set(self):
+        return self.future.done()
+
+
+class DockerBackend(Backend):
+    """
+    AssemblyNet docker (https://github.com/volBrain/AssemblyNet), one
+    container per job
+    """
+
+    stage = "docker"
+
+    def __init__(self, image=ASSEMBLYNET_IMAGE, jobs=1):
+        """
+            Parameters:
+                image (a string): AssemblyNet docker image
+                jobs (an integer): containers run at the same time
+        """
+        super().__init__(image, jobs)
+        self.image = image
+
+    def _run(self, job, log, cancel, usage):
+        print("Launch assemblynet")
+        in_directory = os.path.dirname(os.path.realpath(job.nifti_path))
+        container_name = "assemblynet_" + uuid.uuid4().hex[:12]
+        cmd = [
+            "docker",
+            "run",
+            "--rm",
+            "--name",
+            container_name,
+            "--user",
+            f"{os.getuid()}:{os.getgid()}",
+            "-v",
+            in_directory + ":/data",
+            self.image,
+            "/data/" + os.path.basename(job.nifti_path)
+        ]
+
+        def stop(process):
+            print(f"Stopping {container_name}")
+            subprocess.run(
+                ["docker", "stop", container_name],
+                stdout=subprocess.DEVNULL,
+                check=False,
+            )
+
+        if usage is not None:
+            stop_watching = threading.Event()
+            watcher = threading.Thread(
+                target=watch_container,
+                args=(container_name, usage, stop_watching),
+                daemon=True,
+            )
+            watcher.start()
+        try:
+            self._run_command(job, cmd, log, cancel, stop)
+        finally:
+            if usage is not None:
+                stop_watching.set()
+                watcher.join()
+        return _checked_label_path(job.nifti_path)
+
+
+class ExecutableBackend(Backend):
+    """
+    Local segmentation executable, without docker: the command must write
+    the label volume next to its input (see label_path)
+    """
+
+    def __init__(self, command, jobs=1, tag=None):
+        """
+            Parameters:
+                command (a list): segmentation command, "{input}" is
+                                  replaced by the NIfTI path and
+                                  "{output}" by the label volume path
+                jobs (an integer): commands run at the same time
+                tag (a string): see Backend (default: the command)
+        """
+        super().__init__(tag or json.dumps(command), jobs)
+        self.command = command
+
+    def _run(self, job, log, cancel, usage):
+        cmd = [
+            arg.replace("{input}", job.nifti_path)
+            .replace("{output}", label_path(job.nifti_path))
+            for arg in self.command
+        ]
+        self._run_command(
+            job, cmd, log, cancel, lambda process: process.terminate()
+        )
+        return _checked_label_path(job.nifti_path)
+
+
+def _segment_in_process(function_name, nifti_path):
+    """
+    Run a Python segmenter in a pool process
+
+        Parameters:
+            function_name (a string): "module:function", called with the
+                                      NIfTI path, returns the label volume
+                                      path, the label array (written as
+                                      label_path) or None if it wrote
+                                      label_path itself
+            nifti_path (a string): NIfTI path
+        Returns:
+            path (a string): label volume path
+    """
+    module_name, name = function_name.split(":")
+    function = getattr(importlib.import_module(module_name), name)
+    labels = function(nifti_path)
+    if labels is None:
+        return _checked_label_path(nifti_path)
+    if isinstance(labels, str):
+        return labels
+    import nibabel as nib
+    import numpy as np
+
+    labels = np.asarray(labels, dtype=np.uint16)
+    seg_img = nib.Nifti1Image(labels, nib.load(nifti_path).affine)
+    seg_img.set_data_dtype(np.uint16)
+    seg_img.to_filename(label_path(nifti_path))
+    return label_path(nifti_path)
+
+
+class ProcessPoolBackend(Backend):
+    """
+    Python segmenter run in a pool of processes, without docker: several
+    segmentations at the same time on a large CPU node
+    """
+
+    _executor_class = ProcessPoolExecutor
+
+    def __init__(self, function_name, jobs=None, tag=None):
+        """
+            Parameters:
+                function_name (a string): see _segment_in_process
+                jobs (an integer): processes (default: one per core)
+                tag (a string): see Backend (default: function_name)
+        """
+        super().__init__(tag or function_name, jobs or os.cpu_count() or 1)
+        self.function_name = function_name
+
+    def submit(self, nifti_path, log=None, cancel=None, usage=None):
+        # a running job cannot be cancelled, a waiting one is dropped
+        job = Job(nifti_path)
+        job.future = self.executor.submit(
+            _segment_in_process, self.function_name, nifti_path
+        )
+        if cancel is not None:
+            threading.Thread(
+                target=_stop_on_cancel,
+                args=(job.future, lambda future: future.cancel(), cancel,
+                      _Done(job.future)),
+                daemon=True,
+            ).start()
+        return job
+
+
+class SpoolBackend(Backend):
+    """
+    Warm worker of worker.py: one AssemblyNet container fed through a spool
+    directory, instead of one container per job
+    """
+
+    def __init__(self, spool_dir, image=ASSEMBLYNET_IMAGE, command=None,
+                 jobs=1, tag=None, timeout=JOB_TIMEOUT):
+        """
+            Parameters:
+                spool_dir (a string): spool directory
+                image (a string): docker image of the worker, None to run
+                                  the local stand-in (worker.fake_segment)
+                command (a list): see worker.start_worker
+                jobs (an integer): jobs waiting in the spool at the same
+                                   time
+                tag (a string): see Backend (default: the image and the
+                                command, or the stand-in)
+                timeout (a float): longest wait for the result of a job (s)
+        """
+        if tag is None:
+            tag = ("worker:fake_segment" if image is None
+                   else f"{image} {json.dumps(command)}")
+        super().__init__(tag, jobs)
+        self.spool_dir = spool_dir
+        self.image = image
+        self.command = command
+        self.timeout = timeout
+
+    def _run(self, job, log, cancel, usage):
+        try:
+            result = segment_warm(
+                job.nifti_path, self.spool_dir, self.image, self.command,
+                self.timeout
+            )
+        except RuntimeError as error:
+            raise SegmentationError(str(error)) from error
+        job.returncode = result["status"]
+        job.log.extend(result["log"].splitlines())
+        if usage is not None:
+            for key in ("queue_seconds", "run_seconds", "latency_seconds"):
+                usage[key] = result[key]
+        return _checked_label_path(job.nifti_path)
+
+
+def backend_from_config(data):
+    """
+    Segmentation backend configured by config.json: "SegmentationBackend"
+    ({"Type": "docker", "executable" or "pool", "Image", "Command",
+    "Function", "Jobs", "Tag"}), otherwise the warm worker of
+    "SegmentationWorker" if it has a spool (running the "Image" of
+    "SegmentationBackend"), otherwise the AssemblyNet docker
+
+        Parameters:
+            data (a dictionary): config.json content
+        Returns:
+            backend (a Backend)
+    """
+    settings = data.get("SegmentationBackend") or {}
+    backend_type = settings.get("Type") or "docker"
+    jobs = settings.get("Jobs") or 1
+    worker = data.get("SegmentationWorker") or {}
+    if backend_type == "executable":
+        return ExecutableBackend(
+            settings["Command"], jobs, settings.get("Tag")
+        )
+    if backend_type == "pool":
+        return ProcessPoolBackend(
+            settings["Function"], settings.get("Jobs"), settings.get("Tag")
+        )
+    if backend_type != "docker":
+        raise ValueError(f"Unknown segmentation backend {backend_type}")
+    if worker.get("Spool"):
+        if not worker.get("Fake") and not worker.get("Command"):
+            raise ValueError(
+                "SegmentationWorker needs a Command to run AssemblyNet "
+                "(Fake only runs the stand-in segmenter of the tests)"
+            )
+        return SpoolBackend(
+            worker["Spool"],
+            None if worker.get("Fake")
+            else settings.get("Image") or ASSEMBLYNET_IMAGE,
+            worker.get("Command"),
+            jobs,
+            settings.get("Tag"),
+            worker.get("TimeoutSeconds") or JOB_TIMEOUT,
+        )
+    return DockerBackend(settings.get("Image") or ASSEMBLYNET_IMAGE, jobs)
@@ -0,0 +1,352 @@
+"""
+    Batch processing of several PRIDE exports
+
+    Main functions:
+        - read_manifest
+        - discover_cases
+        - run_batch
+        - print_summary
+
+    ----- LICENSE -----
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License (GPL) as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version. For more detail see the
+    GNU General Public License at <http://www.gnu.org/licenses/>.
+    -----------------
+
+    Developed by A. Delphin, E. Gourieux, J. Pietras, L. Lamalle
+    May 2024
+"""
+
+import argparse
+import contextlib
+import csv
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from checkpoint import STAGES, StageManifest
+from instrument import recorder_from_config
+from functions import (
+    finish_case,
+    load_config,
+    prepare_case,
+    processing_options,
+    segment_case,
+)
+from volumetrics import aggregate_volumetrics
+
+ORIENTATIONS = ("Sag", "Cor", "Tra")
+
+
+def read_manifest(manifest_path):
+    """
+    Read a batch manifest
+
+        Parameters:
+            manifest_path (a string): CSV file (columns input, study,
+                                      patient and optionally labels separated
+                                      by spaces) or JSON file (list of
+                                      objects with the same keys)
+        Returns:
+            cases (a list): list of dictionaries (input, study, patient,
+                            labels or None)
+    """
+    with open(manifest_path, encoding="utf-8") as manifest:
+        if manifest_path.lower().endswith(".json"):
+            rows = json.load(manifest)
+        else:
+            rows = list(csv.DictReader(manifest))
+
+    cases = []
+    for row in rows:
+        labels = row.get("labels")
+        if isinstance(labels, str):
+            labels = labels.split() or None
+        cases.append({
+            "input": row["input"],
+            "study": row["study"],
+            "patient": row["patient"],
+            "labels": labels,
+        })
+    return cases
+
+
+def discover_cases(root_dir, study, sagittal_only=False):
+    """
+    Find the PRIDE exports in a directory: every sub-directory holding
+    the 'Sag', 'Cor' and 'Tra' directories is a patient
+
+        Parameters:
+            root_dir (a string): directory to scan
+            study (a string): study name of the cases
+            sagittal_only (a boolean): a 'Sag' directory is enough, the
+                                       coronal and transversal geometry is
+                                       then computed from it (SagittalOnly
+                                       of the configuration)
+        Returns:
+            cases (a list): see read_manifest
+    """
+    required = ORIENTATIONS[:1] if sagittal_only else ORIENTATIONS
+    cases = []
+    for name in sorted(os.listdir(root_dir)):
+        input_dir_path = os.path.join(root_dir, name)
+        if not os.path.isdir(input_dir_path):
+            continue
+        missing = [orientation for orientation in required
+                   if not os.path.isdir(os.path.join(input_dir_path,
+                                                     orientation))]
+        if len(missing) == len(required):
+            continue
+        if missing:
+            print(f"{input_dir_path} skipped, no {' '.join(missing)} export")
+            continue
+        cases.append({
+                "input": input_dir_path,
+                "study": study,
+                "patient": name,
+                "labels": None,
+            })
+    return cases
+
+
+@contextlib.contextmanager
+def _stage(slots, timings, name, recorder=None, case=""):
+    """
+    Hold a slot of a stage, recording the wait for it in timings, and
+    measure the stage with recorder (an instrument.Recorder) if not None
+    """
+    start = time.perf_counter()
+    with slots:
+        timings[name + "_wait"] = time.perf_counter() - start
+        if recorder is None:
+            yield
+        else:
+            with recorder.stage(name, case):
+                yield
+
+
+def _run_case(case, out_directory, labels, stage_slots, options,
+              force_stages, recorder):
+    """Run one case through the pipeline stages, return its summary"""
+    io_slots, segmentation_slots = stage_slots
+    summary = {"study": case["study"], "patient": case["patient"]}
+    timings = {}
+    start = time.perf_counter()
+    try:
+        case_out_directory = os.path.join(
+            out_directory, case["study"], case["patient"]
+        )
+        os.makedirs(case_out_directory, exist_ok=True)
+        with _stage(io_slots, timings, "prepare",
+                    recorder, case_out_directory):
+            state = prepare_case(
+                case["input"],
+                case_out_directory,
+                options.get("cache_dir"),
+                StageManifest(case_out_directory, force_stages),
+                options.get("backend"),
+                options.get("staging"),
+            )
+        timings.update(state["timings"])
+        state["timings"] = timings
+        with _stage(segmentation_slots, timings, "segmentation",
+                    recorder, case_out_directory):
+            segment_case(
+                state,
+                options.get("cache_dir"),
+                options.get("cache_max_size", 0),
+                options.get("backend"),
+                recorder=recorder,
+            )
+        with _stage(io_slots, timings, "finish",
+                    recorder, case_out_directory):
+            finish_case(state, case["labels"] or labels,
+                        options.get("dtypes"),
+                        options.get("volume_workers", 1))
+        summary["status"] = "ok"
+    except Exception as error:  # one failed case must not stop the batch
+        traceback.print_exc()
+        summary["status"] = "failed"
+        summary["error"] = repr(error)
+    summary["timings"] = timings
+    summary["seconds"] = time.perf_counter() - start
+    return summary
+
+
+def run_batch(cases, out_directory, labels, segmentation_jobs=1,
+              io_jobs=2, options=None, force_stages=(), recorder=None):
+    """
+    Process several cases as a pipeline: prepare_case (PAR, NIfTI),
+    segment_case and finish_case (masking, XML/REC writing) of different
+    cases run at the same time, so that while case N is segmented case N+1
+    is prepared and the outputs of case N-1 are written. At most
+    segmentation_jobs cases are segmented and io_jobs cases are prepared or
+    finished at the same time. The number of cases in flight is bounded, so
+    that prepared cases do not pile up in memory while waiting for the
+    segmentation.
+
+        Parameters:
+            cases (a list): see read_manifest
+            out_directory (a string): results are written in
+                                      out_directory/study/patient
+            labels (a list): labels of the cases without labels
+            segmentation_jobs (an integer): concurrent segmentations
+            io_jobs (an integer): concurrent cases
+            options (a dictionary): other main_processing keyword arguments
+            force_stages (a list): stages run even if up to date
+            recorder (an instrument.Recorder): records the resource use
+                                               of each stage of each case
+        Returns:
+            summaries (a list): one dictionary per case (study, patient,
+                                status, seconds, timings or error)
+    """
+    stage_slots = (
+        threading.Semaphore(max(io_jobs, 1)),
+        threading.Semaphore(max(segmentation_jobs, 1)),
+    )
+    # the slots of the segmentation stage are the limit, not the
+    # executor of the backend (Jobs of the configuration)
+    if (options or {}).get("backend") is not None:
+        options["backend"].reserve(max(segmentation_jobs, 1))
+    # enough cases for every slot of every stage to be busy, no more
+    max_in_flight = max(segmentation_jobs, 1) + 2 * max(io_jobs, 1)
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        futures = [
+            executor.submit(
+                _run_case, case, out_directory, labels,
+                stage_slots, options or {}, force_stages, recorder
+            )
+            for case in cases
+        ]
+        return [future.result() for future in futures]
+
+
+def print_summary(summaries):
+    """
+    Print the per-case summary of a batch
+
+        Parameters:
+            summaries (a list): see run_batch
+    """
+    stages = []
+    for summary in summaries:
+        for stage in summary.get("timings", {}):
+            if stage not in stages:
+                stages.append(stage)
+    print("study/patient".ljust(30) + "status".ljust(8) + "total".rjust(9)
+          + "".join(stage.rjust(max(len(stage), 7) + 2) for stage in stages))
+    for summary in summaries:
+        timings = summary.get("timings", {})
+        line = (
+            f"{summary['study']}/{summary['patient']}"[:29].ljust(30)
+            + summary["status"].ljust(8)
+            + f"{summary['seconds']:9.1f}"
+        )
+        for stage in stages:
+            width = max(len(stage), 7) + 2
+            if stage in timings:
+                line += f"{timings[stage]:{width}.1f}"
+            else:
+                line += "-".rjust(width)
+        print(line)
+        if "error" in summary:
+            print("    " + summary["error"])
+    failed = sum(summary["status"] != "ok" for summary in summaries)
+    print(f"{len(summaries)} cases, {failed} failed")
+
+
+def main_batch():
+    """
+    Batch CLI
+    """
+    parser = argparse.ArgumentParser(
+        description="Segment several PRIDE exports"
+    )
+    parser.add_argument(
+        "--cases",
+        required=True,
+        help="Manifest (CSV or JSON with input, study, patient and "
+        "optionally labels) or directory of PRIDE exports (one "
+        "sub-directory with 'Sag' and optionally 'Cor' and 'Tra' per "
+        "patient)",
+    )
+    parser.add_argument(
+        "--study",
+        help="Study name when --cases is a directory (default: its name)",
+    )
+    parser.add_argument(
+        "--labels",
+        help="Assemblynet labels to use when not given in the manifest",
+        nargs="*",
+        default=[181, 185, 201, 207]
+    )
+    parser.add_argument(
+        "--segmentation-jobs",
+        type=int,
+        default=1,
+        help="Number of concurrent segmentations",
+    )
+    parser.add_argument(
+        "--io-jobs",
+        type=int,
+        default=2,
+        help="Number of cases prepared or written concurrently",
+    )
+    parser.add_argument(
+        "--force-stage",
+        nargs="*",
+        default=[],
+        choices=STAGES + ("all",),
+        help="Stages to run again even if their inputs did not change",
+    )
+    args = parser.parse_args()
+
+    data = load_config()
+    out_directory = data["OutDirectory"]
+    if not os.path.exists(out_directory):
+        print(
+            "Please enter a valid file path in the "
+            "configuration file for OutDirectory"
+        )
+        sys.exit()
+
+    if os.path.isdir(args.cases):
+        cases = discover_cases(
+            args.cases,
+            args.study or os.path.basename(os.path.normpath(args.cases)),
+            data.get("SagittalOnly", False),
+        )
+    else:
+        cases = read_manifest(args.cases)
+
+    summaries = run_batch(
+        cases,
+        out_directory,
+        args.labels,
+        args.segmentation_jobs,
+        args.io_jobs,
+        processing_options(data),
+        args.force_stage,
+        recorder_from_config(data),
+    )
+    print_summary(summaries)
+    volumetrics_path = os.path.join(out_directory, "volumetrics.csv")
+    aggregate_volumetrics(
+        [
+            (summary["study"], summary["patient"],
+             os.path.join(out_directory, summary["study"], summary["patient"]))
+            for summary in summaries if summary["status"] == "ok"
+        ],
+        volumetrics_path,
+    )
+    print(f"Volumetrics of the cases in {volumetrics_path}")
+
+
+if __name__ == "__main__":
+    main_batch()
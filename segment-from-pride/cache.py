@@ -0,0 +1,130 @@
+"""
+    Content-addressed cache of the AssemblyNet segmentations, so that
+    a rerun on the same images (e.g. with other labels) does not segment again
+
+    Main functions:
+        - segmentation_key
+        - get_cached_segmentation
+        - cache_segmentation
+
+    ----- LICENSE -----
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License (GPL) as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version. For more detail see the
+    GNU General Public License at <http://www.gnu.org/licenses/>.
+    -----------------
+
+    Developed by A. Delphin, E. Gourieux, J. Pietras, L. Lamalle
+    May 2024
+"""
+
+import hashlib
+import os
+import shutil
+import uuid
+
+CACHE_FILE_NAME = "native_structures.nii.gz"
+CHUNK_SIZE = 1 << 20
+
+
+def segmentation_key(rec_path, affine, shape, image_tag):
+    """
+    Compute the cache key of a segmentation
+
+        Parameters:
+            rec_path (a string): REC file path
+            affine (a numpy array): affine of the image
+            shape (a tuple): shape of the image
+            image_tag (a string): segmentation docker image tag
+        Returns:
+            key (a string): sha256 hex digest
+    """
+    sha = hashlib.sha256()
+    with open(rec_path, "rb") as rec_file:
+        for chunk in iter(lambda: rec_file.read(CHUNK_SIZE), b""):
+            sha.update(chunk)
+    sha.update(repr(tuple(shape)).encode("utf-8"))
+    sha.update(repr([round(float(v), 4) for v in affine.ravel()]).encode("utf-8"))
+    sha.update(image_tag.encode("utf-8"))
+    return sha.hexdigest()
+
+
+def get_cached_segmentation(cache_dir, key, out_path):
+    """
+    Copy a cached segmentation to out_path
+
+        Parameters:
+            cache_dir (a string): cache directory
+            key (a string): key from segmentation_key
+            out_path (a string): where to copy the segmentation
+        Returns:
+            True if the segmentation was in the cache
+    """
+    cached_path = os.path.join(cache_dir, key, CACHE_FILE_NAME)
+    if not os.path.exists(cached_path):
+        return False
+    shutil.copyfile(cached_path, out_path)
+    # mtime of the entry is its last use, for the LRU eviction
+    os.utime(os.path.join(cache_dir, key))
+    return True
+
+
+def cache_segmentation(cache_dir, key, seg_path, max_size):
+    """
+    Store a segmentation in the cache, then evict the least recently
+    used entries until the cache is under max_size (if there is a cap)
+
+        Parameters:
+            cache_dir (a string): cache directory
+            key (a string): key from segmentation_key
+            seg_path (a string): segmentation (native_structures_*.nii.gz)
+            max_size (an integer): cache size cap in bytes (0 or None: no
+                                   cap)
+    """
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    entry_path = os.path.join(cache_dir, key)
+    if not os.path.exists(entry_path):
+        # copy aside then rename, so that a partial entry is never seen
+        # (permissions from the umask, the cache is shared)
+        tmp_path = os.path.join(cache_dir, ".tmp_" + uuid.uuid4().hex)
+        os.makedirs(tmp_path)
+        shutil.copyfile(seg_path, os.path.join(tmp_path, CACHE_FILE_NAME))
+        try:
+            os.rename(tmp_path, entry_path)
+        except OSError:
+            # stored meanwhile by another run
+            shutil.rmtree(tmp_path)
+    os.utime(entry_path)
+    evict(cache_dir, max_size)
+
+
+def evict(cache_dir, max_size):
+    """
+    Remove the least recently used entries until the cache is under max_size
+
+        Parameters:
+            cache_dir (a string): cache directory
+            max_size (an integer): cache size cap in bytes (0 or None: no
+                                   cap, nothing is removed)
+    """
+    if not max_size:
+        return
+    entries = []
+    for name in os.listdir(cache_dir):
+        cached_path = os.path.join(cache_dir, name, CACHE_FILE_NAME)
+        if name.startswith(".") or not os.path.exists(cached_path):
+            continue
+        entries.append((
+            os.path.getmtime(os.path.join(cache_dir, name)),
+            os.path.getsize(cached_path),
+            name
+        ))
+    entries.sort()
+    total_size = sum(entry[1] for entry in entries)
+    for _, size, name in entries:
+        if total_size <= max_size:
+            break
+        shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+        total_size -= size
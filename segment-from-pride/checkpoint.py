@@ -0,0 +1,143 @@
+"""
+    Stage checkpoints of main_processing: each stage records its input
+    hashes, parameters and outputs in a manifest of the output directory,
+    a rerun skips the stages whose inputs did not change and whose outputs
+    still exist (as make does)
+
+    Main class:
+        - StageManifest
+
+    ----- LICENSE -----
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License (GPL) as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version. For more detail see the
+    GNU General Public License at <http://www.gnu.org/licenses/>.
+    -----------------
+
+    Developed by A. Delphin, E. Gourieux, J. Pietras, L. Lamalle
+    May 2024
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+MANIFEST_NAME = "stages.json"
+STAGES = ("par", "nifti", "segmentation", "export")
+CHUNK_SIZE = 1 << 20
+
+
+class StageManifest:
+    """
+    Manifest of the stages already run in an output directory
+    """
+
+    def __init__(self, output_path, force_stages=()):
+        """
+            Parameters:
+                output_path (a string): output directory of the case
+                force_stages (a list): stages to run even if up to date
+                                       ("all" for every stage)
+        """
+        self.path = os.path.join(output_path, MANIFEST_NAME)
+        self.force_stages = set(force_stages)
+        if "all" in self.force_stages:
+            self.force_stages = set(STAGES)
+        self.lock = threading.Lock()
+        self.data = {"files": {}, "stages": {}}
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as my_json:
+                self.data = json.load(my_json)
+
+    def file_hash(self, path):
+        """
+        sha256 of a file, only recomputed when its size or mtime changed
+
+            Parameters:
+                path (a string): file path
+            Returns:
+                a hex digest, None if the file does not exist
+        """
+        if not os.path.exists(path):
+            return None
+        stat = os.stat(path)
+        path = os.path.realpath(path)
+        known = self.data["files"].get(path)
+        if known and known["size"] == stat.st_size \
+                and known["mtime"] == stat.st_mtime_ns:
+            return known["sha256"]
+        sha = hashlib.sha256()
+        with open(path, "rb") as my_file:
+            for chunk in iter(lambda: my_file.read(CHUNK_SIZE), b""):
+                sha.update(chunk)
+        with self.lock:
+            self.data["files"][path] = {
+                "size": stat.st_size,
+                "mtime": stat.st_mtime_ns,
+                "sha256": sha.hexdigest(),
+            }
+        return sha.hexdigest()
+
+    def _inputs(self, inputs):
+        """Hash of every input file"""
+        return {os.path.realpath(path): self.file_hash(path) for path in inputs}
+
+    def up_to_date(self, stage, inputs, params):
+        """
+        Check whether a stage can be skipped
+
+            Parameters:
+                stage (a string): stage name (see STAGES)
+                inputs (a list): input file paths
+                params (a dictionary): stage parameters (JSON serializable)
+            Returns:
+                True if the stage was run with the same inputs and
+                parameters and all its outputs exist
+        """
+        record = self.data["stages"].get(stage)
+        if stage in self.force_stages or record is None:
+            return False
+        return (
+            record["inputs"] == self._inputs(inputs)
+            and record["params"] == json.loads(json.dumps(params))
+            and all(os.path.exists(path) for path in record["outputs"])
+        )
+
+    def outputs(self, stage):
+        """
+        Outputs recorded for a stage
+
+            Parameters:
+                stage (a string): stage name (see STAGES)
+            Returns:
+                outputs (a list): output file paths
+        """
+        return self.data["stages"][stage]["outputs"]
+
+    def record(self, stage, inputs, params, outputs):
+        """
+        Record a stage that has just been run and save the manifest
+
+            Parameters:
+                stage (a string): stage name (see STAGES)
+                inputs (a list): input file paths
+                params (a dictionary): stage parameters (JSON serializable)
+                outputs (a list): output file paths
+        """
+        inputs = self._inputs(inputs)
+        for path in outputs:
+            self.file_hash(path)
+        with self.lock:
+            self.data["stages"][stage] = {
+                "inputs": inputs,
+                "params": json.loads(json.dumps(params)),
+                "outputs": [os.path.realpath(path) for path in outputs],
+            }
+            self.force_stages.discard(stage)
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as my_json:
+                json.dump(self.data, my_json, indent=4)
+            os.replace(tmp_path, self.path)
@@ -0,0 +1,103 @@
+"""
+    Command line of the processing of one patient, without Qt (headless
+    processing nodes): python main.py --input ... or python cli.py --input ...
+
+    ----- LICENSE -----
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License (GPL) as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version. For more detail see the
+    GNU General Public License at <http://www.gnu.org/licenses/>.
+    -----------------
+
+    Developed by A. Delphin, E. Gourieux, J. Pietras, L. Lamalle
+    May 2024
+"""
+
+import argparse
+import os
+import sys
+from checkpoint import STAGES
+
+
+def main_cli():
+    """
+    Main CLI
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Obtain information to position MRS voxel "
+        "in longitudinal study"
+    )
+    parser.add_argument(
+        "--input",
+        required=True,
+        help="Directory path where 'Sag', 'Cor' and 'Tra' directories are located",
+    )
+
+    parser.add_argument(
+        "--labels",
+        required=True,
+        help="Assemblynet labels to use",
+        nargs="*",
+        default=[181, 185, 201, 207]
+    )
+    parser.add_argument("--study", required=True, help="Study name")
+    parser.add_argument("--patient", required=True, help="Patient name")
+    parser.add_argument(
+        "--force-stage",
+        nargs="*",
+        default=[],
+        choices=STAGES + ("all",),
+        help="Stages to run again even if their inputs did not change",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Dump the cProfile statistics of each stage in "
+        "the 'profile' directory of the output directory",
+    )
+
+    args = parser.parse_args()
+    # imported once the arguments are checked (--help, wrong arguments do
+    # not wait for numpy)
+    from functions import load_config, main_processing, processing_options
+    from instrument import recorder_from_config
+
+    input_dir_path = args.input
+    labels = args.labels
+
+    data = load_config()
+    out_directory = data["OutDirectory"]
+
+    if not os.path.exists(out_directory):
+        print(
+            "Please enter a valid file path in the "
+            "configuration file for OutDirectory"
+        )
+        sys.exit()
+
+    out_directory = os.path.join(
+                    out_directory,
+                    args.study,
+                    args.patient
+                )
+    if not os.path.exists(out_directory):
+        os.makedirs(out_directory)
+
+    profile_dir = None
+    if args.profile:
+        profile_dir = os.path.join(out_directory, "profile")
+    # Launch processing
+    main_processing(
+        input_dir_path, out_directory, labels,
+        force_stages=args.force_stage,
+        recorder=recorder_from_config(data, profile_dir),
+        **processing_options(data)
+    )
+    if profile_dir is not None:
+        print(f"cProfile statistics in {profile_dir} (python -m pstats)")
+
+
+if __name__ == "__main__":
+    main_cli()
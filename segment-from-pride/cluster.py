@@ -0,0 +1,583 @@
+"""
+    Distribution of the cases over several nodes sharing a spool directory
+    (e.g. an NFS volume), without a scheduler: the coordinator writes one
+    job per case in the spool, workers started on any node take them, run
+    main_processing and publish their result in the spool
+
+    Spool layout:
+        jobs/<id>[~<n>].json        case waiting to be taken, n: leases of
+                                    the job that expired
+        running/<id>[~<n>]@<worker>.json
+                                    case taken by a worker, its modification
+                                    time is the lease of the worker
+        done/<id>.json              result of the case (status, output
+                                    directory, worker, timings or error)
+        done/<id>.publishing        job taken from running/, its result
+                                    being written
+        workers/<worker>.json       last heartbeat of each worker
+
+    A worker takes a job by renaming it into running/ (rename is atomic: a
+    job is taken once) and renews its lease while it works on it. A lease
+    not renewed for lease seconds (node crashed or cut from the volume) is
+    expired: the job goes back to jobs/ for another worker with a single
+    rename (the number of expired leases is in its name), up to
+    MAX_ATTEMPTS times, and the worker that lost it drops its result. The
+    clocks of the nodes must agree to well within the lease (NTP), and the
+    input and OutDirectory paths must be the same on every node.
+
+    Main functions:
+        - submit_case
+        - requeue_expired
+        - serve
+        - wait_cases
+        - spool_status
+
+    ----- LICENSE -----
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License (GPL) as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version. For more detail see the
+    GNU General Public License at <http://www.gnu.org/licenses/>.
+    -----------------
+
+    Developed by A. Delphin, E. Gourieux, J. Pietras, L. Lamalle
+    May 2024
+"""
+
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import traceback
+import uuid
+
+from batch import discover_cases, read_manifest
+from instrument import recorder_from_config
+from functions import load_config, main_processing, processing_options
+from worker import _spool_dirs, _write_json
+
+LEASE_SECONDS = 60
+# renewals of a lease during its duration
+RENEWALS_PER_LEASE = 6
+POLL_PERIOD = 1
+# a job whose lease expired this many times is failed instead of requeued
+MAX_ATTEMPTS = 3
+SPOOL_DIRS = ("jobs", "running", "done", "workers")
+
+
+def _read_json(path):
+    """Read a JSON file, None if it is gone (moved by another node)"""
+    try:
+        with open(path, encoding="utf-8") as my_json:
+            return json.load(my_json)
+    except FileNotFoundError:
+        return None
+
+
+def _json_names(directory):
+    """Names of the JSON files of a spool directory, in name order"""
+    return sorted(name for name in os.listdir(directory)
+                  if name.endswith(".json"))
+
+
+def _parse_name(name):
+    """
+    Job identifier, number of expired leases and worker (None in jobs/) of
+    the name of a job in jobs/ or running/
+    """
+    stem, _, worker = name[:-len(".json")].partition("@")
+    job_id, _, attempts = stem.partition("~")
+    return job_id, int(attempts or 0), worker or None
+
+
+def worker_name():
+    """Name of this worker process (host and pid)"""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def submit_case(spool_dir, case, labels):
+    """
+    Write the job of a case in the spool
+
+        Parameters:
+            spool_dir (a string): spool directory
+            case (a dictionary): input, study, patient and labels (None:
+                                 labels), see batch.read_manifest
+            labels (a list): labels of the case when not in case
+        Returns:
+            job_id (a string): job identifier (the jobs are taken in the
+                               order of their identifiers)
+    """
+    _spool_dirs(spool_dir, SPOOL_DIRS)
+    job_id = f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}"
+    _write_json(os.path.join(spool_dir, "jobs", job_id + ".json"), {
+        "id": job_id,
+        "input": os.path.abspath(case["input"]),
+        "study": case["study"],
+        "patient": case["patient"],
+        "labels": [str(label) for label in case["labels"] or labels],
+        "submitted": time.time(),
+    })
+    return job_id
+
+
+def _publish(spool_dir, running_path, result):
+    """
+    Move a job from running/ to done/ with its result. The rename out of
+    running/ takes the job (it is either published here or requeued by
+    another node, not both), it is then done/<id>.publishing until its
+    result is written (see _sweep_publishing for a node stopped meanwhile)
+
+        Parameters:
+            spool_dir (a string): spool directory
+            running_path (a string): path of the job in running/
+            result (a dictionary): result of the job (id, status...)
+        Returns:
+            published (a boolean): False if the job was not in running/
+                                   any more (requeued by another node)
+    """
+    publishing_path = os.path.join(
+        spool_dir, "done", result["id"] + ".publishing"
+    )
+    try:
+        # renewed so that the sweep only sees stalled publications
+        os.utime(running_path)
+        os.rename(running_path, publishing_path)
+    except FileNotFoundError:
+        return False
+    _write_json(
+        os.path.join(spool_dir, "done", result["id"] + ".json"), result
+    )
+    os.remove(publishing_path)
+    return True
+
+
+def _sweep_publishing(spool_dir, lease):
+    """
+    Fail the jobs whose node stopped while publishing their result (left
+    as done/<id>.publishing for more than lease seconds)
+
+        Returns:
+            failed (a list): identifiers of the jobs failed
+    """
+    now = time.time()
+    failed = []
+    done_dir = os.path.join(spool_dir, "done")
+    for name in sorted(os.listdir(done_dir)):
+        if not name.endswith(".publishing"):
+            continue
+        publishing_path = os.path.join(done_dir, name)
+        try:
+            if now - os.path.getmtime(publishing_path) < lease:
+                continue
+        except FileNotFoundError:
+            continue
+        job = _read_json(publishing_path)
+        if job is None:
+            continue
+        done_path = os.path.join(done_dir, job["id"] + ".json")
+        if _read_json(done_path) is None:
+            print(f"Job {job['id']}: worker stopped while publishing")
+            _write_json(done_path, {
+                **job,
+                "status": "error",
+                "error": "Worker stopped while publishing the result",
+            })
+            failed.append(job["id"])
+        try:
+            os.remove(publishing_path)
+        except FileNotFoundError:
+            pass
+    return failed
+
+
+def requeue_expired(spool_dir, lease=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+    """
+    Put back in jobs/ the running jobs whose lease expired, and fail the
+    jobs whose result was not published (run by every worker and by the
+    coordinator, one of them takes each expired job)
+
+        Parameters:
+            spool_dir (a string): spool directory
+            lease (a float): seconds without renewal after which a lease
+                             is expired
+            max_attempts (an integer): expired leases after which the job
+                                       is failed
+        Returns:
+            requeued (a list): identifiers of the jobs requeued or failed
+    """
+    now = time.time()
+    requeued = _sweep_publishing(spool_dir, lease)
+    running_dir = os.path.join(spool_dir, "running")
+    for name in _json_names(running_dir):
+        running_path = os.path.join(running_dir, name)
+        try:
+            if now - os.path.getmtime(running_path) < lease:
+                continue
+        except FileNotFoundError:
+            continue
+        job_id, attempts, worker = _parse_name(name)
+        attempts += 1
+        if attempts < max_attempts:
+            # a single rename, as a job is taken from jobs/: the job is
+            # either still running or back in jobs/, and requeued once
+            try:
+                os.rename(running_path, os.path.join(
+                    spool_dir, "jobs", f"{job_id}~{attempts}.json"
+                ))
+            except OSError:
+                continue
+            print(f"Lease of job {job_id} expired on {worker}, requeued")
+        else:
+            job = _read_json(running_path)
+            # published as a worker publishes its result (see _run_job)
+            if job is None or not _publish(spool_dir, running_path, {
+                    **job,
+                    "attempts": attempts,
+                    "status": "error",
+                    "error": f"Lease expired {attempts} times "
+                             f"(last on {worker})",
+            }):
+                continue
+            print(f"Lease of job {job_id} expired on {worker}, "
+                  f"failed after {attempts} attempts")
+        requeued.append(job_id)
+    return requeued
+
+
+def _claim(spool_dir, worker):
+    """
+    Take the first job of jobs/
+
+        Parameters:
+            spool_dir (a string): spool directory
+            worker (a string): worker name
+        Returns:
+            running_path (a string): path of the job in running/, None if
+                                     there is no job to take
+    """
+    jobs_dir = os.path.join(spool_dir, "jobs")
+    for name in _json_names(jobs_dir):
+        job_path = os.path.join(jobs_dir, name)
+        running_path = os.path.join(
+            spool_dir, "running", f"{name[:-len('.json')]}@{worker}.json"
+        )
+        try:
+            # the lease starts before the job is visible in running/
+            os.utime(job_path)
+            # rename is atomic: a job is taken once
+            os.rename(job_path, running_path)
+        except OSError:
+            continue
+        return running_path
+    return None
+
+
+def _heartbeat(spool_dir, worker, lease, current, stop):
+    """
+    Renew the lease of the current job and write the worker heartbeat
+    until stop is set
+
+        Parameters:
+            spool_dir (a string): spool directory
+            worker (a string): worker name
+            lease (a float): lease duration (s)
+            current (a dictionary): "path" (running/ path of the current
+                                    job) and "lost" (threading.Event set
+                                    when its lease is lost), empty between
+                                    jobs, guarded by current["lock"]
+            stop (a threading.Event): stops the heartbeat
+    """
+    worker_path = os.path.join(spool_dir, "workers", worker + ".json")
+    while True:
+        with current["lock"]:
+            running_path = current.get("path")
+            if running_path is not None:
+                try:
+                    os.utime(running_path)
+                except FileNotFoundError:  # requeued by another node
+                    current["lost"].set()
+        _write_json(worker_path, {
+            "worker": worker,
+            "job": running_path and os.path.basename(running_path),
+            "heartbeat": time.time(),
+        })
+        if stop.wait(lease / RENEWALS_PER_LEASE):
+            return
+
+
+def _run_job(spool_dir, running_path, worker, out_directory, options,
+             recorder, current):
+    """
+    Run the case of a job taken by this worker and publish its result
+
+        Parameters:
+            spool_dir (a string): spool directory
+            running_path (a string): path of the job in running/
+            worker (a string): worker name
+            out_directory (a string): OutDirectory of the configuration
+            options (a dictionary): see functions.processing_options
+            recorder (an instrument.Recorder): see main_processing
+            current (a dictionary): see _heartbeat
+        Returns:
+            result (a dictionary): result of the case, None if the lease
+                                   was lost (the result is not published)
+    """
+    job = _read_json(running_path)
+    if job is None:
+        return None
+    _, attempts, _ = _parse_name(os.path.basename(running_path))
+    lost = threading.Event()
+    with current["lock"]:
+        current.update(path=running_path, lost=lost)
+
+    start = time.time()
+    output_path = os.path.join(out_directory, job["study"], job["patient"])
+    result = {
+        **job,
+        "worker": worker,
+        "output": output_path,
+        "attempts": attempts,
+        "queue_seconds": start - job["submitted"],
+    }
+    print(f"Job {job['id']}: {job['study']}/{job['patient']}")
+    try:
+        os.makedirs(output_path, exist_ok=True)
+        # the processing is cancelled when the lease is lost
+        result["timings"] = main_processing(
+            job["input"], output_path, job["labels"],
+            cancel=lost, recorder=recorder, **options
+        )
+        result["status"] = "ok"
+    except Exception as error:  # the worker must survive a failed case
+        result["status"] = "error"
+        result["error"] = f"{type(error).__name__}: {error}"
+        traceback.print_exc()
+    finally:
+        with current["lock"]:
+            current.pop("path", None)
+            current.pop("lost", None)
+    result["run_seconds"] = time.time() - start
+
+    if lost.is_set() or not _publish(spool_dir, running_path, result):
+        print(f"Lease of job {job['id']} lost, result dropped")
+        return None
+    return result
+
+
+def serve(spool_dir, lease=LEASE_SECONDS, exit_when_idle=False):
+    """
+    Worker loop: take the jobs of the spool one after the other
+
+        Parameters:
+            spool_dir (a string): spool directory
+            lease (a float): lease duration (s), the same on every node
+            exit_when_idle (a boolean): return when no job is waiting nor
+                                        running instead of waiting for jobs
+        Returns:
+            results (a list): results of the jobs run by this worker
+    """
+    _spool_dirs(spool_dir, SPOOL_DIRS)
+    data = load_config()
+    out_directory = data["OutDirectory"]
+    options = processing_options(data)
+    recorder = recorder_from_config(data)
+    worker = worker_name()
+    print(f"Worker {worker} on {spool_dir}")
+
+    current = {"lock": threading.Lock()}
+    stop = threading.Event()
+    heartbeat = threading.Thread(
+        target=_heartbeat,
+        args=(spool_dir, worker, lease, current, stop),
+        daemon=True,
+    )
+    heartbeat.start()
+    results = []
+    try:
+        while True:
+            requeue_expired(spool_dir, lease)
+            running_path = _claim(spool_dir, worker)
+            if running_path is None:
+                if exit_when_idle and not any(
+                    _json_names(os.path.join(spool_dir, name))
+                    for name in ("jobs", "running")
+                ):
+                    return results
+                time.sleep(POLL_PERIOD)
+                continue
+            result = _run_job(spool_dir, running_path, worker, out_directory,
+                              options, recorder, current)
+            if result is not None:
+                results.append(result)
+    finally:
+        stop.set()
+        heartbeat.join()
+        os.remove(os.path.join(spool_dir, "workers", worker + ".json"))
+
+
+def wait_cases(spool_dir, job_ids, lease=LEASE_SECONDS, timeout=None):
+    """
+    Wait for the results of jobs, requeuing the expired ones meanwhile
+
+        Parameters:
+            spool_dir (a string): spool directory
+            job_ids (a list): job identifiers (see submit_case)
+            lease (a float): see requeue_expired
+            timeout (a float): seconds to wait (None: no limit)
+        Returns:
+            results (a dictionary): job identifier -> result, for the jobs
+                                    finished before timeout
+    """
+    deadline = None if timeout is None else time.time() + timeout
+    results = {}
+    waiting = list(job_ids)
+    while waiting:
+        requeue_expired(spool_dir, lease)
+        for job_id in list(waiting):
+            result = _read_json(
+                os.path.join(spool_dir, "done", job_id + ".json")
+            )
+            # (no status yet: the worker is writing the result)
+            if result is not None and "status" in result:
+                results[job_id] = result
+                waiting.remove(job_id)
+                print(f"{result['study']}/{result['patient']}: "
+                      f"{result['status']} ({result.get('worker', '')}, "
+                      f"{len(results)}/{len(job_ids)})")
+        if not waiting or (deadline is not None and time.time() > deadline):
+            break
+        time.sleep(POLL_PERIOD)
+    return results
+
+
+def spool_status(spool_dir):
+    """
+    State of the spool
+
+        Parameters:
+            spool_dir (a string): spool directory
+        Returns:
+            status (a dictionary): number of jobs in each of jobs, running
+                                   and done, and of the jobs whose result
+                                   is being published (publishing, see
+                                   _publish), the running jobs (id,
+                                   worker, lease age) and the workers
+                                   (name, heartbeat age, current job)
+    """
+    _spool_dirs(spool_dir, SPOOL_DIRS)
+    now = time.time()
+    status = {
+        name: len(_json_names(os.path.join(spool_dir, name)))
+        for name in ("jobs", "running", "done")
+    }
+    status["publishing"] = sum(
+        name.endswith(".publishing")
+        for name in os.listdir(os.path.join(spool_dir, "done"))
+    )
+    status["running_jobs"] = []
+    for name in _json_names(os.path.join(spool_dir, "running")):
+        job_id, _, worker = _parse_name(name)
+        try:
+            age = now - os.path.getmtime(
+                os.path.join(spool_dir, "running", name)
+            )
+        except FileNotFoundError:
+            continue
+        status["running_jobs"].append(
+            {"id": job_id, "worker": worker, "lease_age": age}
+        )
+    status["workers"] = []
+    for name in _json_names(os.path.join(spool_dir, "workers")):
+        heartbeat = _read_json(os.path.join(spool_dir, "workers", name))
+        if heartbeat is not None:
+            status["workers"].append({
+                "worker": heartbeat["worker"],
+                "heartbeat_age": now - heartbeat["heartbeat"],
+                "job": heartbeat["job"],
+            })
+    return status
+
+
+def main_cluster():
+    """
+    Cluster CLI
+    """
+    parser = argparse.ArgumentParser(
+        description="Distribute PRIDE exports over the nodes sharing a "
+        "spool directory"
+    )
+    parser.add_argument("spool", help="Spool directory shared by the nodes")
+    parser.add_argument(
+        "--lease",
+        type=float,
+        default=LEASE_SECONDS,
+        help="Seconds after which the job of a silent worker is requeued "
+        "(the same on every node)",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    submit = commands.add_parser("submit", help="Write the jobs of cases")
+    submit.add_argument(
+        "--cases",
+        required=True,
+        help="Manifest or directory of PRIDE exports (see batch.py)",
+    )
+    submit.add_argument(
+        "--study",
+        help="Study name when --cases is a directory (default: its name)",
+    )
+    submit.add_argument(
+        "--labels",
+        help="Assemblynet labels to use when not given in the manifest",
+        nargs="*",
+        default=[181, 185, 201, 207]
+    )
+    submit.add_argument(
+        "--wait",
+        action="store_true",
+        help="Wait for the results of the cases",
+    )
+    worker = commands.add_parser("worker", help="Run the jobs of the spool")
+    worker.add_argument(
+        "--exit-when-idle",
+        action="store_true",
+        help="Exit when no job is waiting nor running",
+    )
+    commands.add_parser("status", help="Print the state of the spool")
+    args = parser.parse_args()
+
+    if args.command == "worker":
+        results = serve(args.spool, args.lease, args.exit_when_idle)
+        failed = sum(result["status"] != "ok" for result in results)
+        print(f"{len(results)} cases, {failed} failed")
+    elif args.command == "status":
+        print(json.dumps(spool_status(args.spool), indent=4))
+    else:
+        if os.path.isdir(args.cases):
+            cases = discover_cases(
+                args.cases,
+                args.study or os.path.basename(os.path.normpath(args.cases)),
+                load_config().get("SagittalOnly", False),
+            )
+        else:
+            cases = read_manifest(args.cases)
+        job_ids = [submit_case(args.spool, case, args.labels)
+                   for case in cases]
+        print(f"{len(job_ids)} jobs written in {args.spool}")
+        if args.wait:
+            results = wait_cases(args.spool, job_ids, args.lease)
+            failed = [result for result in results.values()
+                      if result["status"] != "ok"]
+            for result in failed:
+                print(f"{result['study']}/{result['patient']}: "
+                      f"{result['error']}")
+            print(f"{len(results)} cases, {len(failed)} failed")
+            if failed:
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cluster()
@@ -1,8 +1,11 @@
 """
     Main functions:
+        - label_lookup
         - extract_roi_by_label
-        - launch_assemblynet
-        - segment
+        - label_bounding_box
+        - burn_labels
+        - prepare_case, segment_case, finish_case
+        - main_processing
 
     ----- LICENSE -----
     This program is free software: you can redistribute it and/or modify
@@ -16,17 +19,98 @@
     May 2024
 """
 
+import contextlib
 import glob
+import json
 import os
-import subprocess
-import nibabel as nib
+import time
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 
-from xml2par import main_xml2par
-import xmlrec as xml  # ask your Philips clinical scientist to obtain thoses functions
+from backends import (
+    ASSEMBLYNET_IMAGE,
+    DockerBackend,
+    backend_from_config,
+    label_path,
+)
+from cache import cache_segmentation, get_cached_segmentation, segmentation_key
+from checkpoint import StageManifest
+from geometry import AXES, derive_header, reorient, slice_axes
+import staging as tmpfs  # (staging is the name of the option)
+from volumetrics import label_volumetrics, write_volumetrics
+from xml2par import find_info, main_xmlrec2par
+from xmlheader import read_xml_header
 
+NIFTI_SLAB_BYTES = 32 * 1024 ** 2
+# dtypes of the volumes of finish_case ("Dtypes" of config.json): the
+# label volume and the image math (the REC pixel type is only applied
+# by xmlrec when writing)
+DTYPES = {"Image": "float32", "Labels": "uint16"}
+# slabs per thread of the volume math (load balancing: the labels are not
+# evenly spread)
+SLABS_PER_WORKER = 4
 
-def extract_roi_by_label(seg_volume, labels):
+
+def _slab_map(function, array, workers=1, axis=None):
+    """
+    Run function on slabs of array with a pool of threads (numpy releases
+    the GIL), the slabs being along axis, by default the outermost axis of
+    array in memory so that each slab is contiguous
+
+        Parameters:
+            function (a function): called with the index of each slab (a
+                                   tuple of slices, for every array of the
+                                   shape of array)
+            array (a numpy array): array cut into slabs
+            workers (an integer): threads
+            axis (an integer): axis of the slabs
+        Returns:
+            results (a list): result of function for each slab, in order
+    """
+    if axis is None:
+        axis = int(np.argmax(np.abs(array.strides)))
+    length = array.shape[axis]
+    count = max(1, min(length, SLABS_PER_WORKER * workers))
+    edges = np.linspace(0, length, count + 1).astype(int)
+    indices = [
+        (slice(None),) * axis + (slice(start, stop),)
+        for start, stop in zip(edges[:-1], edges[1:]) if stop > start
+    ]
+    if workers <= 1 or len(indices) <= 1:
+        return [function(index) for index in indices]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(function, indices))
+
+
+def _label_indices(seg_volume):
+    """Return seg_volume as an integer array usable as LUT indices"""
+    seg_volume = np.asanyarray(seg_volume)
+    if seg_volume.dtype.kind not in "iu":
+        seg_volume = seg_volume.astype(np.int32)
+    return seg_volume
+
+
+def label_lookup(seg_volume, labels, values, fill, dtype):
+    """
+    Map every voxel of a label volume through a lookup table
+
+        Parameters:
+            seg_volume (a numpy array): integer label volume
+            labels (a list): labels to map (ex [181, 185])
+            values (a list): output value for each label
+            fill: output value for every other label
+            dtype (a numpy dtype): output dtype
+        Returns:
+            a numpy array of the same shape as seg_volume
+    """
+    labels = [int(label) for label in labels]
+    # the last entry catches every label above max(labels) (mode="clip")
+    lut = np.full(max(labels, default=0) + 2, fill, dtype=dtype)
+    lut[labels] = values
+    return np.take(lut, _label_indices(seg_volume), mode="clip")
+
+
+def extract_roi_by_label(seg_volume, labels, workers=1):
     """
     Extract ROI by label
 
@@ -35,184 +119,694 @@ def extract_roi_by_label(seg_volume, labels):
                                         typically filled with regions identified
                                         by numerical labels
             labels (a list): list of the labels to extract (ex [181, 185])
+            workers (an integer): threads (slabs of the volume)
         Returns:
             label_seg_volume (a numpy array): a volume of the same shape as seg_volume 
                                 containing only the regions corresponding
                                 to the integers in labels
     """
-    label_seg_volume = None
+    labels = [int(label) for label in labels]
+    seg_volume = _label_indices(seg_volume)
+    dtype = np.promote_types(
+        seg_volume.dtype, np.min_scalar_type(max(labels, default=0))
+    )
+    label_seg_volume = np.empty_like(seg_volume, dtype=dtype)
 
-    for label in labels:
-        tmp_label_seg_volume = np.where(
-            seg_volume == int(label), int(label), 0
-        )
-        if label_seg_volume is None:
-            label_seg_volume = tmp_label_seg_volume > 0
-        label_seg_volume = np.where(
-            tmp_label_seg_volume > 0, tmp_label_seg_volume, label_seg_volume
+    def extract(index):
+        label_seg_volume[index] = label_lookup(
+            seg_volume[index], labels, labels, 0, dtype
         )
+    _slab_map(extract, seg_volume, workers)
     return label_seg_volume
 
 
-def launch_assemblynet(nifti_path):
+def label_bounding_box(seg_volume, workers=1):
     """
-    Runs the AssemblyNet docker
-    (https://github.com/volBrain/AssemblyNet)
-    on the NIfTI file 
+    Bounding box of the non-zero voxels of a label volume, from its
+    projections along each axis
 
         Parameters:
-            nifti_path (a string): NIfTI path
+            seg_volume (a numpy array): label volume
+            workers (an integer): threads (slabs of the volume)
+        Returns:
+            box (a tuple): one slice per axis, None if there is no label
     """
-    print("Launch assemblynet")
-    in_directory = os.path.dirname(os.path.realpath(nifti_path))
-    file_name = os.path.basename(nifti_path)
+    seg_volume = np.asanyarray(seg_volume)
+    axes = range(seg_volume.ndim)
+    slab_axis = int(np.argmax(np.abs(seg_volume.strides)))
+
+    def projections(index):
+        return [
+            np.any(seg_volume[index],
+                   axis=tuple(other for other in axes if other != axis))
+            for axis in axes
+        ]
+    slabs = _slab_map(projections, seg_volume, workers, slab_axis)
+    box = []
+    for axis in axes:
+        if axis == slab_axis:
+            projection = np.concatenate([slab[axis] for slab in slabs])
+        else:
+            projection = np.logical_or.reduce([slab[axis] for slab in slabs])
+        nonzero = np.flatnonzero(projection)
+        if nonzero.size == 0:
+            return None
+        box.append(slice(nonzero[0], nonzero[-1] + 1))
+    return tuple(box)
 
-    id_u = (
-        subprocess.check_output(["id", "-u"])
-        .decode("utf-8")
-        .replace("\n", "")
+
+def _burn(out_array, seg_volume, labels, window_center, offset):
+    """Burn the labels into out_array in place, see burn_labels"""
+    seg_volume = _label_indices(seg_volume)
+    selected = label_lookup(seg_volume, labels, True, False, bool)
+    values = np.array(
+        [window_center + offset * (i + 2) for i in range(len(labels))],
+        dtype=out_array.dtype
     )
-    id_g = (
-        subprocess.check_output(["id", "-g"])
-        .decode("utf-8")
-        .replace("\n", "")
+    # labels absent from the lookup table never reach the gather below
+    out_array[selected] = label_lookup(
+        seg_volume[selected], labels, values, 0, out_array.dtype
     )
-    cmd = [
-        "docker",
-        "run",
-        "--rm",
-        "--user",
-        id_u + ":" + id_g,
-        "-v",
-        in_directory + ":/data",
-        "volbrain/assemblynet:1.0.0",
-        "/data/" + file_name
-    ]
-    print(cmd)
-    cmd_string = " ".join(cmd)
-    os.system(cmd_string)
-    # p = subprocess.Popen(
-    #     cmd,
-    #     shell=False,
-    #     bufsize=-1,
-    #     stdin=subprocess.PIPE,
-    #     stdout=subprocess.PIPE,
-    #     stderr=subprocess.PIPE,
-    #     close_fds=True,
-    # )
-
-
-def main_processing(input_dir_path, output_path, labels):
+
+
+def burn_labels(image, seg_volume, labels, window_center, offset,
+                dtype=np.float32):
     """
-    Launch main processing (convert to NIfTI,
-    segment image using AssemblyNet, prepare result for PRIDE)
+    Burn the labelled regions into an image: voxels of labels[i] are set to
+    window_center + offset * (i + 2), all the others keep the image value.
+    Runtime and memory do not depend on the number of labels.
+
+        Parameters:
+            image (a numpy array): (scaled) image, same shape as seg_volume
+            seg_volume (a numpy array): label volume
+            labels (a list): list of the labels to burn (ex [181, 185])
+            window_center (a float): window center of the image
+            offset (a float): intensity step between two labels
+            dtype (a numpy dtype): output dtype
+        Returns:
+            out_array (a numpy array): burned image
+    """
+    labels = [int(label) for label in labels]
+    out_array = np.array(image, dtype=dtype)
+    _burn(out_array, seg_volume, labels, window_center, offset)
+    return out_array
+
+
+def load_config():
+    """
+    Read config/config.json
+
+        Returns:
+            data (a dictionary): configuration
+    """
+    config_file = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+        "config",
+        "config.json",
+    )
+    with open(config_file, encoding="utf-8") as my_json:
+        return json.load(my_json)
+
+
+def processing_options(data):
+    """
+    Optional main_processing arguments from the configuration
+
+        Parameters:
+            data (a dictionary): configuration (see load_config)
+        Returns:
+            options (a dictionary): main_processing keyword arguments
+    """
+    return {
+        "cache_dir": data.get("CacheDirectory"),
+        "cache_max_size": int((data.get("CacheMaxSizeGB") or 0) * 1024 ** 3),
+        "backend": backend_from_config(data),
+        "dtypes": {**DTYPES, **(data.get("Dtypes") or {})},
+        "staging": data.get("Staging"),
+        "volume_workers": data.get("VolumeWorkers") or os.cpu_count() or 1,
+    }
+
+
+def _lap(timings, stage, start):
+    """Add the time elapsed since start to timings[stage], return now"""
+    now = time.perf_counter()
+    timings[stage] = timings.get(stage, 0) + now - start
+    return now
+
+
+class ProcessingCancelled(Exception):
+    """Raised when the processing is cancelled by the user"""
+
+
+def _check_cancel(cancel):
+    """Raise ProcessingCancelled if cancel (a threading.Event) is set"""
+    if cancel is not None and cancel.is_set():
+        raise ProcessingCancelled("Processing cancelled")
+
+
+def _no_progress(stage, message):
+    """Default progress callback of main_processing"""
+
+
+def _measure(recorder, stage, case):
+    """Measure a stage with recorder (an instrument.Recorder) if not None"""
+    if recorder is None:
+        return contextlib.nullcontext()
+    return recorder.stage(stage, case)
+
+
+def write_nifti_slabs(img, nifti_path, dtype="<f4"):
+    """
+    Write an image (typically a memory-mapped PAR/REC) as a NIfTI file,
+    slab by slab along its last axis: only one scaled slab is in memory
+    at a time instead of the whole scaled volume and its cast copy
+
+        Parameters:
+            img (a nibabel image): image to convert, its dataobj must
+                                   support slicing (ArrayProxy)
+            nifti_path (a string): NIfTI path (.nii)
+            dtype (a string): NIfTI data type
+    """
+    import nibabel as nib
+
+    nifti = nib.Nifti1Image(img.dataobj, img.affine, header=img.header)
+    nifti.set_data_dtype(dtype)
+    nifti.update_header()
+    header = nifti.header
+    # the slab values are already scaled
+    header.set_slope_inter(1, 0)
+    shape = img.shape
+    slice_bytes = np.dtype(dtype).itemsize * int(np.prod(shape[:-1]))
+    slab_size = max(1, NIFTI_SLAB_BYTES // slice_bytes)
+    with open(nifti_path, "wb") as nifti_file:
+        header.write_to(nifti_file)
+        nifti_file.seek(header.get_data_offset())
+        for first in range(0, shape[-1], slab_size):
+            slab = np.asarray(
+                img.dataobj[..., first:first + slab_size], dtype=dtype
+            )
+            # NIfTI data is in Fortran order: a slab of the last axis
+            # is contiguous in the file
+            nifti_file.write(slab.tobytes(order="F"))
+
+
+def _load_sagittal(case, dtype):
+    """
+    Load the sagittal XML/REC of a case
+
+        Parameters:
+            case (a dictionary): see prepare_case
+            dtype (a numpy dtype): dtype of the returned image
+        Returns:
+            in_array (a numpy array): image (xmlrec's float64 volume is
+                                      only a temporary)
+            general_info (a dictionary): header of the series
+            series_info (a list): header of each image
+    """
+    # (imported when needed: nibabel and xmlrec are slow to import and not
+    # needed by the command line before the processing starts)
+    import xmlrec as xml  # ask your Philips clinical scientist to obtain thoses functions
+
+    # Load XML REC to get right general_info and series_info structures
+    print("Loading XML REC")
+    images, general_info, series_info = xml.read_xmlrec(case["path_to_xml"])
+    in_array = np.squeeze(
+        xml.to_nd_array(images, general_info, series_info)
+    ).astype(dtype, copy=False)
+    return in_array, general_info, series_info
+
+
+def _read_template(path_to_xml):
+    """
+    Header of a Cor or Tra export read by xmlrec (these headers are given
+    back to xml.write_xmlrec), its pixels are dropped
+    """
+    import xmlrec as xml  # ask your Philips clinical scientist to obtain thoses functions
+
+    _, general_info, series_info = xml.read_xmlrec(path_to_xml)
+    return general_info, series_info
+
+
+def _load_templates(case):
+    """
+    Start reading the Cor and Tra XML/REC (geometry templates of the
+    coronal and transversal outputs) in the background, one after the
+    other, finish_case waits for them. The Cor and Tra exports are
+    optional, without them the geometry is computed from the sagittal
+    header.
+    """
+    executor = ThreadPoolExecutor(max_workers=1)
+    case["templates"] = {}
+    for orientation in ("Cor", "Tra"):
+        paths_to_xml = glob.glob(
+            os.path.join(case["input_dir_path"], orientation, "*.XML"))
+        if paths_to_xml:
+            case["templates"][orientation] = (
+                paths_to_xml[0],
+                executor.submit(_read_template, paths_to_xml[0])
+            )
+    executor.shutdown(wait=False)
+
+
+def prepare_case(input_dir_path, output_path, cache_dir=None,
+                 checkpoints=None, backend=None, staging=None):
+    """
+    First stage of the processing: write the PAR file and the NIfTI file
+    to segment (unless the segmentation is already done or cached)
 
         Parameters:
             input_dir_path (a string): input directory path with XML/REC 
                                        images from PRIDE (in three 
                                        sub-directory Sag, Cor, Tra)
             output_path (a string): output path
-            lables (a list): list of the labels to extract (ex [181, 185]) 
+            cache_dir (a string): segmentation cache directory
+                                  (None to always segment)
+            checkpoints (a StageManifest): stages already run in output_path
+                                           (default: read from output_path)
+            backend (a backends.Backend): segmentation backend, its tag is
+                                          part of the cache key (default:
+                                          the AssemblyNet docker)
+            staging (a dictionary): "Directory", "MaxSizeGB" and "Keep" of
+                                    the staging of the NIfTI and of the
+                                    segmentation in a tmpfs (None: written
+                                    in output_path, see staging.py)
+        Returns:
+            case (a dictionary): state of the case passed to the next stages
     """
-
+    if checkpoints is None:
+        checkpoints = StageManifest(output_path)
+    tag = ASSEMBLYNET_IMAGE if backend is None else backend.tag
     input_image_path = os.path.join(input_dir_path, "Sag")
     path_to_xml = glob.glob(os.path.join(input_image_path, "*.XML"))[0]
-    # Creation of PAR file 
-    par_files = glob.glob(os.path.join(input_image_path, "*.PAR"))
-    if not par_files:
-        print("Converting XML to PAR")
-        # import xml2par # make par from xml (opens dialog box
-        main_xml2par(path_to_xml)
-    else:
+    path_to_rec = glob.glob(os.path.join(input_image_path, "*.REC"))[0]
+    path_to_par = os.path.splitext(path_to_xml)[0] + ".PAR"
+    case = {
+        "input_dir_path": input_dir_path,
+        "output_path": output_path,
+        "path_to_xml": path_to_xml,
+        "checkpoints": checkpoints,
+        # what the segmentation depends on
+        "segmentation_inputs": [path_to_rec, path_to_par],
+        "segmentation_params": {"image": tag},
+        "timings": {},
+    }
+    # read while the case is prepared and segmented
+    _load_templates(case)
+    timings = case["timings"]
+    start = time.perf_counter()
+
+    # Creation of PAR file from the XML header (the REC is only read by
+    # finish_case, a prepared case waiting for its segmentation does not
+    # hold the image). finish_case parses the XML a second time: the pixels
+    # only come from xml.read_xmlrec, which parses the XML itself, and its
+    # headers are the ones given back to xml.write_xmlrec. The PAR is only
+    # written when the XML changed (checkpoint), i.e. once per export.
+    if checkpoints.up_to_date("par", [path_to_xml], {}):
         print("PAR file already existing")
+    else:
+        print("Converting XML to PAR")
+        main_xmlrec2par(path_to_xml, *read_xml_header(path_to_xml))
+        checkpoints.record("par", [path_to_xml], {}, [path_to_par])
+    start = _lap(timings, "load", start)
 
-    # Load XML REC to get right general_info and series_info structures
-    print("Loading XML REC")
-    images, general_info, series_info = xml.read_xmlrec(path_to_xml)
-    in_array = np.squeeze(xml.to_nd_array(images, general_info, series_info))
+    case["path_to_rois"] = []
+    if checkpoints.up_to_date(
+            "segmentation",
+            case["segmentation_inputs"],
+            case["segmentation_params"]):
+        print("Segmentation already done")
+        case["path_to_rois"] = checkpoints.outputs("segmentation")
+        return case
 
     # Open parrec with nibabel needed to have right orientation (use .PAR file)
-    path_to_rec = glob.glob(os.path.join(input_image_path, "*.REC"))[0]
-    img = nib.load(path_to_rec)
+    # The REC is memory-mapped, pixels are only read when converted
+    import nibabel as nib
+
+    img = nib.load(path_to_rec, mmap=True)
 
     assemblynet_out_path = os.path.join(output_path, "AssemblyNet")
     if not os.path.exists(assemblynet_out_path):
         os.makedirs(assemblynet_out_path)
-    # Convert rec to nii
-    print("Converting to nii")
     nifti_path = os.path.join(
         assemblynet_out_path,
         path_to_rec.split("/")[-1].replace(".REC", ".nii")
     )
-    nifti = nib.Nifti1Image(img.dataobj, img.affine, header=img.header)
-    nifti.set_data_dtype("<f4")
-    nifti.to_filename(nifti_path)
-    print("Nii written")
+    case["assemblynet_out_path"] = assemblynet_out_path
+    case["nifti_path"] = nifti_path
+
+    # A segmentation of the same REC may already be in the cache
+    case["cache_key"] = None
+    if cache_dir:
+        case["cache_key"] = segmentation_key(
+            path_to_rec, img.affine, img.shape, tag
+        )
+        cached_path = label_path(nifti_path)
+        if get_cached_segmentation(cache_dir, case["cache_key"], cached_path):
+            print("Segmentation found in cache")
+            case["path_to_rois"] = [cached_path]
+            checkpoints.record(
+                "segmentation",
+                case["segmentation_inputs"],
+                case["segmentation_params"],
+                case["path_to_rois"]
+            )
+            return case
+
+    # the NIfTI and the segmenter outputs may be staged in a tmpfs (about
+    # three times the float32 volume), segment_case keeps the label volume
+    case["staging_path"] = tmpfs.acquire(
+        staging, 3 * 4 * int(np.prod(img.shape))
+    )
+    case["staging_keep"] = (staging or {}).get("Keep") or tmpfs.KEEP
+    if case["staging_path"] is not None:
+        print(f"Staging in {case['staging_path']}")
+        nifti_path = os.path.join(
+            case["staging_path"], os.path.basename(nifti_path)
+        )
+        case["nifti_path"] = nifti_path
+        print("Converting to nii")
+        write_nifti_slabs(img, nifti_path, "<f4")
+        _lap(timings, "nifti", start)
+        return case
+
+    nifti_inputs = [path_to_rec, path_to_par]
+    if checkpoints.up_to_date("nifti", nifti_inputs, {"dtype": "<f4"}):
+        print("Nii already written")
+    else:
+        # Convert rec to nii
+        print("Converting to nii")
+        write_nifti_slabs(img, nifti_path, "<f4")
+        checkpoints.record(
+            "nifti", nifti_inputs, {"dtype": "<f4"}, [nifti_path]
+        )
+        print("Nii written")
+    _lap(timings, "nifti", start)
+    return case
+
+
+def segment_case(case, cache_dir=None, cache_max_size=0, backend=None,
+                 log=None, cancel=None, recorder=None):
+    """
+    Second stage of the processing: segment the NIfTI file written by
+    prepare_case (nothing to do if the segmentation is already done or
+    was cached)
+
+        Parameters:
+            case (a dictionary): see prepare_case
+            cache_dir (a string): segmentation cache directory
+                                  (None to always segment)
+            cache_max_size (an integer): segmentation cache size cap in bytes
+                                         (0: no cap)
+            backend (a backends.Backend): segmentation backend (default:
+                                          the AssemblyNet docker)
+            log (a function): called with each line of the segmenter output
+            cancel (a threading.Event): stops the segmentation when set
+            recorder (an instrument.Recorder): records the resource use of
+                                               the segmentation job
+    """
+    if case["path_to_rois"]:
+        return
+    start = time.perf_counter()
 
     # Segmentation happens here
     # Will write all AssemblyNet output files in output_path
-    launch_assemblynet(nifti_path)
+    if backend is None:
+        backend = DockerBackend()
+    usage = {"case": case["output_path"], "stage": backend.stage}
+    try:
+        job = backend.submit(
+            case["nifti_path"], log, cancel,
+            None if recorder is None else usage
+        )
+        try:
+            case["path_to_rois"] = [backend.result(job)]
+        except Exception:
+            _check_cancel(cancel)
+            raise
+        if case.get("staging_path") is not None:
+            # only the files kept leave the staging area
+            tmpfs.keep(
+                case["staging_path"], case["assemblynet_out_path"],
+                case["staging_keep"]
+            )
+            case["path_to_rois"] = [os.path.join(
+                case["assemblynet_out_path"],
+                os.path.basename(case["path_to_rois"][0])
+            )]
+    finally:
+        tmpfs.release(case.get("staging_path"))
+        case["staging_path"] = None
+    if recorder is not None:
+        usage["wall_seconds"] = time.perf_counter() - start
+        recorder.add(usage)
+    if case["cache_key"]:
+        cache_segmentation(
+            cache_dir, case["cache_key"], case["path_to_rois"][0],
+            cache_max_size
+        )
+    case["checkpoints"].record(
+        "segmentation",
+        case["segmentation_inputs"],
+        case["segmentation_params"],
+        case["path_to_rois"][:1]
+    )
+    _lap(case["timings"], "segmentation", start)
 
-    # Load data from segmented nifti
-    print("Loading modified Nii")
-    path_to_rois = glob.glob(os.path.join(
-        assemblynet_out_path, "native_structures_*.nii.gz"))
-    mod_img = nib.load(path_to_rois[0])
-    mod_img_array = np.array(mod_img.get_fdata())
-    # image matrix in nifti not in the same orientation as REC
-    mod_img_array = np.transpose(mod_img_array, (1, 0, 2))
 
-    # Extract roi
-    extracted_roi = extract_roi_by_label(mod_img_array, labels)
+def mask_volume(in_array, seg_array, labels, series_info,
+                dtype=DTYPES["Image"], workers=1):
+    """
+    Scale the image below its window and burn the labels above it
 
-    # Mask image
+        Parameters:
+            in_array (a numpy array): image
+            seg_array (a numpy array): label volume, same orientation
+            labels (a list): list of the labels to extract (ex [181, 185])
+            series_info (a list): header of the image (window)
+            dtype (a numpy dtype): dtype of the scaling and of the result
+            workers (an integer): threads, each step runs on slabs of the
+                                  volume written in place
+        Returns:
+            out_array (a numpy array): masked image
+    """
     # Needs scaling to have mask brighter than the image
-    max_value = np.max(in_array)
-    window_width = series_info[0]["Window Width"]["Value"]
-    window_center = series_info[0]["Window Center"]["Value"]
+    max_value = max(_slab_map(
+        lambda index: np.max(in_array[index]), in_array, workers
+    ))
+    window_width = float(find_info(series_info[0], "Window Width"))
+    window_center = float(find_info(series_info[0], "Window Center"))
     offset = 0.5 * window_width / (len(labels) + 1)
     scaled_max = max_value - window_center
-    out_array = in_array * scaled_max / max_value
+    # one array of the image dtype, scaled in place
+    out_array = np.empty_like(in_array, dtype=dtype)
+
+    def scale(index):
+        out_slab = out_array[index]
+        np.multiply(in_array[index], scaled_max, out=out_slab, dtype=dtype)
+        out_slab /= max_value
+    _slab_map(scale, out_array, workers)
+
+    # Extract masks and burn them into the image, only within the bounding
+    # box of the segmentation (most of the field of view is air): the
+    # label lookups run on the sub-block, written in place through a view
+    box = label_bounding_box(seg_array, workers)
+    if box is not None:
+        out_box = out_array[box]
+        seg_box = seg_array[box]
+        labels = [int(label) for label in labels]
+        _slab_map(
+            lambda index: _burn(out_box[index], seg_box[index], labels,
+                                window_center, offset),
+            out_box, workers
+        )
+    return out_array
 
-    # Extract masks
-    for i in np.arange(len(labels)):
-        out_array = np.where(
-            extracted_roi == labels[i], window_center +
-            offset * (i + 2), out_array
+
+def write_outputs(final_out_path, outputs):
+    """
+    Write the masked XML/REC with xmlrec, one file after the other (only
+    one contiguous copy of a view at a time). xmlrec writes the XML and
+    the rescaled REC pixels as PRIDE expects them, it is not replaced by
+    a writer of this module.
+
+        Parameters:
+            final_out_path (a string): directory of the results
+            outputs (a list): (orientation, volume view, general_info,
+                              series_info) of each file, "_Seg" is added
+                              to the protocol names
+    """
+    import xmlrec as xml  # ask your Philips clinical scientist to obtain thoses functions
+
+    for orientation, out_view, general_info, series_info in outputs:
+        print(f"Saving new {orientation.lower()} REC")
+        general_info["Protocol Name"]["Value"] = general_info["Protocol Name"]["Value"] + "_Seg"
+        xml.write_xmlrec(
+            os.path.join(final_out_path, orientation + "_masked.xml"),
+            general_info, series_info, np.ascontiguousarray(out_view)
         )
 
+
+def finish_case(case, labels, dtypes=None, volume_workers=1):
+    """
+    Last stage of the processing: burn the labels into the image, write
+    the sagittal, coronal and transversal XML/REC for PRIDE and the
+    volumetrics of the labels (see volumetrics.py)
+
+        Parameters:
+            case (a dictionary): see prepare_case
+            labels (a list): list of the labels to extract (ex [181, 185])
+            dtypes (a dictionary): "Image" and "Labels" dtypes (see DTYPES)
+            volume_workers (an integer): threads of the masking
+        Returns:
+            final_out_path (a string): directory of the results
+    """
+    labels = [int(label) for label in labels]
+    dtypes = {**DTYPES, **(dtypes or {})}
+    timings = case["timings"]
+    start = time.perf_counter()
+    final_out_path = os.path.join(case["output_path"], "results_to_export")
+    templates = case["templates"]
+    export_inputs = [
+        case["path_to_xml"],
+        case["segmentation_inputs"][0],
+        case["path_to_rois"][0],
+    ] + [path_to_xml for path_to_xml, _ in templates.values()]
+    # the dtypes change the masked image (not the number of threads)
+    export_params = {
+        "labels": labels,
+        "dtypes": {name: np.dtype(dtype).name
+                   for name, dtype in sorted(dtypes.items())},
+    }
+    if case["checkpoints"].up_to_date(
+            "export", export_inputs, export_params):
+        print("Results already up to date")
+        return final_out_path
+
+    in_array, general_info, series_info = _load_sagittal(
+        case, dtypes["Image"]
+    )
+
+    # Load data from segmented nifti
+    print("Loading modified Nii")
+    import nibabel as nib
+
+    # integer labels, read in the labels dtype (not as float64 when the
+    # NIfTI has a scaling)
+    mod_img = nib.load(case["path_to_rois"][0])
+    mod_img_array = np.asarray(mod_img.dataobj, dtype=dtypes["Labels"])
+    # volumes of the labels, from the label volume already in memory
+    volumetrics_paths = write_volumetrics(
+        case["output_path"],
+        label_volumetrics(mod_img_array, labels, mod_img.header.get_zooms())
+    )
+    # image matrix in nifti not in the same orientation as REC
+    mod_img_array = np.transpose(mod_img_array, (1, 0, 2))
+
+    out_array = mask_volume(
+        in_array, mod_img_array, labels, series_info, dtypes["Image"],
+        volume_workers
+    )
+    start = _lap(timings, "masking", start)
+
     # Saving XMLREC containing masked array
-    final_out_path = os.path.join(output_path, "results_to_export")
     if not os.path.exists(final_out_path):
         os.makedirs(final_out_path)
 
-    print("Saving new sagittal REC")
-    general_info["Protocol Name"]["Value"] = general_info["Protocol Name"]["Value"] + "_Seg"
-    xml.write_xmlrec(os.path.join(final_out_path, "Sagittal_masked.xml"),
-                     general_info, series_info, np.ascontiguousarray(out_array))
-
-    # outArray is oriented as the original scan (Sag ?)
-    # Need to produce the other 2 orientations
-    # -- first coro
-    out_array_coro = np.fliplr(np.transpose(out_array, (0, 2, 1)))
-    coro_path = os.path.join(input_dir_path, "Cor")
-    path_to_xml = glob.glob(os.path.join(coro_path, "*.XML"))[0]
-    images, general_info, series_info = xml.read_xmlrec(path_to_xml)
-
-    general_info["Protocol Name"]["Value"] = general_info["Protocol Name"]["Value"] + "_Seg"
-    xml.write_xmlrec(os.path.join(final_out_path, "Coronal_masked.xml"),
-                     general_info, series_info, np.ascontiguousarray(out_array_coro))
-
-    # -- then transversal
-    out_array_tra = np.flip(np.flip(np.transpose(out_array, (1, 2, 0)), 1), 2)
-    tra_path = os.path.join(input_dir_path, "Tra")
-    path_to_xml = glob.glob(os.path.join(tra_path, "*.XML"))[0]
-    images, general_info, series_info = xml.read_xmlrec(path_to_xml)
-
-    general_info["Protocol Name"]["Value"] = general_info["Protocol Name"]["Value"] + "_Seg"
-    xml.write_xmlrec(os.path.join(final_out_path, "Transversal_masked.xml"),
-                     general_info, series_info, np.ascontiguousarray(out_array_tra))
+    # outArray is oriented as the original scan, the other 2 orientations
+    # are views of it with the header of the Cor/Tra export when there is
+    # one, otherwise with a header computed from the sagittal one
+    sag_axes = slice_axes(series_info)
+    outputs = [("Sagittal", out_array, general_info, series_info)]
+    for orientation, export in (("Coronal", "Cor"), ("Transversal", "Tra")):
+        if export in templates:
+            # only the header is kept; PRIDE exports its volumes with the
+            # nominal sagittal axes
+            header = templates[export][1].result()
+            out_view = reorient(out_array, AXES["Sagittal"], AXES[orientation])
+        else:
+            header = derive_header(
+                general_info, series_info, sag_axes, orientation
+            )
+            out_view = reorient(out_array, sag_axes, AXES[orientation])
+        outputs.append((orientation, out_view, *header))
+
+    write_outputs(final_out_path, outputs)
+    case["checkpoints"].record(
+        "export",
+        export_inputs,
+        export_params,
+        [
+            path
+            for name in ("Sagittal_masked", "Coronal_masked",
+                         "Transversal_masked")
+            for path in glob.glob(os.path.join(final_out_path, name + ".*"))
+        ] + volumetrics_paths
+    )
+    _lap(timings, "write", start)
+    return final_out_path
+
+
+def main_processing(input_dir_path, output_path, labels,
+                    cache_dir=None, cache_max_size=0, backend=None,
+                    force_stages=(), progress=None, cancel=None,
+                    recorder=None, dtypes=None, staging=None,
+                    volume_workers=1):
+    """
+    Launch main processing (convert to NIfTI,
+    segment image using AssemblyNet, prepare result for PRIDE)
+
+        Parameters:
+            input_dir_path (a string): input directory path with XML/REC 
+                                       images from PRIDE (in three 
+                                       sub-directory Sag, Cor, Tra)
+            output_path (a string): output path
+            lables (a list): list of the labels to extract (ex [181, 185]) 
+            cache_dir (a string): segmentation cache directory
+                                  (None to always segment)
+            cache_max_size (an integer): segmentation cache size cap in bytes
+                                         (0: no cap)
+            backend (a backends.Backend): segmentation backend (default:
+                                          the AssemblyNet docker)
+            force_stages (a list): stages run even if up to date
+                                   (see checkpoint.STAGES, or "all")
+            progress (a function): called with (stage, message) when a
+                                   stage starts ("prepare", "segmentation",
+                                   "export", "done") and with each line of
+                                   the docker output
+            cancel (a threading.Event): cancels the processing when set
+            recorder (an instrument.Recorder): records the wall time, CPU
+                                               time, peak RSS and I/O of
+                                               each stage (None: not
+                                               recorded)
+            dtypes (a dictionary): see finish_case
+            staging (a dictionary): see prepare_case
+            volume_workers (an integer): see finish_case
+        Returns:
+            timings (a dictionary): duration (s) of each stage
+    """
+    if progress is None:
+        progress = _no_progress
+    checkpoints = StageManifest(output_path, force_stages)
+    progress("prepare", "Converting to NIfTI")
+    with _measure(recorder, "prepare", output_path):
+        case = prepare_case(
+            input_dir_path, output_path, cache_dir, checkpoints, backend,
+            staging
+        )
+    _check_cancel(cancel)
+    progress("segmentation", "Segmenting")
+    with _measure(recorder, "segmentation", output_path):
+        segment_case(
+            case, cache_dir, cache_max_size, backend,
+            lambda line: progress("segmentation", line), cancel, recorder
+        )
+    _check_cancel(cancel)
+    progress("export", "Writing XML/REC")
+    with _measure(recorder, "export", output_path):
+        final_out_path = finish_case(case, labels, dtypes, volume_workers)
+    progress("done", "Done")
 
     print(
         f"End of processing. The results to used in PRIDE are in {final_out_path}"
     )
+    return case["timings"]
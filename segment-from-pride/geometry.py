@@ -0,0 +1,209 @@
+"""
+    Orientation engine: reslices the sagittal volume into the coronal and
+    transversal orientations and computes their XML geometry (slice
+    offcentres, angulation, spacing) from the sagittal series_info, so
+    that the Cor and Tra PRIDE exports are not needed
+
+    Each orientation is described by the patient directions its array axes
+    (rows, columns, slices) point to, with the letters of the Philips
+    patient axes: A/P (ap), F/H (fh), R/L (rl). These are the axes of
+    ACQ_TO_PSL in nibabel.parrec.
+
+    Main functions:
+        - slice_axes
+        - reorient
+        - derive_header
+
+    ----- LICENSE -----
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License (GPL) as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version. For more detail see the
+    GNU General Public License at <http://www.gnu.org/licenses/>.
+    -----------------
+
+    Developed by A. Delphin, E. Gourieux, J. Pietras, L. Lamalle
+    May 2024
+"""
+
+import copy
+import numpy as np
+
+from xml2par import find_info
+
+# directions of the (rows, columns, slices) axes of each orientation
+AXES = {
+    "Sagittal": ("F", "P", "R"),
+    "Coronal": ("F", "L", "P"),
+    "Transversal": ("P", "L", "H"),
+}
+# unit vectors in the (ap, fh, rl) patient coordinates of PRIDE
+DIRECTIONS = {
+    "P": np.array([1.0, 0.0, 0.0]),
+    "A": np.array([-1.0, 0.0, 0.0]),
+    "H": np.array([0.0, 1.0, 0.0]),
+    "F": np.array([0.0, -1.0, 0.0]),
+    "L": np.array([0.0, 0.0, 1.0]),
+    "R": np.array([0.0, 0.0, -1.0]),
+}
+OPPOSITE = {"P": "A", "A": "P", "H": "F", "F": "H", "L": "R", "R": "L"}
+
+
+def _vector(info, name):
+    """(ap, fh, rl) vector of a header entry, ex 'Offcenter'"""
+    return np.array([
+        float(find_info(info, name + " " + axis)) for axis in ("AP", "FH", "RL")
+    ])
+
+
+def rotation(info):
+    """
+    Rotation of the slice stack (as in nibabel.parrec)
+
+        Parameters:
+            info (a dictionary): header with the 'Angulation AP/FH/RL'
+        Returns:
+            rot (a 3x3 array): rotation in (ap, fh, rl) coordinates
+    """
+    # nibabel.eulerangles imports the whole of nibabel
+    from nibabel.eulerangles import euler2mat
+
+    ap_rot, fh_rot, rl_rot = np.deg2rad(_vector(info, "Angulation"))
+    return euler2mat(z=rl_rot) @ euler2mat(x=ap_rot) @ euler2mat(y=fh_rot)
+
+
+def slice_axes(series_info, orientation="Sagittal"):
+    """
+    Axes of an exported volume, the slice direction being taken from the
+    slice offcentres
+
+        Parameters:
+            series_info (a list): header of each slice
+            orientation (a string): slice orientation of the export
+        Returns:
+            axes (a tuple): directions of the rows, columns and slices
+    """
+    axes = AXES[orientation]
+    if len(series_info) < 2:
+        return axes
+    step = _vector(series_info[-1], "Offcenter") \
+        - _vector(series_info[0], "Offcenter")
+    # step in the unrotated patient axes
+    step = rotation(series_info[0]).T @ step
+    if step @ DIRECTIONS[axes[2]] < 0:
+        axes = axes[:2] + (OPPOSITE[axes[2]],)
+    return axes
+
+
+def reorient(array, source_axes, target_axes):
+    """
+    Reslice a volume in another orientation, without copying it
+
+        Parameters:
+            array (a 3D array): volume (rows, columns, slices)
+            source_axes (a tuple): directions of the axes of array
+            target_axes (a tuple): directions of the axes of the result
+        Returns:
+            a strided view of array
+    """
+    order = []
+    flips = []
+    for direction in target_axes:
+        for axis, source in enumerate(source_axes):
+            if source in (direction, OPPOSITE[direction]):
+                order.append(axis)
+                flips.append(source != direction)
+    view = np.transpose(array, order)
+    return view[tuple(slice(None, None, -1) if flip else slice(None)
+                      for flip in flips)]
+
+
+def _spacings(series_info, axes):
+    """Voxel size along each patient axis (A/P, F/H, R/L)"""
+    col_spacing, row_spacing = (
+        float(value) for value in find_info(series_info[0], "Pixel Spacing").split()
+    )
+    if len(series_info) > 1:
+        slice_spacing = np.linalg.norm(
+            _vector(series_info[1], "Offcenter")
+            - _vector(series_info[0], "Offcenter")
+        )
+    else:
+        slice_spacing = float(find_info(series_info[0], "Slice Thickness")) \
+            + float(find_info(series_info[0], "Slice Gap"))
+    spacings = {}
+    for direction, spacing in zip(axes, (row_spacing, col_spacing,
+                                         slice_spacing)):
+        spacings[direction] = spacings[OPPOSITE[direction]] = spacing
+    return spacings
+
+
+def _set(info, name, value):
+    """Set a header value, as text if the header holds text"""
+    if name not in info:
+        return
+    old = info[name]["Value"]
+    if isinstance(old, str):
+        if isinstance(value, (list, tuple, np.ndarray)):
+            value = " ".join(f"{float(v):.3f}" for v in value)
+        elif isinstance(value, (int, np.integer)):
+            value = str(value)
+        else:
+            value = f"{value:.3f}"
+    elif isinstance(value, (list, tuple, np.ndarray)):
+        value = np.asarray(value, dtype=np.asarray(old).dtype)
+    else:
+        value = type(old)(value)
+    info[name]["Value"] = value
+
+
+def derive_header(general_info, series_info, source_axes, orientation):
+    """
+    Header of the volume resliced by reorient in another orientation:
+    same volume centre and angulation, one image per new slice
+
+        Parameters:
+            general_info (a dictionary): header of the source volume
+            series_info (a list): header of each slice of the source volume,
+                                  one image per slice
+            source_axes (a tuple): directions of the source axes
+                                   (see slice_axes)
+            orientation (a string): "Coronal", "Transversal" or "Sagittal"
+        Returns:
+            general_info (a dictionary): new header (copy)
+            series_info (a list): new header of each slice (copies)
+    """
+    target_axes = AXES[orientation]
+    n_rows = int(find_info(series_info[0], "Resolution Y"))
+    n_cols = int(find_info(series_info[0], "Resolution X"))
+    sizes = {}
+    for direction, size in zip(source_axes, (n_rows, n_cols,
+                                             len(series_info))):
+        sizes[direction] = sizes[OPPOSITE[direction]] = size
+    spacings = _spacings(series_info, source_axes)
+    rows, cols, slices = target_axes
+
+    rot = rotation(series_info[0])
+    centre = np.mean(
+        [_vector(info, "Offcenter") for info in series_info], axis=0
+    )
+    step = spacings[slices] * (rot @ DIRECTIONS[slices])
+
+    new_general_info = copy.deepcopy(general_info)
+    _set(new_general_info, "Max No Slices", sizes[slices])
+    new_series_info = []
+    for index in range(sizes[slices]):
+        info = copy.deepcopy(series_info[0])
+        offcentre = centre + (index - (sizes[slices] - 1) / 2) * step
+        for axis, value in zip(("AP", "FH", "RL"), offcentre):
+            _set(info, "Offcenter " + axis, value)
+        _set(info, "Slice", index + 1)
+        _set(info, "Index", index)
+        _set(info, "Resolution X", sizes[cols])
+        _set(info, "Resolution Y", sizes[rows])
+        _set(info, "Pixel Spacing", [spacings[cols], spacings[rows]])
+        _set(info, "Slice Thickness", spacings[slices])
+        _set(info, "Slice Gap", 0.0)
+        info["Slice Orientation"]["Value"] = orientation
+        new_series_info.append(info)
+    return new_general_info, new_series_info
@@ -0,0 +1,249 @@
+"""
+    Qt window of the processing: a queue of patients processed one after
+    the other, with the progress of the running one
+
+    ----- LICENSE -----
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License (GPL) as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version. For more detail see the
+    GNU General Public License at <http://www.gnu.org/licenses/>.
+    -----------------
+
+    Developed by A. Delphin, E. Gourieux, J. Pietras, L. Lamalle
+    May 2024
+"""
+
+import os
+import sys
+import threading
+from functions import (
+    ProcessingCancelled,
+    load_config,
+    main_processing,
+    processing_options,
+)
+from instrument import recorder_from_config
+
+from PyQt5.QtCore import QDir
+from PyQt5 import QtCore, QtGui, QtWidgets
+from PyQt5.QtWidgets import QApplication, QFileDialog, QMainWindow
+from PyQt5.uic import loadUi
+
+
+# progress bar value when each stage of main_processing starts
+STAGE_PROGRESS = {"prepare": 5, "segmentation": 20, "export": 90, "done": 100}
+
+
+class ProcessingThread(QtCore.QThread):
+    """
+    Runs main_processing for one patient outside of the Qt main thread
+    """
+
+    progress = QtCore.pyqtSignal(int, str)
+    failed = QtCore.pyqtSignal(str)
+
+    def __init__(self, job, options, parent=None):
+        """
+            Parameters:
+                job (a dictionary): input_dir_path, out_directory, labels
+                options (a dictionary): other main_processing arguments
+                parent (a QObject): owner of the thread
+        """
+        super(ProcessingThread, self).__init__(parent)
+        self.job = job
+        self.options = options
+        self.cancel = threading.Event()
+        self.value = 0
+
+    def report(self, stage, message):
+        """Progress callback of main_processing (docker output included)"""
+        self.value = STAGE_PROGRESS.get(stage, self.value)
+        self.progress.emit(self.value, message)
+
+    def run(self):
+        """Run the processing"""
+        try:
+            main_processing(
+                self.job["input_dir_path"],
+                self.job["out_directory"],
+                self.job["labels"],
+                progress=self.report,
+                cancel=self.cancel,
+                **self.options
+            )
+        except ProcessingCancelled:
+            self.failed.emit("Cancelled")
+        except Exception as error:  # shown in the window, not a crash
+            self.failed.emit(f"Failed: {error!r}")
+
+
+class App(QMainWindow):
+    """
+    Main windows Qt
+    """
+
+    def __init__(self):
+        super(App, self).__init__()
+        self.dir_code_path = os.path.realpath(os.path.dirname(__file__))
+        # Set window title
+        self.setWindowTitle("PRIDE Tool")
+
+        # Set window icon
+        icon_path = os.path.join(os.path.dirname(self.dir_code_path), "images", "icon.png")
+        self.setWindowIcon(QtGui.QIcon(icon_path))
+
+        # Get ui
+        ui_file = os.path.join(self.dir_code_path, "interface.ui")
+        loadUi(ui_file, self)
+
+        data = load_config()
+        self.out_directory = data["OutDirectory"]
+        self.processing_options = processing_options(data)
+        self.processing_options["recorder"] = recorder_from_config(data)
+        if os.path.exists(self.out_directory):
+            self.input_directory = self.out_directory
+        else:
+            self.input_directory = QDir.homePath()
+
+        if not os.path.exists(self.out_directory):
+            print(
+                "Please enter a valid file path in the "
+                "configuration file for OutDirectory"
+            )
+            sys.exit()
+        self.input_dir_path = ""
+        # Patients waiting to be processed, and the one being processed
+        self.jobs = []
+        self.thread = None
+        self.pushButton_cancel.setEnabled(False)
+
+        # Connect signals and slots
+        self.pushButton_input.clicked.connect(
+            lambda: self.browse_directory("input", self.input_directory)
+        )
+        self.pushButton_run.clicked.connect(self.get_labels)
+        self.pushButton_run.clicked.connect(self.get_patient_name)
+        self.pushButton_run.clicked.connect(self.get_study_name)
+        self.pushButton_run.clicked.connect(self.launch_processing)
+        self.pushButton_cancel.clicked.connect(self.cancel_processing)
+
+    def get_labels(self):
+        """Get Labels from edit line"""
+        labels = self.lineEdit_labels.text().split(" ")
+        self.labels = [int(i) for i in labels]
+        print(self.labels)
+
+    def get_patient_name(self):
+        """Get patient name from edit line"""
+        self.patient_name = self.lineEdit_patient.text()
+
+    def get_study_name(self):
+        """Get study name from edit line"""
+        self.study_name = self.lineEdit_study.text()
+
+    def browse_directory(self, name, out):
+        """Browse DICOM directory"""
+        options = QFileDialog.Options()
+        options |= QFileDialog.ShowDirsOnly
+        directory = QFileDialog.getExistingDirectory(
+            self,
+            "Select a directory",
+            os.path.dirname(out),
+            options=options,
+        )
+
+        if directory:
+            if name == "input":
+                self.input_dir_path = directory
+                self.textEdit_input.setText(self.input_dir_path)
+
+    def launch_processing(self):
+        """Add the patient to the processing queue"""
+        if self.labels:
+            if self.patient_name and self.study_name and self.input_dir_path:
+                out_directory = os.path.join(
+                    self.out_directory,
+                    self.study_name,
+                    self.patient_name
+                )
+                if not os.path.exists(out_directory):
+                    os.makedirs(out_directory)
+
+                item = QtWidgets.QListWidgetItem(
+                    f"{self.study_name}/{self.patient_name}: waiting"
+                )
+                self.listWidget_queue.addItem(item)
+                self.jobs.append({
+                    "input_dir_path": self.input_dir_path,
+                    "out_directory": out_directory,
+                    "labels": self.labels,
+                    "name": f"{self.study_name}/{self.patient_name}",
+                    "item": item,
+                })
+                self.start_next_job()
+            else:
+                print(
+                    "'Study', 'Patient identification' and "
+                    "'input directory' fields are mandatory"
+                )
+
+        else:
+            print("'Labels' field is mandatory")
+
+    def start_next_job(self):
+        """Start the next patient of the queue if none is running"""
+        if self.thread is not None or not self.jobs:
+            return
+        job = self.jobs.pop(0)
+        self.thread = ProcessingThread(job, self.processing_options, self)
+        self.thread.progress.connect(self.show_progress)
+        self.thread.failed.connect(self.job_failed)
+        self.thread.finished.connect(self.job_finished)
+        job["item"].setText(f"{job['name']}: running")
+        self.progressBar.setValue(0)
+        self.pushButton_cancel.setEnabled(True)
+        self.thread.start()
+
+    def show_progress(self, value, message):
+        """Show the progress of the running patient"""
+        self.progressBar.setValue(value)
+        self.label_status.setText(message[-80:])
+
+    def job_failed(self, message):
+        """Keep the failure of the running patient for its queue entry"""
+        self.thread.job["status"] = message
+
+    def job_finished(self):
+        """Update the queue when a patient is done"""
+        job = self.thread.job
+        status = job.get("status", "done")
+        job["item"].setText(f"{job['name']}: {status}")
+        self.label_status.setText(status)
+        self.pushButton_cancel.setEnabled(False)
+        self.thread.wait()
+        self.thread.deleteLater()
+        self.thread = None
+        self.start_next_job()
+
+    def cancel_processing(self):
+        """Cancel the running patient (stops the AssemblyNet container)"""
+        if self.thread is not None:
+            self.label_status.setText("Cancelling...")
+            self.thread.cancel.set()
+
+
+def main_gui():
+    """Main gui"""
+    app = QApplication(sys.argv)
+    mainwindow = App()
+    widget = QtWidgets.QStackedWidget()
+    widget.addWidget(mainwindow)
+    widget.setFixedWidth(800)
+    widget.setFixedHeight(600)
+    widget.show()
+    sys.exit(app.exec_())
+
+
+if __name__ == "__main__":
+    main_gui()
@@ -0,0 +1,285 @@
+"""
+    Per-stage instrumentation of the processing: wall time, CPU time, peak
+    RSS and bytes read/written of each stage, and resource use of the
+    AssemblyNet container, written as JSON lines and optionally as a
+    Prometheus textfile (node_exporter textfile collector)
+
+    The measurements are those of the process (the stages use helper
+    threads): in a batch, the stages of other cases running at the same
+    time are counted too. The I/O counters are Linux only (/proc/self/io).
+
+    Main class:
+        - Recorder
+
+    Main functions:
+        - recorder_from_config
+        - watch_container
+
+    ----- LICENSE -----
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License (GPL) as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version. For more detail see the
+    GNU General Public License at <http://www.gnu.org/licenses/>.
+    -----------------
+
+    Developed by A. Delphin, E. Gourieux, J. Pietras, L. Lamalle
+    May 2024
+"""
+
+import contextlib
+import cProfile
+import json
+import os
+import re
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+METRICS_PREFIX = "segment_from_pride"
+CONTAINER_PERIOD = 2
+# /proc/<pid>/io fields -> record keys
+IO_FIELDS = {
+    "rchar": "read_bytes",
+    "wchar": "write_bytes",
+    "read_bytes": "disk_read_bytes",
+    "write_bytes": "disk_write_bytes",
+}
+UNITS = {
+    "B": 1, "kB": 1e3, "KB": 1e3, "MB": 1e6, "GB": 1e9, "TB": 1e12,
+    "KiB": 1024, "MiB": 1024 ** 2, "GiB": 1024 ** 3, "TiB": 1024 ** 4,
+}
+
+
+def _io_counters():
+    """I/O counters of the process, {} where not available"""
+    try:
+        with open("/proc/self/io", encoding="utf-8") as io_file:
+            counters = dict(line.split(":") for line in io_file)
+    except OSError:
+        return {}
+    return {key: int(counters[field]) for field, key in IO_FIELDS.items()
+            if field in counters}
+
+
+def _peak_rss():
+    """Peak resident set size of the process (bytes)"""
+    try:
+        with open("/proc/self/status", encoding="utf-8") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # kB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _reset_peak_rss():
+    """Reset the peak RSS of the process (Linux), so that it is per stage"""
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="utf-8") as refs:
+            refs.write("5")
+    except OSError:
+        pass
+
+
+class Recorder:
+    """
+    Measurements of the processing stages, shared by the cases of a batch
+    """
+
+    def __init__(self, jsonl_path=None, prometheus_path=None,
+                 profile_dir=None):
+        """
+            Parameters:
+                jsonl_path (a string): file where a JSON line is appended
+                                       for each stage (None: not written)
+                prometheus_path (a string): Prometheus textfile rewritten
+                                            with the last value of each
+                                            stage (None: not written)
+                profile_dir (a string): directory where the cProfile
+                                        statistics of each stage are dumped
+                                        (None: no profiling)
+        """
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        self.profile_dir = profile_dir
+        self.records = []
+        self.lock = threading.Lock()
+        self.active = 0
+
+    @contextlib.contextmanager
+    def stage(self, name, case=""):
+        """
+        Measure the code run in the with block as a stage
+
+            Parameters:
+                name (a string): stage name
+                case (a string): case name (ex study/patient)
+            Yields:
+                record (a dictionary): the record, extra keys can be added
+        """
+        with self.lock:
+            # the peak RSS is of the process: only reset when no other
+            # stage is measured
+            if self.active == 0:
+                _reset_peak_rss()
+            self.active += 1
+        record = {"case": case, "stage": name, "time": time.time()}
+        io_start = _io_counters()
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        profiler = None
+        if self.profile_dir is not None:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:  # another profiler is active (other thread)
+                profiler = None
+        try:
+            yield record
+            record["status"] = "ok"
+        except BaseException as error:
+            record["status"] = type(error).__name__
+            raise
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                os.makedirs(self.profile_dir, exist_ok=True)
+                profiler.dump_stats(os.path.join(
+                    self.profile_dir,
+                    re.sub(r"\W", "_", f"{case}_{name}".strip("_")) + ".prof"
+                ))
+            record["wall_seconds"] = time.perf_counter() - wall_start
+            record["cpu_seconds"] = time.process_time() - cpu_start
+            record["peak_rss_bytes"] = _peak_rss()
+            for key, value in _io_counters().items():
+                record[key] = value - io_start.get(key, 0)
+            with self.lock:
+                self.active -= 1
+            self.add(record)
+
+    def add(self, record):
+        """
+        Add a record (a stage or a child process) and write it
+
+            Parameters:
+                record (a dictionary): at least "stage", numbers for the
+                                       measurements
+        """
+        record.setdefault("case", "")
+        record.setdefault("time", time.time())
+        with self.lock:
+            self.records.append(record)
+            if self.jsonl_path:
+                with open(self.jsonl_path, "a", encoding="utf-8") as jsonl:
+                    jsonl.write(json.dumps(record) + "\n")
+            if self.prometheus_path:
+                self._write_prometheus()
+
+    def _write_prometheus(self):
+        """Rewrite the Prometheus textfile with the last value of each stage"""
+        last = {}
+        for record in self.records:
+            last[record["stage"]] = record
+        metrics = {}
+        for stage, record in last.items():
+            for key, value in record.items():
+                if key in ("case", "stage", "time", "status") \
+                        or not isinstance(value, (int, float)):
+                    continue
+                metrics.setdefault(key, []).append((stage, value))
+        lines = []
+        for key, values in metrics.items():
+            metric = f"{METRICS_PREFIX}_{key}"
+            lines.append(f"# TYPE {metric} gauge")
+            lines.extend(f'{metric}{{stage="{stage}"}} {value}'
+                         for stage, value in values)
+        # written then renamed, so that the collector never reads a
+        # partial file
+        tmp_path = self.prometheus_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as textfile:
+            textfile.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.prometheus_path)
+
+
+def recorder_from_config(data, profile_dir=None):
+    """
+    Recorder configured by config.json ("Metrics": {"JsonLines": path,
+    "Prometheus": path})
+
+        Parameters:
+            data (a dictionary): config.json content
+            profile_dir (a string): see Recorder
+        Returns:
+            recorder (a Recorder): None if nothing is recorded
+    """
+    metrics = data.get("Metrics") or {}
+    jsonl_path = metrics.get("JsonLines") or None
+    prometheus_path = metrics.get("Prometheus") or None
+    if not (jsonl_path or prometheus_path or profile_dir):
+        return None
+    return Recorder(jsonl_path, prometheus_path, profile_dir)
+
+
+def _size(text):
+    """Bytes of a docker stats size, ex '1.5GiB'"""
+    match = re.match(r"([\d.]+)\s*([A-Za-z]+)", text.strip())
+    if match is None:
+        return 0
+    return int(float(match.group(1)) * UNITS.get(match.group(2), 1))
+
+
+def watch_container(container_name, usage, stop, period=CONTAINER_PERIOD):
+    """
+    Sample the resource use of a container (docker stats) until stop is
+    set: CPU time (integrated from the CPU percentage), peak memory and
+    block I/O
+
+        Parameters:
+            container_name (a string): container name
+            usage (a dictionary): filled with container_cpu_seconds,
+                                  container_peak_memory_bytes,
+                                  container_read_bytes,
+                                  container_write_bytes
+            stop (a threading.Event): stops the sampling
+            period (a float): sampling period (s)
+    """
+    usage.update({
+        "container_cpu_seconds": 0.0,
+        "container_peak_memory_bytes": 0,
+        "container_read_bytes": 0,
+        "container_write_bytes": 0,
+    })
+    last = time.perf_counter()
+    while not stop.is_set():
+        process = subprocess.run(
+            ["docker", "stats", "--no-stream", "--format", "{{json .}}",
+             container_name],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+            check=False,
+        )
+        now = time.perf_counter()
+        try:
+            stats = json.loads(process.stdout.splitlines()[0])
+        except (IndexError, ValueError):  # not started yet or already gone
+            stats = None
+        if stats is not None:
+            usage["container_cpu_seconds"] += (
+                float(stats["CPUPerc"].rstrip("%") or 0) / 100 * (now - last)
+            )
+            usage["container_peak_memory_bytes"] = max(
+                usage["container_peak_memory_bytes"],
+                _size(stats["MemUsage"].split("/")[0]),
+            )
+            read, write = stats["BlockIO"].split("/")
+            usage["container_read_bytes"] = _size(read)
+            usage["container_write_bytes"] = _size(write)
+        last = now
+        stop.wait(period)
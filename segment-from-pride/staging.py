@@ -0,0 +1,146 @@
+"""
+    Staging of the intermediate files of the segmentation (NIfTI to
+    segment, segmenter outputs) in a tmpfs such as /dev/shm instead of the
+    output directory: only the files kept are copied to the output
+    directory, the staging area is then removed
+
+    Each staging area is a directory <pid>_<id> of the staging directory.
+    The areas are removed when released, when the process exits, and the
+    areas left by processes that died are removed by the next one.
+
+    Main functions:
+        - acquire
+        - keep
+        - release
+
+    ----- LICENSE -----
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License (GPL) as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version. For more detail see the
+    GNU General Public License at <http://www.gnu.org/licenses/>.
+    -----------------
+
+    Developed by A. Delphin, E. Gourieux, J. Pietras, L. Lamalle
+    May 2024
+"""
+
+import atexit
+import fnmatch
+import os
+import shutil
+import threading
+import uuid
+
+# files of the segmenter kept by default (the label volume)
+KEEP = ("native_structures_*.nii.gz",)
+
+_lock = threading.Lock()
+# staging area -> bytes reserved in it by this process
+_reserved = {}
+
+
+def _pid_alive(pid):
+    """True if a process with this pid exists"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # exists, owned by another user
+        return True
+    return True
+
+
+def clean_stale(staging_dir):
+    """
+    Remove the staging areas of processes that no longer exist
+
+        Parameters:
+            staging_dir (a string): staging directory
+    """
+    if not os.path.isdir(staging_dir):
+        return
+    for name in os.listdir(staging_dir):
+        pid = name.split("_")[0]
+        if pid.isdigit() and int(pid) != os.getpid() \
+                and not _pid_alive(int(pid)):
+            shutil.rmtree(os.path.join(staging_dir, name), ignore_errors=True)
+
+
+def acquire(staging, needed):
+    """
+    Create a staging area if there is room for it
+
+        Parameters:
+            staging (a dictionary): "Directory" (the tmpfs directory, empty
+                                    to disable the staging) and "MaxSizeGB"
+                                    (cap of the areas of this process,
+                                    0 for no cap) of config.json
+            needed (an integer): bytes that will be written in the area
+        Returns:
+            path (a string): staging area, None if the staging is disabled
+                             or there is no room (the files are then
+                             written in the output directory)
+    """
+    staging_dir = (staging or {}).get("Directory")
+    if not staging_dir:
+        return None
+    os.makedirs(staging_dir, exist_ok=True)
+    clean_stale(staging_dir)
+    max_size = int(float(staging.get("MaxSizeGB") or 0) * 1024 ** 3)
+    with _lock:
+        reserved = sum(_reserved.values())
+        free = shutil.disk_usage(staging_dir).free
+        if needed > free or (max_size and reserved + needed > max_size):
+            print(
+                f"Not enough room in {staging_dir} "
+                f"({needed / 1024 ** 2:.0f} MB needed), "
+                "writing in the output directory"
+            )
+            return None
+        path = os.path.join(staging_dir, f"{os.getpid()}_{uuid.uuid4().hex}")
+        os.makedirs(path)
+        _reserved[path] = needed
+    return path
+
+
+def keep(path, destination, patterns=KEEP):
+    """
+    Copy the files of a staging area that are kept
+
+        Parameters:
+            path (a string): staging area
+            destination (a string): directory where they are copied
+            patterns (a list): names of the files kept (glob patterns)
+        Returns:
+            kept (a list): paths of the copies
+    """
+    os.makedirs(destination, exist_ok=True)
+    kept = []
+    for name in sorted(os.listdir(path)):
+        if any(fnmatch.fnmatch(name, pattern) for pattern in patterns):
+            kept.append(shutil.copy2(
+                os.path.join(path, name), os.path.join(destination, name)
+            ))
+    return kept
+
+
+def release(path):
+    """
+    Remove a staging area
+
+        Parameters:
+            path (a string): staging area (None: nothing to do)
+    """
+    if path is None:
+        return
+    shutil.rmtree(path, ignore_errors=True)
+    with _lock:
+        _reserved.pop(path, None)
+
+
+@atexit.register
+def _release_all():
+    """Remove the staging areas left by this process"""
+    for path in list(_reserved):
+        release(path)
@@ -0,0 +1,168 @@
+"""
+    Volumetrics of the labels of a segmentation: voxel count, volume (mm3)
+    and bounding box of each label, computed from the label volume already
+    loaded for the masking and written next to results_to_export
+    (volumetrics.json and volumetrics.csv)
+
+    Main functions:
+        - label_volumetrics
+        - write_volumetrics
+        - read_volumetrics
+        - aggregate_volumetrics
+
+    ----- LICENSE -----
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License (GPL) as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version. For more detail see the
+    GNU General Public License at <http://www.gnu.org/licenses/>.
+    -----------------
+
+    Developed by A. Delphin, E. Gourieux, J. Pietras, L. Lamalle
+    May 2024
+"""
+
+import csv
+import json
+import os
+import numpy as np
+
+JSON_NAME = "volumetrics.json"
+CSV_NAME = "volumetrics.csv"
+CSV_COLUMNS = (
+    "label", "voxels", "volume_mm3",
+    "i_min", "i_max", "j_min", "j_max", "k_min", "k_max",
+)
+
+
+def label_volumetrics(seg_volume, labels, zooms):
+    """
+    Voxel count, volume and bounding box of labels: the label volume is
+    read once (mapped to the index of each label), the rest of the work
+    only concerns the voxels of these labels
+
+        Parameters:
+            seg_volume (a numpy array): integer label volume (NIfTI voxel
+                                        axes)
+            labels (a list): labels to measure (ex [181, 185])
+            zooms (a tuple): voxel size (mm) along each axis
+        Returns:
+            volumetrics (a dictionary): voxel_volume_mm3 and labels, one
+                                        dictionary per label (label, voxels,
+                                        volume_mm3, bbox: [min, max] voxel
+                                        index along each axis, None if the
+                                        label is absent)
+    """
+    labels = [int(label) for label in labels]
+    voxel_volume = float(np.prod([float(zoom) for zoom in zooms[:3]]))
+    # index of each voxel label in labels + 1, 0 for the other labels (the
+    # last entry catches every label above max(labels), as in
+    # functions.label_lookup)
+    lut = np.zeros(max(labels, default=0) + 2,
+                   np.min_scalar_type(len(labels)))
+    lut[labels] = np.arange(1, len(labels) + 1)
+    indices = np.take(lut, seg_volume, mode="clip")
+    coordinates = np.nonzero(indices)
+    selected = indices[coordinates]
+    counts = np.bincount(selected, minlength=len(labels) + 1)
+
+    # voxels of each label along each axis: [label index, position]
+    present = []
+    for axis, coordinate in enumerate(coordinates):
+        presence = np.zeros((len(labels) + 1, indices.shape[axis]), bool)
+        presence[selected, coordinate] = True
+        present.append(presence)
+
+    records = []
+    for index, label in enumerate(labels, 1):
+        bbox = None
+        if counts[index]:
+            bbox = []
+            for presence in present:
+                positions = np.flatnonzero(presence[index])
+                bbox.append([int(positions[0]), int(positions[-1])])
+        records.append({
+            "label": label,
+            "voxels": int(counts[index]),
+            "volume_mm3": float(counts[index]) * voxel_volume,
+            "bbox": bbox,
+        })
+    return {"voxel_volume_mm3": voxel_volume, "labels": records}
+
+
+def write_volumetrics(output_path, volumetrics):
+    """
+    Write volumetrics.json and volumetrics.csv
+
+        Parameters:
+            output_path (a string): output directory of the case
+            volumetrics (a dictionary): see label_volumetrics
+        Returns:
+            paths (a list): the JSON and CSV paths
+    """
+    json_path = os.path.join(output_path, JSON_NAME)
+    csv_path = os.path.join(output_path, CSV_NAME)
+    with open(json_path, "w", encoding="utf-8") as my_json:
+        json.dump(volumetrics, my_json, indent=4)
+    with open(csv_path, "w", encoding="utf-8", newline="") as my_csv:
+        writer = csv.writer(my_csv)
+        writer.writerow(CSV_COLUMNS)
+        for record in volumetrics["labels"]:
+            bbox = record["bbox"] or [["", ""]] * 3
+            writer.writerow(
+                [record["label"], record["voxels"], record["volume_mm3"]]
+                + [value for bounds in bbox for value in bounds]
+            )
+    return [json_path, csv_path]
+
+
+def read_volumetrics(output_path):
+    """
+    Read the volumetrics of a case
+
+        Parameters:
+            output_path (a string): output directory of the case
+        Returns:
+            volumetrics (a dictionary): see label_volumetrics, None if the
+                                        case has none
+    """
+    try:
+        with open(os.path.join(output_path, JSON_NAME),
+                  encoding="utf-8") as my_json:
+            return json.load(my_json)
+    except FileNotFoundError:
+        return None
+
+
+def aggregate_volumetrics(cases, csv_path=None):
+    """
+    Volumetrics of several cases in one table (ex after a batch)
+
+        Parameters:
+            cases (a list): (study, patient, output_path) of each case
+            csv_path (a string): CSV file written with the rows (None: not
+                                 written)
+        Returns:
+            rows (a list): one dictionary per case and label (study,
+                           patient and the CSV_COLUMNS)
+    """
+    rows = []
+    for study, patient, output_path in cases:
+        volumetrics = read_volumetrics(output_path)
+        if volumetrics is None:
+            continue
+        for record in volumetrics["labels"]:
+            row = {"study": study, "patient": patient}
+            row.update(label=record["label"], voxels=record["voxels"],
+                       volume_mm3=record["volume_mm3"])
+            for axis, bounds in zip("ijk", record["bbox"] or [[None] * 2] * 3):
+                row[axis + "_min"], row[axis + "_max"] = bounds
+            rows.append(row)
+    if csv_path is not None:
+        with open(csv_path, "w", encoding="utf-8", newline="") as my_csv:
+            writer = csv.DictWriter(
+                my_csv, ("study", "patient") + CSV_COLUMNS
+            )
+            writer.writeheader()
+            writer.writerows(rows)
+    return rows
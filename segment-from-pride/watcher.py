@@ -0,0 +1,330 @@
+"""
+    Watch-folder daemon: processes the PRIDE exports as soon as they are
+    complete and copies the results where PRIDE imports them
+
+    A case is a sub-directory of the watched directory holding 'Sag', 'Cor'
+    and 'Tra' directories (only 'Sag' with SagittalOnly), each with an
+    XML/REC pair. It is complete when the sizes and modification times of
+    its files have not changed for a while.
+
+    Main functions:
+        - case_snapshot
+        - watch
+
+    ----- LICENSE -----
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License (GPL) as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version. For more detail see the
+    GNU General Public License at <http://www.gnu.org/licenses/>.
+    -----------------
+
+    Developed by A. Delphin, E. Gourieux, J. Pietras, L. Lamalle
+    May 2024
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import queue
+import shutil
+import sys
+import threading
+import time
+import traceback
+
+try:
+    import inotify_simple
+except ImportError:  # polling only
+    inotify_simple = None
+
+from batch import ORIENTATIONS
+from functions import load_config, main_processing, processing_options
+from instrument import recorder_from_config
+
+STATE_NAME = "watch_state.json"
+CHUNK_SIZE = 1 << 20
+
+
+def case_snapshot(case_dir, sagittal_only=False):
+    """
+    Sizes and modification times of the XML/REC files of a case
+
+        Parameters:
+            case_dir (a string): case directory
+            sagittal_only (a boolean): Cor and Tra are optional (they are
+                                       still waited for when PRIDE has
+                                       started writing them)
+        Returns:
+            snapshot (a tuple): (path, size, mtime) of every file, None if
+                                an XML/REC pair is missing
+    """
+    snapshot = []
+    for orientation in ORIENTATIONS:
+        orientation_path = os.path.join(case_dir, orientation)
+        if sagittal_only and orientation != ORIENTATIONS[0] \
+                and not os.path.isdir(orientation_path):
+            continue
+        xml_files = glob.glob(os.path.join(orientation_path, "*.XML"))
+        rec_files = glob.glob(os.path.join(orientation_path, "*.REC"))
+        if len(xml_files) != 1 or len(rec_files) != 1:
+            return None
+        for path in xml_files + rec_files:
+            try:
+                stat = os.stat(path)
+            except OSError:  # removed meanwhile
+                return None
+            snapshot.append((path, stat.st_size, stat.st_mtime))
+    return tuple(snapshot)
+
+
+def case_hash(snapshot):
+    """sha256 of the content of the files of a case snapshot"""
+    sha = hashlib.sha256()
+    for path, _, _ in snapshot:
+        with open(path, "rb") as my_file:
+            for chunk in iter(lambda: my_file.read(CHUNK_SIZE), b""):
+                sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _load_state(state_path):
+    """Hashes of the cases already processed"""
+    if not os.path.exists(state_path):
+        return {}
+    with open(state_path, encoding="utf-8") as my_json:
+        return json.load(my_json)
+
+
+def _save_state(state_path, state):
+    """Save the hashes of the cases already processed"""
+    tmp_path = state_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as my_json:
+        json.dump(state, my_json, indent=4)
+    os.replace(tmp_path, state_path)
+
+
+class _Waiter:
+    """
+    Waits for a change in the watched directory: inotify when available,
+    otherwise (or on file systems without inotify) a plain timeout
+    """
+
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+        self.inotify = None
+        self.watched = set()
+        if inotify_simple is not None:
+            try:
+                self.inotify = inotify_simple.INotify()
+            except OSError:
+                self.inotify = None
+
+    def _add_watches(self):
+        """Watch every directory under root_dir"""
+        flags = inotify_simple.flags
+        mask = (flags.CREATE | flags.CLOSE_WRITE | flags.MOVED_TO
+                | flags.MODIFY | flags.DELETE)
+        for dir_path, _, _ in os.walk(self.root_dir):
+            if dir_path not in self.watched:
+                try:
+                    self.inotify.add_watch(dir_path, mask)
+                    self.watched.add(dir_path)
+                except OSError:
+                    pass
+
+    def wait(self, timeout):
+        """Return after a change in root_dir or after timeout seconds"""
+        if self.inotify is None:
+            time.sleep(timeout)
+            return
+        self._add_watches()
+        if self.inotify.read(timeout=int(timeout * 1000)):
+            # let a burst of writes settle
+            time.sleep(0.2)
+            self.inotify.read(timeout=0)
+
+
+def _export_results(results_dir, xmlrec_out):
+    """
+    Copy the result files in xmlrec_out, each one under a temporary name
+    first so that PRIDE never imports a partly written file
+    """
+    for path in glob.glob(os.path.join(results_dir, "*")):
+        name = os.path.basename(path)
+        tmp_path = os.path.join(xmlrec_out, f".{name}.tmp")
+        shutil.copy(path, tmp_path)
+        os.replace(tmp_path, os.path.join(xmlrec_out, name))
+
+
+def _process_queue(jobs, out_directory, study, labels, xmlrec_out, options,
+                   state, state_path, state_lock, queued_digests):
+    """
+    Process the complete cases one after the other, a failed case is
+    processed again when it is exported again
+    """
+    while True:
+        case_dir, digest = jobs.get()
+        patient = os.path.basename(case_dir)
+        print(f"Processing {case_dir}")
+        try:
+            case_out_directory = os.path.join(out_directory, study, patient)
+            os.makedirs(case_out_directory, exist_ok=True)
+            main_processing(case_dir, case_out_directory, labels, **options)
+            if xmlrec_out:
+                _export_results(
+                    os.path.join(case_out_directory, "results_to_export"),
+                    xmlrec_out,
+                )
+                print(f"Results of {patient} copied to {xmlrec_out}")
+            with state_lock:
+                state[digest] = {"case": case_dir, "time": time.time()}
+                _save_state(state_path, state)
+        except Exception:  # the daemon keeps watching
+            traceback.print_exc()
+            with state_lock:
+                queued_digests.discard(digest)
+        jobs.task_done()
+
+
+def watch(root_dir, out_directory, study, labels, xmlrec_out=None,
+          options=None, settle=10, poll=5, sagittal_only=False):
+    """
+    Watch root_dir and process every complete case once
+
+        Parameters:
+            root_dir (a string): directory where PRIDE exports the cases
+            out_directory (a string): results are written in
+                                      out_directory/study/patient
+            study (a string): study name of the cases
+            labels (a list): labels to extract
+            xmlrec_out (a string): directory where the 6 result files are
+                                   copied (PRIDE dirXmlRecOut), None to
+                                   leave them in out_directory
+            options (a dictionary): other main_processing keyword arguments
+            settle (a float): seconds without change for a case to be
+                              considered complete
+            poll (a float): maximum time between two scans (s)
+            sagittal_only (a boolean): process the cases without Cor and
+                                       Tra exports (see case_snapshot)
+    """
+    state_path = os.path.join(out_directory, STATE_NAME)
+    state = _load_state(state_path)
+    state_lock = threading.Lock()
+    # hashes of the cases queued and not processed yet (under state_lock)
+    queued_digests = set()
+    jobs = queue.Queue()
+    threading.Thread(
+        target=_process_queue,
+        args=(jobs, out_directory, study, labels, xmlrec_out, options or {},
+              state, state_path, state_lock, queued_digests),
+        daemon=True,
+    ).start()
+
+    waiter = _Waiter(root_dir)
+    if waiter.inotify is None:
+        print(f"Polling {root_dir} every {poll} s")
+    else:
+        print(f"Watching {root_dir} (inotify)")
+    # case_dir -> (snapshot, time when it was first seen unchanged)
+    seen = {}
+    queued = set()
+    while True:
+        now = time.time()
+        for name in sorted(os.listdir(root_dir)):
+            case_dir = os.path.join(root_dir, name)
+            if not os.path.isdir(case_dir):
+                continue
+            snapshot = case_snapshot(case_dir, sagittal_only)
+            if snapshot is None:
+                seen.pop(case_dir, None)
+                continue
+            if case_dir not in seen or seen[case_dir][0] != snapshot:
+                seen[case_dir] = (snapshot, now)
+                continue
+            newest = max(mtime for _, _, mtime in snapshot)
+            if now - max(seen[case_dir][1], newest) < settle \
+                    or (case_dir, snapshot) in queued:
+                continue
+            queued.add((case_dir, snapshot))
+            digest = case_hash(snapshot)
+            with state_lock:
+                done = digest in state or digest in queued_digests
+                if not done:
+                    queued_digests.add(digest)
+            if done:
+                print(f"{case_dir} already processed")
+                continue
+            print(f"{case_dir} complete, queued")
+            jobs.put((case_dir, digest))
+        # wake up in time to see the cases settle
+        waiter.wait(min(poll, settle))
+
+
+def main_watch():
+    """
+    Watch-folder CLI
+    """
+    parser = argparse.ArgumentParser(
+        description="Process the PRIDE exports written in a directory"
+    )
+    parser.add_argument(
+        "--root",
+        required=True,
+        help="Directory where each case is exported (one sub-directory with "
+        "'Sag', 'Cor' and 'Tra' per patient, 'Sag' only with SagittalOnly)",
+    )
+    parser.add_argument("--study", required=True, help="Study name")
+    parser.add_argument(
+        "--labels",
+        help="Assemblynet labels to use",
+        nargs="*",
+        default=[181, 185, 201, 207]
+    )
+    parser.add_argument(
+        "--xmlrec-out",
+        help="Directory where the results are copied for PRIDE "
+        "(default: DirXmlRecOut of the configuration)",
+    )
+    parser.add_argument(
+        "--settle",
+        type=float,
+        default=10,
+        help="Seconds without change for an export to be complete",
+    )
+    parser.add_argument(
+        "--poll",
+        type=float,
+        default=5,
+        help="Polling period (s) when inotify is not available",
+    )
+    args = parser.parse_args()
+
+    data = load_config()
+    out_directory = data["OutDirectory"]
+    if not os.path.exists(out_directory):
+        print(
+            "Please enter a valid file path in the "
+            "configuration file for OutDirectory"
+        )
+        sys.exit()
+
+    options = processing_options(data)
+    options["recorder"] = recorder_from_config(data)
+    watch(
+        args.root,
+        out_directory,
+        args.study,
+        args.labels,
+        args.xmlrec_out or data.get("DirXmlRecOut"),
+        options,
+        args.settle,
+        args.poll,
+        data.get("SagittalOnly", False),
+    )
+
+
+if __name__ == "__main__":
+    main_watch()
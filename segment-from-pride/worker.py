@@ -0,0 +1,438 @@
+"""
+    Long-lived segmentation worker fed through a spool directory, so that
+    the AssemblyNet container is started once instead of once per patient
+
+    Spool layout:
+        jobs/<id>.json      job waiting to be taken
+        running/<id>.json   job taken by the worker
+        done/<id>.json      job result (status, log, timings)
+        data/<id>/          input NIfTI and segmentation outputs of the job
+        heartbeat           touched by the worker while it is alive
+        worker.pid          pid of the local stand-in worker (--fake)
+
+    Main functions:
+        - serve
+        - start_worker
+        - worker_alive
+        - segment_warm
+
+    ----- LICENSE -----
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License (GPL) as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version. For more detail see the
+    GNU General Public License at <http://www.gnu.org/licenses/>.
+    -----------------
+
+    Developed by A. Delphin, E. Gourieux, J. Pietras, L. Lamalle
+    May 2024
+"""
+
+import argparse
+import glob
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+WORKER_CONTAINER = "segment-from-pride-worker"
+HEARTBEAT_PERIOD = 2
+HEARTBEAT_TIMEOUT = 15
+POLL_PERIOD = 0.2
+PID_FILE = "worker.pid"
+SPOOL_DIRS = ("jobs", "running", "done", "data")
+# longest wait for the result of a job (s), and restarts of the worker
+# during one job before it is failed
+JOB_TIMEOUT = 3 * 3600
+MAX_RESTARTS = 3
+# one restart of the worker at a time among the threads of this process
+_RESTART_LOCK = threading.Lock()
+
+
+def _spool_dirs(spool_dir, names=SPOOL_DIRS):
+    """Create the spool sub-directories"""
+    for name in names:
+        os.makedirs(os.path.join(spool_dir, name), exist_ok=True)
+
+
+def _write_json(path, data):
+    """
+    Write a JSON file atomically (readers never see a partial file), with a
+    temporary name unique to the writer (several processes, or nodes for
+    cluster.py, write in a spool)
+    """
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as my_json:
+        json.dump(data, my_json)
+    os.replace(tmp_path, path)
+
+
+def fake_segment(nifti_path):
+    """
+    Stand-in for AssemblyNet: writes a native_structures_*.nii.gz label
+    volume next to the input, with labels from the intensity quantiles
+
+        Parameters:
+            nifti_path (a string): NIfTI path
+    """
+    import nibabel as nib
+    import numpy as np
+
+    img = nib.load(nifti_path)
+    data = np.asanyarray(img.dataobj)
+    edges = np.quantile(data, [0.5, 0.6, 0.7, 0.8, 0.9])
+    labels = np.array([0, 181, 185, 201, 207, 4], dtype=np.uint16)
+    seg = labels[np.searchsorted(edges, data)]
+    seg_img = nib.Nifti1Image(seg, img.affine)
+    seg_img.set_data_dtype(np.uint16)
+    seg_img.to_filename(os.path.join(
+        os.path.dirname(nifti_path),
+        "native_structures_" + os.path.basename(nifti_path) + ".gz"
+    ))
+
+
+def _heartbeat(spool_dir, stop):
+    """Touch the heartbeat file until stop is set"""
+    heartbeat_path = os.path.join(spool_dir, "heartbeat")
+    while not stop.is_set():
+        with open(heartbeat_path, "w", encoding="utf-8") as heartbeat:
+            heartbeat.write(str(time.time()))
+        stop.wait(HEARTBEAT_PERIOD)
+
+
+def run_job(spool_dir, job_id, command):
+    """
+    Run one job taken from the spool and write its result in done/
+
+        Parameters:
+            spool_dir (a string): spool directory
+            job_id (a string): job identifier
+            command (a list): segmentation command, "{input}" is replaced
+                              by the input NIfTI path (None: fake_segment,
+                              see serve)
+    """
+    running_path = os.path.join(spool_dir, "running", job_id + ".json")
+    with open(running_path, encoding="utf-8") as my_json:
+        job = json.load(my_json)
+    nifti_path = os.path.join(spool_dir, "data", job_id, job["input"])
+
+    start = time.time()
+    result = {"id": job_id, "queue_seconds": start - job["submitted"]}
+    try:
+        if command is None:
+            fake_segment(nifti_path)
+            result["status"] = 0
+            result["log"] = ""
+        else:
+            process = subprocess.run(
+                [arg.replace("{input}", nifti_path) for arg in command],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                check=False,
+            )
+            result["status"] = process.returncode
+            result["log"] = process.stdout.decode("utf-8", "replace")
+    except Exception as error:  # the worker must survive a failed job
+        result["status"] = -1
+        result["log"] = repr(error)
+    result["run_seconds"] = time.time() - start
+    _write_json(os.path.join(spool_dir, "done", job_id + ".json"), result)
+    os.remove(running_path)
+
+
+def serve(spool_dir, command=None, fake=False):
+    """
+    Worker loop: take the jobs of the spool one after the other
+
+        Parameters:
+            spool_dir (a string): spool directory
+            command (a list): segmentation command, "{input}" is replaced
+                              by the input NIfTI path
+            fake (a boolean): segment with fake_segment instead of command
+                              (tests only)
+    """
+    if fake == bool(command):
+        raise ValueError("The worker needs either a command or fake")
+    if fake:
+        command = None
+    _spool_dirs(spool_dir)
+    stop = threading.Event()
+    threading.Thread(
+        target=_heartbeat, args=(spool_dir, stop), daemon=True
+    ).start()
+    # jobs left running by a worker that died are taken again
+    for running_path in glob.glob(os.path.join(spool_dir, "running", "*.json")):
+        os.replace(running_path, os.path.join(
+            spool_dir, "jobs", os.path.basename(running_path)))
+    try:
+        while True:
+            job_paths = sorted(
+                glob.glob(os.path.join(spool_dir, "jobs", "*.json")),
+                key=os.path.getmtime,
+            )
+            if not job_paths:
+                time.sleep(POLL_PERIOD)
+                continue
+            job_id = os.path.basename(job_paths[0])[:-len(".json")]
+            try:
+                # rename is atomic: a job is taken once
+                os.rename(job_paths[0], os.path.join(
+                    spool_dir, "running", job_id + ".json"))
+            except OSError:
+                continue
+            run_job(spool_dir, job_id, command)
+    finally:
+        stop.set()
+
+
+def worker_alive(spool_dir, timeout=HEARTBEAT_TIMEOUT):
+    """
+    Health check of the worker
+
+        Parameters:
+            spool_dir (a string): spool directory
+            timeout (a float): heartbeat age (s) above which the worker
+                               is considered dead
+        Returns:
+            True if the worker heartbeat is recent
+    """
+    heartbeat_path = os.path.join(spool_dir, "heartbeat")
+    if not os.path.exists(heartbeat_path):
+        return False
+    return time.time() - os.path.getmtime(heartbeat_path) < timeout
+
+
+def _pid_alive(pid):
+    """True if the process pid exists (a finished child is reaped)"""
+    try:
+        if os.waitpid(pid, os.WNOHANG)[0] == pid:
+            return False
+    except ChildProcessError:  # not a child of this process
+        pass
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+def stop_fake_worker(spool_dir):
+    """
+    Stop the local stand-in worker of the spool started by start_worker,
+    if any, and wait for it to exit (its jobs are then taken back by the
+    next worker)
+
+        Parameters:
+            spool_dir (a string): spool directory
+    """
+    pid_path = os.path.join(spool_dir, PID_FILE)
+    try:
+        with open(pid_path, encoding="utf-8") as pid_file:
+            pid = int(pid_file.read())
+    except (FileNotFoundError, ValueError):
+        return
+    try:
+        os.kill(pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+    else:
+        deadline = time.time() + HEARTBEAT_TIMEOUT
+        while _pid_alive(pid):
+            if time.time() > deadline:
+                os.kill(pid, signal.SIGKILL)
+                deadline = float("inf")
+            time.sleep(POLL_PERIOD)
+    os.remove(pid_path)
+
+
+def start_worker(spool_dir, image=None, command=None):
+    """
+    (Re)start the worker and wait for its first heartbeat, the previous
+    worker being stopped first
+
+        Parameters:
+            spool_dir (a string): spool directory
+            image (a string): docker image running the worker, None to run
+                              the local stand-in worker (fake_segment,
+                              tests only)
+            command (a list): segmentation command run in the container,
+                              required with an image
+    """
+    if image is not None and not command:
+        raise ValueError(
+            f"A segmentation command is needed to run the worker in {image} "
+            "(SegmentationWorker Command)"
+        )
+    _spool_dirs(spool_dir)
+    heartbeat_path = os.path.join(spool_dir, "heartbeat")
+    if os.path.exists(heartbeat_path):
+        os.remove(heartbeat_path)
+    if image is None:
+        stop_fake_worker(spool_dir)
+        process = subprocess.Popen(
+            [sys.executable, os.path.realpath(__file__), spool_dir, "--fake"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        with open(os.path.join(spool_dir, PID_FILE), "w",
+                  encoding="utf-8") as pid_file:
+            pid_file.write(str(process.pid))
+    else:
+        code_dir = os.path.dirname(os.path.realpath(__file__))
+        subprocess.run(
+            ["docker", "rm", "-f", WORKER_CONTAINER],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            check=False,
+        )
+        subprocess.run(
+            [
+                "docker", "run", "-d",
+                "--name", WORKER_CONTAINER,
+                "--restart", "on-failure",
+                "--user", f"{os.getuid()}:{os.getgid()}",
+                "-v", os.path.realpath(spool_dir) + ":/spool",
+                "-v", code_dir + ":/code:ro",
+                "--entrypoint", "python3",
+                image,
+                "/code/worker.py", "/spool",
+                "--command", json.dumps(command),
+            ],
+            stdout=subprocess.DEVNULL,
+            check=True,
+        )
+    deadline = time.time() + HEARTBEAT_TIMEOUT
+    while not worker_alive(spool_dir):
+        if time.time() > deadline:
+            raise RuntimeError("Segmentation worker did not start")
+        time.sleep(POLL_PERIOD)
+
+
+def _ensure_worker(spool_dir, image, command):
+    """
+    Start the worker unless it is alive, the threads that find it dead at
+    the same time restart it once
+
+        Returns:
+            started (a boolean): True if this call (re)started the worker
+    """
+    with _RESTART_LOCK:
+        if worker_alive(spool_dir):
+            return False
+        print("Starting segmentation worker")
+        start_worker(spool_dir, image, command)
+        return True
+
+
+def segment_warm(nifti_path, spool_dir, image=None, command=None,
+                 timeout=JOB_TIMEOUT):
+    """
+    Segment a NIfTI file with the warm worker (started if needed), the
+    segmentation outputs are moved next to the NIfTI file
+
+        Parameters:
+            nifti_path (a string): NIfTI path
+            spool_dir (a string): spool directory
+            image (a string): see start_worker
+            command (a list): see start_worker
+            timeout (a float): longest wait for the result (s)
+        Returns:
+            result (a dictionary): job result (status, log, timings)
+    """
+    _spool_dirs(spool_dir)
+    _ensure_worker(spool_dir, image, command)
+
+    job_id = uuid.uuid4().hex
+    data_path = os.path.join(spool_dir, "data", job_id)
+    os.makedirs(data_path)
+    file_name = os.path.basename(nifti_path)
+    shutil.copyfile(nifti_path, os.path.join(data_path, file_name))
+    submitted = time.time()
+    _write_json(
+        os.path.join(spool_dir, "jobs", job_id + ".json"),
+        {"input": file_name, "submitted": submitted},
+    )
+
+    done_path = os.path.join(spool_dir, "done", job_id + ".json")
+    deadline = submitted + timeout
+    restarts = 0
+    while not os.path.exists(done_path):
+        error = None
+        if time.time() > deadline:
+            error = f"no result after {timeout:.0f} s"
+        elif not worker_alive(spool_dir):
+            # the restarted worker takes the job back from running/
+            if restarts == MAX_RESTARTS:
+                error = f"worker restarted {restarts} times"
+            elif _ensure_worker(spool_dir, image, command):
+                print("Segmentation worker not responding, restarted it")
+                restarts += 1
+        if error is not None:
+            # not run any more if still waiting (a running job is left to
+            # the worker, its outputs are removed with data/)
+            try:
+                os.remove(os.path.join(spool_dir, "jobs", job_id + ".json"))
+            except FileNotFoundError:
+                pass
+            shutil.rmtree(data_path, ignore_errors=True)
+            raise RuntimeError(f"Segmentation job {job_id} failed: {error}")
+        time.sleep(POLL_PERIOD)
+    with open(done_path, encoding="utf-8") as my_json:
+        result = json.load(my_json)
+    os.remove(done_path)
+    result["latency_seconds"] = time.time() - submitted
+
+    out_directory = os.path.dirname(os.path.realpath(nifti_path))
+    for out_file in os.listdir(data_path):
+        if out_file != file_name:
+            shutil.move(os.path.join(data_path, out_file),
+                        os.path.join(out_directory, out_file))
+    shutil.rmtree(data_path)
+
+    print(
+        f"Segmentation job {job_id}: {result['latency_seconds']:.1f} s "
+        f"(queued {result['queue_seconds']:.1f} s, "
+        f"run {result['run_seconds']:.1f} s)"
+    )
+    if result["status"] != 0:
+        raise RuntimeError(
+            f"Segmentation failed ({result['status']}):\n{result['log']}"
+        )
+    return result
+
+
+def main_worker():
+    """Worker CLI"""
+    parser = argparse.ArgumentParser(
+        description="Long-lived segmentation worker"
+    )
+    parser.add_argument("spool", help="Spool directory")
+    parser.add_argument(
+        "--command",
+        help="Segmentation command as a JSON list, '{input}' is replaced "
+        "by the input NIfTI path",
+    )
+    parser.add_argument(
+        "--fake",
+        action="store_true",
+        help="Stand-in segmenter (no AssemblyNet), for tests",
+    )
+    args = parser.parse_args()
+    command = None
+    if args.command:
+        command = json.loads(args.command)
+        if not isinstance(command, list) or not command:
+            parser.error("--command must be a non-empty JSON list")
+    if args.fake == bool(command):
+        parser.error("one of --command or --fake is required")
+    serve(args.spool, command, args.fake)
+
+
+if __name__ == "__main__":
+    main_worker()
@@ -47,7 +47,6 @@ Version 0.2 - 22, October 2015
       - check reverse translation of Slice Orientation (should be OK)
       - check reverse translation of anisotropy direction (probably doen't matter)
   error conditions and messaging in case somke XML tag is not found
-  more general/better handling of the 3 'find_xml_' soubroutines
   improove handling of array type XML tags ('Phase Encoding Velocity' and 'Pixel Spacing')    
 
 '''
@@ -55,32 +54,94 @@ Version 0.2 - 22, October 2015
 import xml.etree.ElementTree as ET
 import sys
 import os
+import argparse
+import hashlib
+import json
+import multiprocessing
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
 # from tkinter import Tk
 # from tkinter.filedialog import askopenfilename
 
 
-def find_xml_seriesinfo(root, name):
-    result = ''
-    for info in root[0]:
-        if info.get('Name') == (name):
-            result = info.text
-    return result
-
-
-def find_xml_imageinfo1(root, name, index):
-    result = ''
-    for info in root[1][index][0]:
-        if info.get('Name') == (name):
-            result = info.text
-    return result
-
-
-def find_xml_imageinfo2(root, name, index):
-    result = ''
-    for info in root[1][index]:
-        if info.get('Name') == (name):
-            result = info.text
-    return result
+def index_xml_seriesinfo(root):
+    # parse Series_Info once: name -> text (last occurrence wins)
+    return {info.get('Name'): info.text for info in root[0]}
+
+
+def index_xml_imageinfo(image):
+    # parse one Image_Info once: name -> text for its Key attributes
+    # and for its own attributes
+    key = {info.get('Name'): info.text for info in image[0]}
+    info = {info.get('Name'): info.text for info in image}
+    return key, info
+
+
+def integer_text(value):
+    return str(int(value))
+
+
+# text of the typed values of the fields copied as they are into the PAR,
+# as PRIDE writes them in the XML (whatever type the reader gave them)
+XML_TEXT = {
+    'Aquisition Number': integer_text,
+    'Reconstruction Number': integer_text,
+    'Max No Phases': integer_text,
+    'Max No Echoes': integer_text,
+    'Max No Slices': integer_text,
+    'Max No Dynamics': integer_text,
+    'Max No Mixes': integer_text,
+    'Scan Resolution X': integer_text,
+    'Scan Resolution Y': integer_text,
+    'EPI factor': integer_text,
+    'Max No B Values': integer_text,
+    'Max No Gradient Orients': integer_text,
+    'No Label Types': integer_text,
+    'Slice': integer_text,
+    'Echo': integer_text,
+    'Dynamic': integer_text,
+    'Phase': integer_text,
+    'Index': integer_text,
+    'Pixel Size': integer_text,
+    'Resolution X': integer_text,
+    'Resolution Y': integer_text,
+    'Scale Slope': '{:.5E}'.format,
+}
+
+
+def info_text(value):
+    # textual form of a header value, as it appears in the XML
+    if hasattr(value, 'dtype'):
+        # numpy array or scalar (without importing numpy): a float is
+        # written with the shortest text of its own precision, not of the
+        # float64 it would be converted to
+        if value.ndim:
+            return ' '.join(info_text(v) for v in value)
+        if value.dtype.kind == 'b':
+            value = bool(value)
+        elif value.dtype.kind in 'iu':
+            value = int(value)
+        else:
+            return str(value)
+    if isinstance(value, str):
+        return value
+    if isinstance(value, bool):
+        return 'Y' if value else 'N'
+    if isinstance(value, (list, tuple)):
+        return ' '.join(info_text(v) for v in value)
+    return str(value)
+
+
+def find_info(info, name):
+    # look name up in a header mapping, either name -> text or
+    # xmlrec style name -> {'Value': ...}
+    value = info.get(name, '')
+    if isinstance(value, dict):
+        value = value['Value']
+    if isinstance(value, str) or name not in XML_TEXT:
+        return info_text(value)
+    return XML_TEXT[name](value)
 
 
 def format_number(str_number, digits):
@@ -115,9 +176,39 @@ def main_xml2par(input_file):
 
     tree = ET.parse(input_file)
     root = tree.getroot()
+    general_info = index_xml_seriesinfo(root)
+    series_info = []
+    for image in root[1]:
+        key, info = index_xml_imageinfo(image)
+        info.update(key)
+        series_info.append(info)
 
-   #open outfile
+    main_xmlrec2par(input_file, general_info, series_info)
+
+
+def main_xmlrec2par(input_file, general_info, series_info):
+    # write the PAR next to input_file from already loaded header structures,
+    # either xmlrec.read_xmlrec's general_info/series_info or the name -> text
+    # indexes built by main_xml2par
     output_file = os.path.splitext(input_file)[0]+'.PAR'
+    # written to a temporary file of the same directory then renamed, so
+    # that an interrupted conversion never leaves a truncated PAR (a plain
+    # open, the PAR gets the permissions given by the umask)
+    tmp_file = output_file+'.'+uuid.uuid4().hex+'.tmp'
+    try:
+        write_par(tmp_file, general_info, series_info,
+                  input_file[:input_file.find('.')])
+        os.replace(tmp_file, output_file)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+
+
+def write_par(output_file, general_info, series_info, dataset_name):
+    series = general_info
+
+   #open outfile
     outfile = open(output_file, 'w');
 
     #write header
@@ -126,7 +217,7 @@ def main_xml2par(input_file):
     outfile.write ('# CAUTION - Investigational device.\n')
     outfile.write ('# Limited by Federal Law to investigational use.\n')
     outfile.write ('#\n')
-    outfile.write ('# Dataset name: '+input_file[:input_file.find('.')]+'\n')
+    outfile.write ('# Dataset name: '+dataset_name+'\n')
     outfile.write ('#\n')
     outfile.write ('# CLINICAL TRYOUT             Research image export tool     V4.2\n')
     outfile.write ('#\n')
@@ -134,20 +225,20 @@ def main_xml2par(input_file):
     outfile.write ('#\n')
 
     #write general info
-    outfile.write ('.    Patient name                       :   '+find_xml_seriesinfo (root, 'Patient Name')+'\n')
-    outfile.write ('.    Examination name                   :   '+find_xml_seriesinfo (root, 'Examination Name')+'\n')
-    outfile.write ('.    Protocol name                      :   '+find_xml_seriesinfo (root, 'Protocol Name')+'\n')
-    outfile.write ('.    Examination date/time              :   '+find_xml_seriesinfo (root, 'Examination Date')+' / '+find_xml_seriesinfo (root, 'Examination Time')+'\n')
+    outfile.write ('.    Patient name                       :   '+find_info(series, 'Patient Name')+'\n')
+    outfile.write ('.    Examination name                   :   '+find_info(series, 'Examination Name')+'\n')
+    outfile.write ('.    Protocol name                      :   '+find_info(series, 'Protocol Name')+'\n')
+    outfile.write ('.    Examination date/time              :   '+find_info(series, 'Examination Date')+' / '+find_info(series, 'Examination Time')+'\n')
     outfile.write ('.    Series Type                        :   Image   MRSeries\n')
-    outfile.write ('.    Acquisition nr                     :   '+find_xml_seriesinfo (root, 'Aquisition Number')+'\n')
-    outfile.write ('.    Reconstruction nr                  :   '+find_xml_seriesinfo (root, 'Reconstruction Number')+'\n')
-    outfile.write ('.    Scan Duration [sec]                :   '+format_number(find_xml_seriesinfo (root, 'Scan Duration'),0)+'\n')
-    outfile.write ('.    Max. number of cardiac phases      :   '+find_xml_seriesinfo (root, 'Max No Phases')+'\n')
-    outfile.write ('.    Max. number of echoes              :   '+find_xml_seriesinfo (root, 'Max No Echoes')+'\n')
-    outfile.write ('.    Max. number of slices/locations    :   '+find_xml_seriesinfo (root, 'Max No Slices')+'\n')
-    outfile.write ('.    Max. number of dynamics            :   '+find_xml_seriesinfo (root, 'Max No Dynamics')+'\n')
-    outfile.write ('.    Max. number of mixes               :   '+find_xml_seriesinfo (root, 'Max No Mixes')+'\n')
-    pos=find_xml_seriesinfo (root, 'Patient Position')
+    outfile.write ('.    Acquisition nr                     :   '+find_info(series, 'Aquisition Number')+'\n')
+    outfile.write ('.    Reconstruction nr                  :   '+find_info(series, 'Reconstruction Number')+'\n')
+    outfile.write ('.    Scan Duration [sec]                :   '+format_number(find_info(series, 'Scan Duration'),0)+'\n')
+    outfile.write ('.    Max. number of cardiac phases      :   '+find_info(series, 'Max No Phases')+'\n')
+    outfile.write ('.    Max. number of echoes              :   '+find_info(series, 'Max No Echoes')+'\n')
+    outfile.write ('.    Max. number of slices/locations    :   '+find_info(series, 'Max No Slices')+'\n')
+    outfile.write ('.    Max. number of dynamics            :   '+find_info(series, 'Max No Dynamics')+'\n')
+    outfile.write ('.    Max. number of mixes               :   '+find_info(series, 'Max No Mixes')+'\n')
+    pos=find_info(series, 'Patient Position')
     position=''
     if pos.find('HF')>=0: position += 'Head First'
     if pos.find('FF')>=0: position += 'Feet First'
@@ -158,56 +249,56 @@ def main_xml2par(input_file):
     if pos.find('L')>=0: position += ' Left'
     if position=='': position=pos
     outfile.write ('.    Patient position                   :   '+position+'\n')
-    prep=find_xml_seriesinfo (root, 'Preparation Direction')
+    prep=find_info(series, 'Preparation Direction')
     if prep.find('AP')>=0: prep= 'Anterior-Posterior'
     elif prep.find('RL')>=0: prep= 'Right-Left'
     elif prep.find('FH')>=0: prep= 'Foot-Head'
     outfile.write ('.    Preparation direction              :   '+prep+'\n')
-    outfile.write ('.    Technique                          :   '+find_xml_seriesinfo (root, 'Technique')+'\n')
-    outfile.write ('.    Scan resolution  (x, y)            :   '+find_xml_seriesinfo (root, 'Scan Resolution X')+'  '+find_xml_seriesinfo (root, 'Scan Resolution Y')+'\n')
-    outfile.write ('.    Scan mode                          :   '+find_xml_seriesinfo (root, 'Scan Mode')+'\n')
-    tmpTR = find_xml_seriesinfo (root, 'Repetition Times');
+    outfile.write ('.    Technique                          :   '+find_info(series, 'Technique')+'\n')
+    outfile.write ('.    Scan resolution  (x, y)            :   '+find_info(series, 'Scan Resolution X')+'  '+find_info(series, 'Scan Resolution Y')+'\n')
+    outfile.write ('.    Scan mode                          :   '+find_info(series, 'Scan Mode')+'\n')
+    tmpTR = find_info(series, 'Repetition Times');
     tmpTR1 = tmpTR[0]
-    # outfile.write ('.    Repetition time [ms]               :   '+format_number(find_xml_seriesinfo (root, 'Repetition Times'),3)+'\n')
+    # outfile.write ('.    Repetition time [ms]               :   '+format_number(find_info(series, 'Repetition Times'),3)+'\n')
     outfile.write ('.    Repetition time [ms]               :   '+format_number(tmpTR1,3)+'\n')
-    outfile.write ('.    FOV (ap,fh,rl) [mm]                :   '+format_number(find_xml_seriesinfo (root, 'FOV AP'),3)+'  '+format_number(find_xml_seriesinfo (root, 'FOV FH'),3)+'  '+format_number(find_xml_seriesinfo (root, 'FOV RL'),3)+'\n')
-    outfile.write ('.    Water Fat shift [pixels]           :   '+format_number(find_xml_seriesinfo (root, 'Water Fat Shift'),3)+'\n')
-    outfile.write ('.    Angulation midslice(ap,fh,rl)[degr]:   '+format_number(find_xml_seriesinfo (root, 'Angulation AP'),3)+'  '+format_number(find_xml_seriesinfo (root, 'Angulation FH'),3)+'  '+format_number(find_xml_seriesinfo (root, 'Angulation RL'),3)+'\n')
-    outfile.write ('.    Off Centre midslice(ap,fh,rl) [mm] :   '+format_number(find_xml_seriesinfo (root, 'Off Center AP'),3)+'  '+format_number(find_xml_seriesinfo (root, 'Off Center FH'),3)+'  '+format_number(find_xml_seriesinfo (root, 'Off Center RL'),3)+'\n')
-    flowcomp=find_xml_seriesinfo (root, 'Flow Compensation')
+    outfile.write ('.    FOV (ap,fh,rl) [mm]                :   '+format_number(find_info(series, 'FOV AP'),3)+'  '+format_number(find_info(series, 'FOV FH'),3)+'  '+format_number(find_info(series, 'FOV RL'),3)+'\n')
+    outfile.write ('.    Water Fat shift [pixels]           :   '+format_number(find_info(series, 'Water Fat Shift'),3)+'\n')
+    outfile.write ('.    Angulation midslice(ap,fh,rl)[degr]:   '+format_number(find_info(series, 'Angulation AP'),3)+'  '+format_number(find_info(series, 'Angulation FH'),3)+'  '+format_number(find_info(series, 'Angulation RL'),3)+'\n')
+    outfile.write ('.    Off Centre midslice(ap,fh,rl) [mm] :   '+format_number(find_info(series, 'Off Center AP'),3)+'  '+format_number(find_info(series, 'Off Center FH'),3)+'  '+format_number(find_info(series, 'Off Center RL'),3)+'\n')
+    flowcomp=find_info(series, 'Flow Compensation')
     if flowcomp=='N': flowcomp='0';
     else: flowcomp='1'
     outfile.write ('.    Flow compensation <0=no 1=yes> ?   :   '+flowcomp+'\n')
-    presat=find_xml_seriesinfo (root, 'Presaturation')
+    presat=find_info(series, 'Presaturation')
     if presat=='N': presat='0';
     else: presat='1'
     outfile.write ('.    Presaturation     <0=no 1=yes> ?   :   '+presat+'\n')
-    dummy=str(find_xml_seriesinfo (root, 'Phase Encoding Velocity'))
+    dummy=str(find_info(series, 'Phase Encoding Velocity'))
     str1=dummy.split()[0]
     str2=dummy.split()[1]
     str3=dummy.split()[2]
     outfile.write ('.    Phase encoding velocity [cm/sec]   :   '+format_number(str1,6)+'  '+format_number(str2,6)+'  '+format_number(str3,6)+'\n')
-    mtc=find_xml_seriesinfo (root, 'MTC')
+    mtc=find_info(series, 'MTC')
     if mtc=='N': mtc='0';
     else: mtc='1'
     outfile.write ('.    MTC               <0=no 1=yes> ?   :   '+mtc+'\n')
-    spir=find_xml_seriesinfo (root, 'SPIR')
+    spir=find_info(series, 'SPIR')
     if spir=='N': spir='0';
     else: spir='1'
     outfile.write ('.    SPIR              <0=no 1=yes> ?   :   '+spir+'\n')
-    outfile.write ('.    EPI factor        <0,1=no EPI>     :   '+find_xml_seriesinfo (root, 'EPI factor')+'\n')
-    dyn=find_xml_seriesinfo (root, 'Dynamic Scan')
+    outfile.write ('.    EPI factor        <0,1=no EPI>     :   '+find_info(series, 'EPI factor')+'\n')
+    dyn=find_info(series, 'Dynamic Scan')
     if dyn=='N': dyn='0';
     else: dyn='1'
     outfile.write ('.    Dynamic scan      <0=no 1=yes> ?   :   '+dyn+'\n')
-    diff=find_xml_seriesinfo (root, 'Diffusion')
+    diff=find_info(series, 'Diffusion')
     if diff=='N': diff='0';
     else: diff='1'
     outfile.write ('.    Diffusion         <0=no 1=yes> ?   :   '+diff+'\n')
-    outfile.write ('.    Diffusion echo time [ms]           :   '+format_number(find_xml_seriesinfo (root, 'Diffusion Echo Time'),4)+'\n')
-    outfile.write ('.    Max. number of diffusion values    :   '+find_xml_seriesinfo (root, 'Max No B Values')+'\n')
-    outfile.write ('.    Max. number of gradient orients    :   '+find_xml_seriesinfo (root, 'Max No Gradient Orients')+'\n')
-    outfile.write ('.    Number of label types   <0=no ASL> :   '+find_xml_seriesinfo (root, 'No Label Types')+'\n')
+    outfile.write ('.    Diffusion echo time [ms]           :   '+format_number(find_info(series, 'Diffusion Echo Time'),4)+'\n')
+    outfile.write ('.    Max. number of diffusion values    :   '+find_info(series, 'Max No B Values')+'\n')
+    outfile.write ('.    Max. number of gradient orients    :   '+find_info(series, 'Max No Gradient Orients')+'\n')
+    outfile.write ('.    Number of label types   <0=no ASL> :   '+find_info(series, 'No Label Types')+'\n')
 
     #write instructions
     outfile.write ('#\n')
@@ -266,101 +357,242 @@ def main_xml2par(input_file):
     outfile.write ('\n')
 
     #write frame data
-    End=False
-    index=0
-    while not End:
-        outfile.write (form_str_len(find_xml_imageinfo1 (root, 'Slice',index),4))
-        outfile.write (form_str_len(find_xml_imageinfo1 (root, 'Echo',index),4))
-        outfile.write (form_str_len(find_xml_imageinfo1 (root, 'Dynamic',index),5))
-        outfile.write (form_str_len(find_xml_imageinfo1 (root, 'Phase',index),3))
-        type=find_xml_imageinfo1 (root, 'Type',index)
+    for info in series_info:
+        outfile.write (form_str_len(find_info(info, 'Slice'),4))
+        outfile.write (form_str_len(find_info(info, 'Echo'),4))
+        outfile.write (form_str_len(find_info(info, 'Dynamic'),5))
+        outfile.write (form_str_len(find_info(info, 'Phase'),3))
+        type=find_info(info, 'Type')
         imagetypes = ['M','R','I','P','CR','T0','T1','T2', 'RHO','SPECTRO','DERIVED','ADC','RCBV','RCBF','MTT','TTP','FA','EADC','B0','DELAY','MAXRELENH','RELENH','MAXENH','WASHIN','WASHOUT','BREVENH','AREACURV','ANATOMIC','T_TEST','STD_DEVIATION','PERFUSION','T2_STAR','R2','R2_STAR','W','IP','OP','F','SPARE1','SPARE2']
         try: type=str(imagetypes.index(type))
         except: type='0'
         outfile.write (' '+type)
-        seq=find_xml_imageinfo1 (root, 'Sequence',index)
+        seq=find_info(info, 'Sequence')
         sequences = ['IR','SE','FFE','DERIVED','PCA','UNSPECIFIED','SPECTRO','SI']
         try: seq=str(sequences.index(seq))
         except: sequence='5'
         outfile.write (form_str_len(seq,2))
-        outfile.write (form_str_len(find_xml_imageinfo1 (root, 'Index',index),6))
-        outfile.write (form_str_len(find_xml_imageinfo2(root, 'Pixel Size',index),4))
-        outfile.write (form_str_len(format_number(find_xml_imageinfo2(root, 'Scan Percentage',index),0),6))
-        outfile.write (form_str_len(find_xml_imageinfo2(root, 'Resolution X',index),5))
-        outfile.write (form_str_len(find_xml_imageinfo2(root, 'Resolution Y',index),5))
-        outfile.write (form_str_len(format_number(find_xml_imageinfo2(root, 'Rescale Intercept',index),5),12))
-        outfile.write (form_str_len(format_number(find_xml_imageinfo2(root, 'Rescale Slope',index),5),10))
-        outfile.write (form_str_len(find_xml_imageinfo2(root, 'Scale Slope',index).replace('E','e'),13))
-        outfile.write (form_str_len(format_number(find_xml_imageinfo2(root, 'Window Center',index),0),6))
-        outfile.write (form_str_len(format_number(find_xml_imageinfo2(root, 'Window Width',index),0),6))
-        outfile.write (form_str_len(format_number(find_xml_imageinfo2(root, 'Angulation AP',index),2),7))
-        outfile.write (form_str_len(format_number(find_xml_imageinfo2(root, 'Angulation FH',index),2),7))
-        outfile.write (form_str_len(format_number(find_xml_imageinfo2(root, 'Angulation RL',index),2),7))
-        outfile.write (form_str_len(format_number(find_xml_imageinfo2(root, 'Offcenter AP',index),2),8))
-        outfile.write (form_str_len(format_number(find_xml_imageinfo2(root, 'Offcenter FH',index),2),8))
-        outfile.write (form_str_len(format_number(find_xml_imageinfo2(root, 'Offcenter RL',index),2),8))
-        outfile.write (form_str_len(format_number(find_xml_imageinfo2(root, 'Slice Thickness',index),3),7))
-        outfile.write (form_str_len(format_number(find_xml_imageinfo2(root, 'Slice Gap',index),3),7))
-        disp_orient = find_xml_imageinfo2(root, 'Display Orientation',index)
+        outfile.write (form_str_len(find_info(info, 'Index'),6))
+        outfile.write (form_str_len(find_info(info, 'Pixel Size'),4))
+        outfile.write (form_str_len(format_number(find_info(info, 'Scan Percentage'),0),6))
+        outfile.write (form_str_len(find_info(info, 'Resolution X'),5))
+        outfile.write (form_str_len(find_info(info, 'Resolution Y'),5))
+        outfile.write (form_str_len(format_number(find_info(info, 'Rescale Intercept'),5),12))
+        outfile.write (form_str_len(format_number(find_info(info, 'Rescale Slope'),5),10))
+        outfile.write (form_str_len(find_info(info, 'Scale Slope').replace('E','e'),13))
+        outfile.write (form_str_len(format_number(find_info(info, 'Window Center'),0),6))
+        outfile.write (form_str_len(format_number(find_info(info, 'Window Width'),0),6))
+        outfile.write (form_str_len(format_number(find_info(info, 'Angulation AP'),2),7))
+        outfile.write (form_str_len(format_number(find_info(info, 'Angulation FH'),2),7))
+        outfile.write (form_str_len(format_number(find_info(info, 'Angulation RL'),2),7))
+        outfile.write (form_str_len(format_number(find_info(info, 'Offcenter AP'),2),8))
+        outfile.write (form_str_len(format_number(find_info(info, 'Offcenter FH'),2),8))
+        outfile.write (form_str_len(format_number(find_info(info, 'Offcenter RL'),2),8))
+        outfile.write (form_str_len(format_number(find_info(info, 'Slice Thickness'),3),7))
+        outfile.write (form_str_len(format_number(find_info(info, 'Slice Gap'),3),7))
+        disp_orient = find_info(info, 'Display Orientation')
         disp_orientations= ['NONE','RIGHT90','RIGHT180','LEFT90','VM','RIGHT90VM','RIGHT180VM','LEFT90VM']
         try: disp_orient=str(disp_orientations.index(disp_orient))
         except: disp_orient='0'
         outfile.write (form_str_len(disp_orient,2))
-        sl_orient = find_xml_imageinfo2(root, 'Slice Orientation',index)
+        sl_orient = find_info(info, 'Slice Orientation')
         sl_orient = sl_orient.lower()
         if sl_orient.find('tra')>=0: sl_orient='1'   # some issue here: what are the other possibilities
         elif sl_orient.find('sag')>=0: sl_orient='2' # some issue here: is that correct?
         elif sl_orient.find('cor')>=0: sl_orient='3' # some issue here: is that correct?
         else: sl_orient='0'
         outfile.write (form_str_len(sl_orient,2))
-        outfile.write (form_str_len(format_number(find_xml_imageinfo2(root, 'fMRI Status Indication',index),0),2))
-        type_ed_es = find_xml_imageinfo2(root, 'Image Type Ed Es',index)
+        outfile.write (form_str_len(format_number(find_info(info, 'fMRI Status Indication'),0),2))
+        type_ed_es = find_info(info, 'Image Type Ed Es')
         if type_ed_es.find('U')>=0: type_ed_es='2'
         elif type_ed_es.find('ED')>=0: type_ed_es='0'
         elif type_ed_es.find('ES')>=0: type_ed_es='1'
         else: type_ed_es='2'
         outfile.write (form_str_len(type_ed_es,2))
-        dummy=str(find_xml_imageinfo2(root, 'Pixel Spacing',index))
+        dummy=str(find_info(info, 'Pixel Spacing'))
         str1=dummy.split()[0]
         str2=dummy.split()[1]
         outfile.write (form_str_len(format_number(str1,3),7))
         outfile.write (form_str_len(format_number(str2,3),7))
-        outfile.write (form_str_len(format_number(find_xml_imageinfo2(root, 'Echo Time',index),2),7))
-        outfile.write (form_str_len(format_number(find_xml_imageinfo2(root, 'Dyn Scan Begin Time',index),2),8))
-        outfile.write (form_str_len(format_number(find_xml_imageinfo2(root, 'Trigger Time',index),2),9))
-        outfile.write (form_str_len(format_number(find_xml_imageinfo2(root, 'Diffusion B Factor',index),2),8))
-        outfile.write (form_str_len(format_number(find_xml_imageinfo2(root, 'No Averages',index),0),4))
-        outfile.write (form_str_len(format_number(find_xml_imageinfo2(root, 'Image Flip Angle',index),2),8))
-        outfile.write (form_str_len(format_number(find_xml_imageinfo2(root, 'Cardiac Frequency',index),0),6))
-        outfile.write (form_str_len(format_number(find_xml_imageinfo2(root, 'Min RR Interval',index),0),5))
-        outfile.write (form_str_len(format_number(find_xml_imageinfo2(root, 'Max RR Interval',index),0),5))
-        outfile.write (form_str_len(format_number(find_xml_imageinfo2(root, 'TURBO Factor',index),0),6))
-        outfile.write (form_str_len(format_number(find_xml_imageinfo2(root, 'Inversion Delay',index),1),6))
-        outfile.write (form_str_len(format_number(find_xml_imageinfo1 (root, 'BValue',index),0),3))
-        outfile.write (form_str_len(format_number(find_xml_imageinfo1 (root, 'Grad Orient',index),0),4))
-        contr=find_xml_imageinfo2(root, 'Contrast Type',index)
+        outfile.write (form_str_len(format_number(find_info(info, 'Echo Time'),2),7))
+        outfile.write (form_str_len(format_number(find_info(info, 'Dyn Scan Begin Time'),2),8))
+        outfile.write (form_str_len(format_number(find_info(info, 'Trigger Time'),2),9))
+        outfile.write (form_str_len(format_number(find_info(info, 'Diffusion B Factor'),2),8))
+        outfile.write (form_str_len(format_number(find_info(info, 'No Averages'),0),4))
+        outfile.write (form_str_len(format_number(find_info(info, 'Image Flip Angle'),2),8))
+        outfile.write (form_str_len(format_number(find_info(info, 'Cardiac Frequency'),0),6))
+        outfile.write (form_str_len(format_number(find_info(info, 'Min RR Interval'),0),5))
+        outfile.write (form_str_len(format_number(find_info(info, 'Max RR Interval'),0),5))
+        outfile.write (form_str_len(format_number(find_info(info, 'TURBO Factor'),0),6))
+        outfile.write (form_str_len(format_number(find_info(info, 'Inversion Delay'),1),6))
+        outfile.write (form_str_len(format_number(find_info(info, 'BValue'),0),3))
+        outfile.write (form_str_len(format_number(find_info(info, 'Grad Orient'),0),4))
+        contr=find_info(info, 'Contrast Type')
         contrasttypes = ['DIFFUSION','FLOW_ENCODED','FLUID_ATTENUATED','PERFUSION','PROTON_DENSITY','STIR','TAGGING','T1','T2','T2_STAR','TOF','UNKNOWN','MIXED']
         try: contr=str(contrasttypes.index(contr))
         except: contr='11'
         outfile.write (form_str_len(contr,5))
-        anis=find_xml_imageinfo2(root, 'Diffusion Anisotropy Type',index)
+        anis=find_info(info, 'Diffusion Anisotropy Type')
         if anis=='-': anis='0' # some issue here: what are the other possibilities
         outfile.write (form_str_len(anis,5))
-        outfile.write (form_str_len(format_number(find_xml_imageinfo2(root, 'Diffusion AP',index),3),8))
-        outfile.write (form_str_len(format_number(find_xml_imageinfo2(root, 'Diffusion FH',index),3),9))
-        outfile.write (form_str_len(format_number(find_xml_imageinfo2(root, 'Diffusion RL',index),3),9))
-        labletype=find_xml_imageinfo1 (root, 'Label Type',index)
+        outfile.write (form_str_len(format_number(find_info(info, 'Diffusion AP'),3),8))
+        outfile.write (form_str_len(format_number(find_info(info, 'Diffusion FH'),3),9))
+        outfile.write (form_str_len(format_number(find_info(info, 'Diffusion RL'),3),9))
+        labletype=find_info(info, 'Label Type')
         if labletype=='-': labletype='1'
         elif labletype.find('L')>=0: labletype='1'
         elif labletype.find('l')>=0: labletype='1'
         else: labletype='0'
         outfile.write (form_str_len(labletype,3))
         outfile.write ('\n')
-        index+=1
-        try: test = find_xml_imageinfo1 (root, 'Slice',index)
-        except: End=True
 
 
     outfile.write ('\n')
     outfile.write ('# === END OF DATA DESCRIPTION FILE ===============================================\n')
-    outfile.close()
\ No newline at end of file
+    outfile.close()
+
+#  ------------------- Batch conversion of a directory tree ----------------
+
+# state of the batch conversion, at the top of the converted tree:
+# XML path (relative) -> size, mtime and sha256 of the XML when converted
+STATE_FILE = '.xml2par.json'
+
+
+def file_sha256(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        for block in iter(lambda: handle.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def find_xml_files(root_dir):
+    # every .xml/.XML of the tree, sorted for a reproducible order; absolute
+    # paths, the dataset name of the PAR ending at the first '.'
+    found = []
+    for dirpath, dirnames, filenames in os.walk(os.path.abspath(root_dir)):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1].lower() == '.xml':
+                found.append(os.path.join(dirpath, filename))
+    return found
+
+
+def convert_if_needed(input_file, known=None, force=False):
+    # convert input_file unless its PAR is up to date; known is its entry of
+    # the state file. The PAR is up to date if it exists and either the XML
+    # size/mtime are those recorded, or the XML content is the one recorded
+    # (touched or copied file), or, without record, the PAR is newer than
+    # the XML. Returns (status, entry, bytes, seconds), status being
+    # 'converted', 'skipped' or the error message
+    start = time.perf_counter()
+    stat = os.stat(input_file)
+    entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    output_file = os.path.splitext(input_file)[0]+'.PAR'
+    par_exists = os.path.exists(output_file)
+    if par_exists and not force:
+        if known and known.get('size') == entry['size'] \
+                and known.get('mtime_ns') == entry['mtime_ns']:
+            return 'skipped', known, 0, time.perf_counter()-start
+        if known and known.get('size') == entry['size']:
+            entry['sha256'] = file_sha256(input_file)
+            if entry['sha256'] == known.get('sha256'):
+                return 'skipped', entry, 0, time.perf_counter()-start
+        elif not known \
+                and os.stat(output_file).st_mtime_ns >= entry['mtime_ns']:
+            entry['sha256'] = file_sha256(input_file)
+            return 'skipped', entry, 0, time.perf_counter()-start
+    try:
+        main_xml2par(input_file)
+    except Exception as error:
+        return '%s: %s' % (type(error).__name__, error), None, 0, \
+            time.perf_counter()-start
+    if 'sha256' not in entry:
+        entry['sha256'] = file_sha256(input_file)
+    return 'converted', entry, entry['size'], time.perf_counter()-start
+
+
+def load_state(root_dir):
+    try:
+        with open(os.path.join(root_dir, STATE_FILE)) as state_file:
+            return json.load(state_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(root_dir, state):
+    # same temporary file and rename as the PAR files
+    state_path = os.path.join(root_dir, STATE_FILE)
+    tmp_file = state_path+'.'+uuid.uuid4().hex+'.tmp'
+    with open(tmp_file, 'w') as state_file:
+        json.dump(state, state_file, indent=1, sort_keys=True)
+    os.replace(tmp_file, state_path)
+
+
+def batch_xml2par(root_dir, jobs=None, force=False):
+    # convert every XML of the tree lacking an up-to-date PAR with a pool of
+    # jobs processes (default: one per core), print a throughput summary.
+    # Returns the number of failed conversions
+    start = time.perf_counter()
+    input_files = find_xml_files(root_dir)
+    state = load_state(root_dir)
+    counts = {'converted': 0, 'skipped': 0, 'failed': 0}
+    converted_bytes = 0
+    busy = 0.0
+    jobs = jobs or os.cpu_count() or 1
+    relative = [os.path.relpath(path, root_dir) for path in input_files]
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        results = executor.map(
+            convert_if_needed, input_files,
+            [state.get(name) for name in relative],
+            [force]*len(input_files),
+            chunksize=max(1, len(input_files)//(4*jobs)))
+        for name, (status, entry, size, seconds) in zip(relative, results):
+            busy += seconds
+            if status in ('converted', 'skipped'):
+                counts[status] += 1
+                state[name] = entry
+                converted_bytes += size
+            else:
+                counts['failed'] += 1
+                state.pop(name, None)
+                print('Failed %s: %s' % (name, status))
+    # forget the XML files that were removed
+    for name in set(state) - set(relative):
+        del state[name]
+    save_state(root_dir, state)
+
+    elapsed = time.perf_counter()-start
+    rate = counts['converted']/elapsed if elapsed else 0.0
+    print('%d XML files: %d converted, %d up to date, %d failed'
+          % (len(input_files), counts['converted'], counts['skipped'],
+             counts['failed']))
+    print('%.2f s with %d processes: %.1f files/s, %.1f MB/s of XML, '
+          '%.0f%% pool use'
+          % (elapsed, jobs, rate,
+             converted_bytes/1e6/elapsed if elapsed else 0.0,
+             100*busy/(jobs*elapsed) if elapsed else 0.0))
+    return counts['failed']
+
+
+def main_batch_xml2par():
+    parser = argparse.ArgumentParser(
+        description='Convert the PRIDE XML files of a directory tree (or a '
+                    'single XML file) to PAR')
+    parser.add_argument('path', help='Directory tree or XML file')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='Worker processes (default: one per core)')
+    parser.add_argument('--force', action='store_true',
+                        help='Convert even the XML files with an up-to-date PAR')
+    args = parser.parse_args()
+    if os.path.isfile(args.path):
+        main_xml2par(args.path)
+        return
+    if batch_xml2par(args.path, args.jobs, args.force):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    # needed by the process pool in the PyInstaller executable (xml2par.spec)
+    multiprocessing.freeze_support()
+    main_batch_xml2par()
@@ -0,0 +1,78 @@
+"""
+    Header-only reading of the PRIDE XML files: general_info and series_info
+    without the REC pixel data, for the XML/REC used as geometry templates
+
+    Main functions:
+        - read_xml_header
+
+    ----- LICENSE -----
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License (GPL) as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version. For more detail see the
+    GNU General Public License at <http://www.gnu.org/licenses/>.
+    -----------------
+
+    Developed by A. Delphin, E. Gourieux, J. Pietras, L. Lamalle
+    May 2024
+"""
+
+import xml.etree.ElementTree as ET
+import numpy as np
+
+# conversion of the attribute text according to its XML Type
+TYPES = {
+    "Int16": int,
+    "Int32": int,
+    "UInt16": int,
+    "UInt32": int,
+    "Float": float,
+    "Double": float,
+    "Boolean": lambda text: text == "Y",
+}
+
+
+def _attribute(element):
+    """Header entry of an Attribute element: its XML attributes and Value"""
+    info = {name: value for name, value in element.attrib.items()
+            if name != "Name"}
+    convert = TYPES.get(element.get("Type"), str)
+    text = (element.text or "").strip()
+    if "ArraySize" in element.attrib:
+        info["Value"] = np.array([convert(value) for value in text.split()])
+    elif text:
+        info["Value"] = convert(text)
+    else:
+        info["Value"] = text
+    return info
+
+
+def read_xml_header(path_to_xml):
+    """
+    Read the header of a PRIDE XML file, streaming the file (the elements
+    are freed once read) and without opening the REC file
+
+        Parameters:
+            path_to_xml (a string): XML file path
+        Returns:
+            general_info (a dictionary): Series_Info attributes,
+                                         name -> {"Value": ..., "Type": ...}
+            series_info (a list): one dictionary per Image_Info (Key
+                                  attributes included), as general_info
+    """
+    general_info = {}
+    series_info = []
+    image_info = None
+    for event, element in ET.iterparse(path_to_xml, events=("start", "end")):
+        if event == "start":
+            if element.tag == "Image_Info":
+                image_info = {}
+            continue
+        if element.tag == "Attribute":
+            target = general_info if image_info is None else image_info
+            target[element.get("Name")] = _attribute(element)
+        elif element.tag == "Image_Info":
+            series_info.append(image_info)
+            image_info = None
+        element.clear()
+    return general_info, series_info
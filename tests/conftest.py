@@ -0,0 +1,59 @@
+"""
+    Test configuration: the modules of segment-from-pride and the synthetic
+    PRIDE exports of the benchmarks are importable, with the xmlrec
+    stand-in of the benchmarks when the Philips xmlrec.py is not there
+
+    python -m pytest tests
+
+    ----- LICENSE -----
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License (GPL) as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version. For more detail see the
+    GNU General Public License at <http://www.gnu.org/licenses/>.
+    -----------------
+
+    Developed by A. Delphin, E. Gourieux, J. Pietras, L. Lamalle
+    May 2024
+"""
+
+import os
+import sys
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+ROOT_DIR = os.path.dirname(TESTS_DIR)
+REFERENCE_DIR = os.path.join(TESTS_DIR, "reference")
+sys.path.insert(0, os.path.join(ROOT_DIR, "benchmarks"))
+sys.path.insert(0, os.path.join(ROOT_DIR, "segment-from-pride"))
+sys.path.append(os.path.join(ROOT_DIR, "benchmarks", "standin"))
+
+# voxels along each axis of the synthetic exports
+EXPORT_SIZE = 24
+
+
+@pytest.fixture(scope="session")
+def export_dir(tmp_path_factory):
+    """Synthetic PRIDE export (Sag, Cor and Tra), see benchmarks/synthetic.py"""
+    from synthetic import make_export
+
+    return make_export(str(tmp_path_factory.mktemp("export")), EXPORT_SIZE)
+
+
+@pytest.fixture
+def sag_xml(export_dir, tmp_path):
+    """Copy of the sagittal XML of export_dir in an empty directory"""
+    import shutil
+
+    path_to_xml = os.path.join(str(tmp_path), "IM_Sag.XML")
+    shutil.copyfile(os.path.join(export_dir, "Sag", "IM_Sag.XML"), path_to_xml)
+    return path_to_xml
+
+
+@pytest.fixture
+def umask():
+    """Umask 022 during the test (files 0644, directories 0755)"""
+    previous = os.umask(0o022)
+    yield 0o022
+    os.umask(previous)
@@ -0,0 +1,60 @@
+"""
+    Batch pipeline: the segmentations of the cases run at the same time
+"""
+
+import threading
+
+import batch
+from backends import Backend
+
+
+class _MeetingBackend(Backend):
+    """Each job waits for another job to run at the same time"""
+
+    def __init__(self, jobs):
+        super().__init__("meeting", jobs)
+        self.barrier = threading.Barrier(2, timeout=5)
+
+    def _run(self, job, log, cancel, usage):
+        self.barrier.wait()
+        return job.nifti_path
+
+
+def test_concurrent_segment_calls_overlap():
+    backend = _MeetingBackend(1)
+    backend.reserve(2)
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda name: results.append(backend.segment(name)),
+            args=(name,),
+        )
+        for name in ("a.nii", "b.nii")
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(results) == ["a.nii", "b.nii"]
+
+
+def test_batch_segmentations_overlap(tmp_path, monkeypatch):
+    def prepare_case(input_dir_path, *args):
+        return {"nifti_path": input_dir_path, "timings": {}}
+
+    def segment_case(state, cache_dir, cache_max_size, backend, **kwargs):
+        backend.segment(state["nifti_path"])
+
+    monkeypatch.setattr(batch, "prepare_case", prepare_case)
+    monkeypatch.setattr(batch, "segment_case", segment_case)
+    monkeypatch.setattr(batch, "finish_case", lambda *args: None)
+    cases = [
+        {"input": name, "study": "study", "patient": name, "labels": None}
+        for name in ("a", "b")
+    ]
+    # Jobs 1 in the configuration, 2 segmentations in the batch
+    summaries = batch.run_batch(
+        cases, str(tmp_path), [181], segmentation_jobs=2,
+        options={"backend": _MeetingBackend(1)},
+    )
+    assert [summary["status"] for summary in summaries] == ["ok", "ok"]
@@ -0,0 +1,46 @@
+"""
+    Segmentation cache: hits and least recently used eviction
+"""
+
+import os
+
+import pytest
+
+from cache import cache_segmentation, get_cached_segmentation
+
+
+def _segmentation(path, size):
+    with open(path, "wb") as seg_file:
+        seg_file.write(b"\0" * size)
+    return str(path)
+
+
+@pytest.mark.parametrize("max_size", [0, None])
+def test_no_cap_keeps_entries(tmp_path, max_size):
+    cache_dir = str(tmp_path / "cache")
+    for key in ("a", "b"):
+        seg_path = _segmentation(tmp_path / f"{key}.nii.gz", 1000)
+        cache_segmentation(cache_dir, key, seg_path, max_size)
+    for key in ("a", "b"):
+        out_path = str(tmp_path / f"out_{key}.nii.gz")
+        assert get_cached_segmentation(cache_dir, key, out_path)
+        assert os.path.getsize(out_path) == 1000
+
+
+def test_cap_evicts_least_recently_used(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    for index, key in enumerate(("a", "b", "c")):
+        seg_path = _segmentation(tmp_path / f"{key}.nii.gz", 1000)
+        cache_segmentation(cache_dir, key, seg_path, 2500)
+        os.utime(os.path.join(cache_dir, key), (index, index))
+    out_path = str(tmp_path / "out.nii.gz")
+    assert not get_cached_segmentation(cache_dir, "a", out_path)
+    assert get_cached_segmentation(cache_dir, "b", out_path)
+    assert get_cached_segmentation(cache_dir, "c", out_path)
+
+
+def test_entries_get_umask_permissions(tmp_path, umask):
+    cache_dir = str(tmp_path / "cache")
+    seg_path = _segmentation(tmp_path / "a.nii.gz", 10)
+    cache_segmentation(cache_dir, "a", seg_path, 0)
+    assert os.stat(os.path.join(cache_dir, "a")).st_mode & 0o777 == 0o755
@@ -0,0 +1,83 @@
+"""
+    Cluster spool: expired leases are requeued with one rename, then failed
+"""
+
+import json
+import os
+
+import cluster
+
+
+def _expire(spool_dir):
+    """Take the waiting job as a worker and let its lease expire"""
+    running_path = cluster._claim(spool_dir, "node-1")
+    os.utime(running_path, (0, 0))
+    return running_path
+
+
+def test_expired_job_requeued_then_failed(tmp_path):
+    spool_dir = str(tmp_path)
+    case = {"input": "case", "study": "study", "patient": "patient",
+            "labels": None}
+    job_id = cluster.submit_case(spool_dir, case, [181])
+
+    for attempts in range(1, cluster.MAX_ATTEMPTS):
+        _expire(spool_dir)
+        assert cluster.requeue_expired(spool_dir) == [job_id]
+        assert os.listdir(tmp_path / "jobs") == [f"{job_id}~{attempts}.json"]
+        assert os.listdir(tmp_path / "running") == []
+
+    running_path = _expire(spool_dir)
+    assert cluster.requeue_expired(spool_dir) == [job_id]
+    assert not os.path.exists(running_path)
+    assert os.listdir(tmp_path / "jobs") == []
+    with open(tmp_path / "done" / f"{job_id}.json", encoding="utf-8") as done:
+        result = json.load(done)
+    assert result["status"] == "error"
+    assert result["attempts"] == cluster.MAX_ATTEMPTS
+    assert result["patient"] == "patient"
+
+
+def test_live_lease_kept(tmp_path):
+    spool_dir = str(tmp_path)
+    case = {"input": "case", "study": "study", "patient": "patient",
+            "labels": None}
+    cluster.submit_case(spool_dir, case, [181])
+    cluster._claim(spool_dir, "node-1")
+    assert cluster.requeue_expired(spool_dir) == []
+    assert cluster.spool_status(spool_dir)["running"] == 1
+
+
+def test_stalled_publication_failed(tmp_path):
+    spool_dir = str(tmp_path)
+    case = {"input": "case", "study": "study", "patient": "patient",
+            "labels": None}
+    job_id = cluster.submit_case(spool_dir, case, [181])
+    running_path = cluster._claim(spool_dir, "node-1")
+    # node stopped between taking the job out of running/ and writing
+    # its result
+    publishing_path = tmp_path / "done" / f"{job_id}.publishing"
+    os.rename(running_path, publishing_path)
+    assert cluster.spool_status(spool_dir)["publishing"] == 1
+    assert cluster.requeue_expired(spool_dir) == []
+
+    os.utime(publishing_path, (0, 0))
+    assert cluster.requeue_expired(spool_dir) == [job_id]
+    results = cluster.wait_cases(spool_dir, [job_id], timeout=0)
+    assert results[job_id]["status"] == "error"
+    status = cluster.spool_status(spool_dir)
+    assert (status["publishing"], status["done"]) == (0, 1)
+
+
+def test_result_published(tmp_path):
+    spool_dir = str(tmp_path)
+    case = {"input": "case", "study": "study", "patient": "patient",
+            "labels": None}
+    job_id = cluster.submit_case(spool_dir, case, [181])
+    running_path = cluster._claim(spool_dir, "node-1")
+    assert cluster._publish(spool_dir, running_path,
+                            {"id": job_id, "status": "ok"})
+    assert os.listdir(tmp_path / "done") == [f"{job_id}.json"]
+    # requeued meanwhile by another node: not published
+    assert not cluster._publish(spool_dir, running_path,
+                                {"id": job_id, "status": "ok"})
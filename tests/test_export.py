@@ -0,0 +1,60 @@
+"""
+    Export stage: skipped when up to date, run again when the labels or the
+    dtypes change
+"""
+
+import os
+
+import nibabel as nib
+import numpy as np
+import pytest
+
+import functions
+from checkpoint import StageManifest
+from conftest import EXPORT_SIZE
+
+LABELS = [181, 185]
+
+
+@pytest.fixture
+def case(export_dir, tmp_path):
+    """Case of the synthetic export as left by prepare_case/segment_case"""
+    seg_path = str(tmp_path / "native_structures_IM_Sag.nii.gz")
+    rng = np.random.default_rng(0)
+    nib.Nifti1Image(
+        rng.choice([0, 181, 185, 4], size=(EXPORT_SIZE,) * 3)
+        .astype(np.uint16),
+        np.eye(4),
+    ).to_filename(seg_path)
+    case = {
+        "input_dir_path": export_dir,
+        "output_path": str(tmp_path),
+        "path_to_xml": os.path.join(export_dir, "Sag", "IM_Sag.XML"),
+        "checkpoints": StageManifest(str(tmp_path)),
+        "segmentation_inputs": [os.path.join(export_dir, "Sag", "IM_Sag.REC")],
+        "path_to_rois": [seg_path],
+        "timings": {},
+    }
+    functions._load_templates(case)
+    return case
+
+
+def _exported(case, monkeypatch, labels, dtypes):
+    """True if finish_case ran the export (False: up to date)"""
+    loads = []
+    load_sagittal = functions._load_sagittal
+    monkeypatch.setattr(
+        functions, "_load_sagittal",
+        lambda *args: loads.append(args) or load_sagittal(*args)
+    )
+    functions.finish_case(case, labels, dtypes)
+    return bool(loads)
+
+
+def test_export_rerun_on_dtype_change(case, monkeypatch):
+    float32 = {"Image": "float32", "Labels": "uint16"}
+    assert _exported(case, monkeypatch, LABELS, float32)
+    assert not _exported(case, monkeypatch, LABELS, float32)
+    assert not _exported(case, monkeypatch, LABELS, {"Image": np.float32})
+    assert _exported(case, monkeypatch, LABELS, {"Image": "float64"})
+    assert _exported(case, monkeypatch, LABELS[:1], {"Image": "float64"})
@@ -0,0 +1,59 @@
+"""
+    Masked image of mask_volume compared with the masking of the first
+    release (float64), exact in float64 and within one REC value with the
+    dtypes of the configuration
+"""
+
+import json
+import os
+
+import numpy as np
+import pytest
+
+import xmlrec
+from baseline_masking import mask_baseline
+from bench import rec_difference
+from conftest import ROOT_DIR
+from functions import DTYPES, mask_volume
+
+LABELS = [181, 185, 201, 207]
+
+
+@pytest.fixture(scope="module")
+def volumes(export_dir):
+    """Image of the synthetic export and a label volume inside its box"""
+    images, general_info, series_info = xmlrec.read_xmlrec(
+        os.path.join(export_dir, "Sag", "IM_Sag.XML")
+    )
+    in_array = np.squeeze(xmlrec.to_nd_array(images, general_info, series_info))
+    rng = np.random.default_rng(0)
+    seg_array = np.zeros(in_array.shape, dtype=np.uint16)
+    seg_array[4:-5, 3:-6, 6:-2] = rng.choice(
+        LABELS + [0, 4, 17, 182], size=seg_array[4:-5, 3:-6, 6:-2].shape
+    )
+    return in_array.astype(np.float64), seg_array, series_info
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_float64_identical_to_first_release(volumes, workers):
+    in_array, seg_array, series_info = volumes
+    expected = mask_baseline(
+        in_array, seg_array.astype(np.float64), LABELS, series_info
+    )
+    result = mask_volume(
+        in_array, seg_array, LABELS, series_info, np.float64, workers
+    )
+    assert result.dtype == np.float64
+    assert np.array_equal(result, expected)
+
+
+def _configured_dtypes():
+    with open(os.path.join(ROOT_DIR, "config", "config.json"),
+              encoding="utf-8") as my_json:
+        return {**DTYPES, **json.load(my_json).get("Dtypes", {})}
+
+
+@pytest.mark.parametrize("dtypes", [DTYPES, _configured_dtypes()])
+def test_configured_dtypes_within_one_rec_value(volumes, dtypes):
+    check = rec_difference(*volumes[:2], LABELS, volumes[2], dtypes)
+    assert check["max_difference"] <= 1
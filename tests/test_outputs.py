@@ -0,0 +1,53 @@
+"""
+    The XML/REC sent back to the console are written by xmlrec, with the
+    Cor and Tra headers read by xmlrec
+"""
+
+import numpy as np
+
+import xmlrec
+from functions import _load_templates, write_outputs
+from geometry import AXES, reorient
+
+
+def test_outputs_written_by_xmlrec(monkeypatch, tmp_path):
+    calls = []
+    monkeypatch.setattr(
+        xmlrec, "write_xmlrec",
+        lambda *args: calls.append(args)
+    )
+    volume = np.arange(4 * 5 * 6, dtype=np.float32).reshape(4, 5, 6)
+    outputs = []
+    for orientation in ("Sagittal", "Coronal", "Transversal"):
+        general_info = {"Protocol Name": {"Value": "T1W_3D"}}
+        series_info = [{"Slice": {"Value": 1}}]
+        view = reorient(volume, AXES["Sagittal"], AXES[orientation])
+        outputs.append((orientation, view, general_info, series_info))
+    write_outputs(str(tmp_path), outputs)
+
+    assert [call[0] for call in calls] == [
+        str(tmp_path / (orientation + "_masked.xml"))
+        for orientation, *_ in outputs
+    ]
+    for (_, view, general_info, series_info), call in zip(outputs, calls):
+        assert call[1] is general_info and call[2] is series_info
+        assert general_info["Protocol Name"]["Value"] == "T1W_3D_Seg"
+        assert call[3].flags["C_CONTIGUOUS"]
+        assert np.array_equal(call[3], view)
+
+
+def test_templates_read_by_xmlrec(monkeypatch, export_dir):
+    headers = {}
+
+    def read_xmlrec(path_to_xml):
+        headers[path_to_xml] = ({"Protocol Name": {}}, [{}])
+        return None, *headers[path_to_xml]
+    monkeypatch.setattr(xmlrec, "read_xmlrec", read_xmlrec)
+    case = {"input_dir_path": export_dir}
+    _load_templates(case)
+
+    assert sorted(case["templates"]) == ["Cor", "Tra"]
+    for path_to_xml, header in case["templates"].values():
+        general_info, series_info = header.result()
+        assert general_info is headers[path_to_xml][0]
+        assert series_info is headers[path_to_xml][1]
@@ -0,0 +1,75 @@
+"""
+    Watch-folder daemon: failed cases and export of the results
+"""
+
+import os
+import queue
+import threading
+
+import watcher
+
+
+def _run_queue(tmp_path, monkeypatch, processing):
+    monkeypatch.setattr(watcher, "main_processing", processing)
+    xmlrec_out = tmp_path / "xmlrec_out"
+    xmlrec_out.mkdir()
+    state = {}
+    queued_digests = {"digest"}
+    jobs = queue.Queue()
+    threading.Thread(
+        target=watcher._process_queue,
+        args=(jobs, str(tmp_path / "out"), "study", [181], str(xmlrec_out),
+              {}, state, str(tmp_path / "state.json"), threading.Lock(),
+              queued_digests),
+        daemon=True,
+    ).start()
+    jobs.put((str(tmp_path / "patient"), "digest"))
+    jobs.join()
+    return state, queued_digests, xmlrec_out
+
+
+def test_failed_case_can_be_queued_again(tmp_path, monkeypatch):
+    def processing(*args, **kwargs):
+        raise RuntimeError("segmentation failed")
+
+    state, queued_digests, _ = _run_queue(tmp_path, monkeypatch, processing)
+    assert state == {}
+    assert "digest" not in queued_digests
+
+
+def test_results_exported(tmp_path, monkeypatch):
+    def processing(case_dir, case_out_directory, labels, **options):
+        results_dir = os.path.join(case_out_directory, "results_to_export")
+        os.makedirs(results_dir)
+        for name in ("IM_Sag_Seg.XML", "IM_Sag_Seg.REC"):
+            with open(os.path.join(results_dir, name), "w") as my_file:
+                my_file.write(name)
+
+    state, _, xmlrec_out = _run_queue(tmp_path, monkeypatch, processing)
+    assert "digest" in state
+    assert sorted(os.listdir(xmlrec_out)) == [
+        "IM_Sag_Seg.REC", "IM_Sag_Seg.XML"
+    ]
+    assert (xmlrec_out / "IM_Sag_Seg.XML").read_text() == "IM_Sag_Seg.XML"
+
+
+def _export(case_dir, orientations):
+    for orientation in orientations:
+        orientation_dir = case_dir / orientation
+        orientation_dir.mkdir(parents=True)
+        for extension in ("XML", "REC"):
+            (orientation_dir / f"IM_{orientation}.{extension}").write_text("")
+
+
+def test_case_needs_three_exports(tmp_path):
+    _export(tmp_path, ["Sag"])
+    assert watcher.case_snapshot(str(tmp_path)) is None
+    assert len(watcher.case_snapshot(str(tmp_path), sagittal_only=True)) == 2
+    _export(tmp_path, ["Cor", "Tra"])
+    assert len(watcher.case_snapshot(str(tmp_path))) == 6
+
+
+def test_sagittal_only_waits_for_started_exports(tmp_path):
+    _export(tmp_path, ["Sag"])
+    (tmp_path / "Cor").mkdir()
+    assert watcher.case_snapshot(str(tmp_path), sagittal_only=True) is None
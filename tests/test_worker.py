@@ -0,0 +1,109 @@
+"""
+    Warm segmentation worker: configuration checks and restarts
+"""
+
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+import worker
+from backends import backend_from_config
+
+
+def test_worker_needs_a_command(tmp_path):
+    with pytest.raises(ValueError):
+        worker.start_worker(str(tmp_path), "volbrain/assemblynet:1.0.0")
+    with pytest.raises(ValueError):
+        backend_from_config({"SegmentationWorker": {"Spool": str(tmp_path)}})
+    with pytest.raises(ValueError):
+        worker.serve(str(tmp_path))
+
+
+@pytest.mark.parametrize("command", ["null", "[]", '"pipeline"'])
+def test_main_worker_rejects_empty_command(tmp_path, monkeypatch, command):
+    monkeypatch.setattr(
+        sys, "argv", ["worker.py", str(tmp_path), "--command", command]
+    )
+    with pytest.raises(SystemExit):
+        worker.main_worker()
+
+
+def test_fake_restart_stops_previous_worker(tmp_path):
+    spool_dir = str(tmp_path)
+    pid_path = os.path.join(spool_dir, worker.PID_FILE)
+    worker.start_worker(spool_dir)
+    with open(pid_path, encoding="utf-8") as pid_file:
+        first_pid = int(pid_file.read())
+    try:
+        worker.start_worker(spool_dir)
+        assert not worker._pid_alive(first_pid)
+    finally:
+        worker.stop_fake_worker(spool_dir)
+    assert not os.path.exists(pid_path)
+
+
+def test_spool_tag_follows_the_segmenter(tmp_path):
+    def tag(worker_settings, backend_settings=None):
+        return backend_from_config({
+            "SegmentationBackend": backend_settings or {},
+            "SegmentationWorker": {"Spool": str(tmp_path), **worker_settings},
+        }).tag
+
+    real = tag({"Command": ["pipeline", "{input}"]})
+    assert tag({"Fake": True}) != real
+    assert tag({"Command": ["pipeline2", "{input}"]}) != real
+    assert tag({"Command": ["pipeline", "{input}"]},
+               {"Image": "volbrain/assemblynet:1.0.1"}) != real
+    assert tag({"Fake": True}, {"Tag": "segmenter v2"}) == "segmenter v2"
+
+
+def _nifti(tmp_path):
+    nifti_path = tmp_path / "case" / "IM_Sag.nii"
+    nifti_path.parent.mkdir()
+    nifti_path.write_bytes(b"")
+    return str(nifti_path)
+
+
+def test_job_without_result_times_out(tmp_path, monkeypatch):
+    spool_dir = str(tmp_path / "spool")
+    # a worker that looks alive and never takes the job
+    monkeypatch.setattr(worker, "worker_alive", lambda spool_dir: True)
+    with pytest.raises(RuntimeError, match="no result"):
+        worker.segment_warm(_nifti(tmp_path), spool_dir, timeout=0.5)
+    assert os.listdir(os.path.join(spool_dir, "jobs")) == []
+    assert os.listdir(os.path.join(spool_dir, "data")) == []
+
+
+def test_dead_worker_restarted_a_bounded_number_of_times(tmp_path,
+                                                         monkeypatch):
+    starts = []
+    monkeypatch.setattr(worker, "start_worker",
+                        lambda *args: starts.append(args))
+    with pytest.raises(RuntimeError, match="restarted"):
+        worker.segment_warm(_nifti(tmp_path), str(tmp_path / "spool"))
+    assert len(starts) == 1 + worker.MAX_RESTARTS
+
+
+def test_concurrent_restarts_serialized(tmp_path, monkeypatch):
+    spool_dir = str(tmp_path)
+    starts = []
+
+    def start_worker(spool_dir, image, command):
+        starts.append(spool_dir)
+        time.sleep(0.3)
+        with open(os.path.join(spool_dir, "heartbeat"), "w") as heartbeat:
+            heartbeat.write("")
+    monkeypatch.setattr(worker, "start_worker", start_worker)
+    threads = [
+        threading.Thread(target=worker._ensure_worker,
+                         args=(spool_dir, None, None))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert starts == [spool_dir]
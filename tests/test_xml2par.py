@@ -0,0 +1,91 @@
+"""
+    PAR files of xml2par compared with those of the first release, and
+    PAR files written from typed headers compared with those written from
+    the XML text
+"""
+
+import importlib.util
+import os
+
+import numpy as np
+import pytest
+
+from conftest import REFERENCE_DIR
+from xml2par import STATE_FILE, main_xml2par, main_xmlrec2par, save_state
+from xmlheader import read_xml_header
+
+
+def _baseline_xml2par():
+    """xml2par.py as first released (tests/reference)"""
+    spec = importlib.util.spec_from_file_location(
+        "xml2par_baseline", os.path.join(REFERENCE_DIR, "xml2par_baseline.py")
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _par_bytes(path_to_xml):
+    """Bytes of the PAR written next to path_to_xml, removed once read"""
+    path_to_par = os.path.splitext(path_to_xml)[0] + ".PAR"
+    with open(path_to_par, "rb") as par_file:
+        content = par_file.read()
+    os.remove(path_to_par)
+    return content
+
+
+def test_par_identical_to_first_release(sag_xml):
+    _baseline_xml2par().main_xml2par(sag_xml)
+    expected = _par_bytes(sag_xml)
+    main_xml2par(sag_xml)
+    assert _par_bytes(sag_xml) == expected
+
+
+def _retyped(header, convert):
+    """Copy of a header with convert applied to every number"""
+    general_info, series_info = header
+
+    def retype(info):
+        return {
+            name: {**entry, "Value": entry["Value"]
+                   if isinstance(entry["Value"], (str, bool))
+                   else convert(entry["Value"])}
+            for name, entry in info.items()
+        }
+    return retype(general_info), [retype(info) for info in series_info]
+
+
+# types a reader of the XML may give to the header values
+TYPINGS = {
+    "xml types": lambda value: value,
+    "numpy float64": lambda value: np.asarray(value, dtype=np.float64)[()],
+    "numpy float32": lambda value: np.asarray(value, dtype=np.float32)[()],
+    "python float": lambda value: np.asarray(value, dtype=float).tolist(),
+}
+
+
+@pytest.mark.parametrize("typing", TYPINGS)
+def test_typed_par_identical_to_xml(sag_xml, typing):
+    main_xml2par(sag_xml)
+    expected = _par_bytes(sag_xml)
+    main_xmlrec2par(
+        sag_xml, *_retyped(read_xml_header(sag_xml), TYPINGS[typing])
+    )
+    assert _par_bytes(sag_xml) == expected
+
+
+def test_scale_slope_as_in_xml(sag_xml):
+    with open(sag_xml, encoding="utf-8") as xml_file:
+        assert ">1.20000E-02</Attribute>" in xml_file.read()
+    main_xml2par(sag_xml)
+    assert b" 1.20000e-02" in _par_bytes(sag_xml)
+
+
+def test_files_get_umask_permissions(sag_xml, tmp_path, umask):
+    main_xml2par(sag_xml)
+    path_to_par = os.path.splitext(sag_xml)[0] + ".PAR"
+    assert os.stat(path_to_par).st_mode & 0o777 == 0o644
+    save_state(str(tmp_path), {})
+    assert os.stat(tmp_path / STATE_FILE).st_mode & 0o777 == 0o644
+    assert not [name for name in os.listdir(tmp_path)
+                if name.endswith(".tmp")]